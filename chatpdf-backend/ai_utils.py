@@ -2,15 +2,99 @@ import os
 import logging
 from openai import AzureOpenAI
 from dotenv import load_dotenv
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
+from similarity_utils import similitud_textos
 import json
+from llm_cache import CacheLLM
+from prompt_budget import (PRESUPUESTOS, Contexto, construir_prompt, contar_tokens, dividir_prompt, partes_contexto,
+                           prefijo_documento, recortar_tokens, seccion_fragmentos, seccion_indice,
+                           secciones_contexto)
+from provider_clients import crear_circuito, crear_cliente_http, crear_politica_reintentos
+from metrics import registrar_tokens
+from typing import Any, Callable, List, Optional
 
 
 load_dotenv()
 
+MENSAJE_ERROR_CASO_DE_USO = "No se pudo generar el caso. Por favor ingrésalo manualmente."
+
+# Evaluación empaquetada: varias respuestas por llamada con un contexto compartido
+CRITERIOS_EVALUACION = ("coherencia", "precision", "aplicabilidad")
+MAX_TOKENS_CANDIDATO = int(os.getenv("EVAL_CANDIDATE_MAX_TOKENS", "600"))
+MAX_CANDIDATOS_LLAMADA = int(os.getenv("EVAL_PACK_MAX_CANDIDATES", "20"))
+TOKENS_SALIDA_CANDIDATO = 80
+TOKENS_SALIDA_COMBINACION = 500
+
+
+def validar_evaluacion_lote(datos, ids: List[str], combinar: bool) -> dict:
+    """
+    Comprueba estrictamente el JSON de una evaluación empaquetada: una entrada por
+    cada id (ni más ni menos), puntuaciones enteras 0-100 y textos donde corresponde.
+    Lanza ValueError si algo no cumple el esquema.
+    """
+    if not isinstance(datos, dict) or not isinstance(datos.get("evaluaciones"), dict):
+        raise ValueError("Falta el objeto 'evaluaciones'")
+    evaluaciones = datos["evaluaciones"]
+    if set(evaluaciones) != set(ids):
+        raise ValueError(f"Ids evaluados {sorted(evaluaciones)} distintos de los enviados {sorted(ids)}")
+
+    limpias = {}
+    for id_candidato, evaluacion in evaluaciones.items():
+        if not isinstance(evaluacion, dict):
+            raise ValueError(f"Evaluación de '{id_candidato}' no es un objeto")
+        limpia = {}
+        for criterio in CRITERIOS_EVALUACION:
+            valor = evaluacion.get(criterio)
+            if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not 0 <= valor <= 100:
+                raise ValueError(f"Puntuación '{criterio}' inválida para '{id_candidato}': {valor!r}")
+            limpia[criterio] = int(round(valor))
+        limpia["comentario"] = str(evaluacion.get("comentario", ""))
+        limpias[id_candidato] = limpia
+
+    if datos.get("mejor_respuesta") not in ids:
+        raise ValueError(f"mejor_respuesta inválida: {datos.get('mejor_respuesta')!r}")
+    if not isinstance(datos.get("analisis"), str):
+        raise ValueError("Falta 'analisis'")
+    resultado = {"evaluaciones": limpias, "mejor_respuesta": datos["mejor_respuesta"], "analisis": datos["analisis"]}
+    if combinar:
+        if not isinstance(datos.get("respuesta_combinada"), str) or not datos["respuesta_combinada"].strip():
+            raise ValueError("Falta 'respuesta_combinada'")
+        resultado["respuesta_combinada"] = datos["respuesta_combinada"]
+    return resultado
+
+
+def _objeto_json(contenido: str) -> dict:
+    datos = json.loads(contenido)
+    if not isinstance(datos, dict):
+        raise ValueError("La respuesta JSON no es un objeto")
+    return datos
+
+
+def _promedio(evaluacion: dict) -> float:
+    return sum(evaluacion[c] for c in CRITERIOS_EVALUACION) / len(CRITERIOS_EVALUACION)
+
+
+def _limpiar_formato_stream(partes):
+    """
+    Quita "**" y "- " de un texto que llega por partes, como el post-procesado
+    de generar_caso_de_uso. Se retiene el último carácter si puede iniciar un marcador.
+    """
+    pendiente = ""
+    inicio = True
+    for parte in partes:
+        texto = (pendiente + parte).replace("**", "").replace("- ", "")
+        pendiente = ""
+        if texto[-1:] in ("*", "-"):
+            texto, pendiente = texto[:-1], texto[-1]
+        if inicio:
+            texto = texto.lstrip()
+            inicio = not texto
+        if texto:
+            yield texto
+    if pendiente:
+        yield pendiente
+
 class Consulta_ia_openai:
-    def __init__(self):        
+    def __init__(self, cache: Optional[CacheLLM] = None, similitud: Optional[Callable[[str, str], float]] = None):
         self.azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT", "https://recursoazureopenaimupi.openai.azure.com/")
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.api_version = "2024-08-01-preview"
@@ -20,129 +104,257 @@ class Consulta_ia_openai:
             logging.error("❌ No se encontró la clave de API de OpenAI en variables de entorno.")
             raise EnvironmentError("Falta la clave de API de OpenAI.")
 
+        # Cliente reutilizable con conexiones persistentes; los reintentos los gestiona la política propia
         self.client = AzureOpenAI(
             api_key=self.api_key,
             api_version=self.api_version,
-            azure_endpoint=self.azure_endpoint
+            azure_endpoint=self.azure_endpoint,
+            http_client=crear_cliente_http(float(os.getenv("AZURE_REQUEST_TIMEOUT_S", "60"))),
+            max_retries=0
         )
+        self.cache = cache
+        # Similitud entre respuestas: TF-IDF por defecto o el motor semántico inyectado
+        self.similitud = similitud or similitud_textos
+        self.reintentos = crear_politica_reintentos()
+        self.circuito = crear_circuito("azure")
+
+    @staticmethod
+    def _mensajes(prompt: str) -> list:
+        """
+        El prefijo estable (instrucciones + documento) va como mensaje de sistema, siempre igual
+        para un mismo documento: así Azure reutiliza su caché de prompts entre llamadas.
+        """
+        prefijo, resto = dividir_prompt(prompt)
+        if not prefijo:
+            return [{"role": "user", "content": prompt}]
+        return [{"role": "system", "content": prefijo}, {"role": "user", "content": resto}]
+
+    @staticmethod
+    def _tokens_cacheados(usage) -> int:
+        detalles = getattr(usage, "prompt_tokens_details", None)
+        return getattr(detalles, "cached_tokens", None) or 0
 
-    def generar_respuesta(self, texto_pdf, escenario):
-        prompt = (
-            f"Según el siguiente contenido del documento:\n\n"
-            f"{texto_pdf}\n\n"
-            f"Responde al siguiente escenario aplicado a este contenido:\n\n"
-            f"{escenario}"
+    def _completar(self, prompt: str, usar_cache: bool = True,
+                   interpretar: Optional[Callable[[str], Any]] = None, **parametros):
+        """
+        Llamada a chat.completions con caché por (modelo, prompt, parámetros).
+        Con interpretar (p. ej. el parser de un JSON), devuelve su resultado y solo se guarda en
+        caché una respuesta que interpretó sin error; si falla, el error se propaga.
+        """
+        clave = None
+        if self.cache is not None and usar_cache:
+            clave = CacheLLM.clave(self.model_name, prompt, parametros)
+            guardado = self.cache.obtener(clave)
+            if guardado is not None:
+                if interpretar is None:
+                    return guardado
+                try:
+                    return interpretar(guardado)
+                except (ValueError, TypeError):
+                    logging.warning("⚠️ Respuesta inválida en la caché del LLM: se vuelve a pedir")
+
+        response = self.reintentos.ejecutar(
+            "azure", self.circuito, self.client.chat.completions.create,
+            model=self.model_name,
+            messages=self._mensajes(prompt),
+            **parametros
         )
+        contenido = response.choices[0].message.content
+        if response.usage is not None:
+            registrar_tokens("azure", response.usage.prompt_tokens, response.usage.completion_tokens,
+                             self._tokens_cacheados(response.usage))
 
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-                max_tokens=1500
+        resultado = interpretar(contenido) if interpretar is not None else contenido
+        if clave is not None and contenido:
+            self.cache.guardar(clave, contenido)
+        return resultado
+
+    def _completar_stream(self, prompt: str, usar_cache: bool = True, uso: Optional[dict] = None, **parametros):
+        """
+        Versión en streaming de _completar: devuelve el texto por partes.
+        Si se pasa uso, al terminar se rellena con los tokens consumidos.
+        """
+        clave = None
+        if self.cache is not None and usar_cache:
+            clave = CacheLLM.clave(self.model_name, prompt, parametros)
+            guardado = self.cache.obtener(clave)
+            if guardado is not None:
+                if uso is not None:
+                    uso.update(prompt_tokens=0, completion_tokens=0, total_tokens=0, cached_tokens=0, cache=True)
+                yield guardado
+                return
+
+        stream = self.reintentos.ejecutar(
+            "azure", self.circuito, self.client.chat.completions.create,
+            model=self.model_name,
+            messages=self._mensajes(prompt),
+            stream=True,
+            stream_options={"include_usage": True},
+            **parametros
+        )
+        partes = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                partes.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+            # El último fragmento no trae choices, solo el consumo de tokens
+            if chunk.usage is not None:
+                registrar_tokens("azure", chunk.usage.prompt_tokens, chunk.usage.completion_tokens,
+                                 self._tokens_cacheados(chunk.usage))
+            if chunk.usage is not None and uso is not None:
+                uso.update(
+                    prompt_tokens=chunk.usage.prompt_tokens,
+                    completion_tokens=chunk.usage.completion_tokens,
+                    total_tokens=chunk.usage.total_tokens,
+                    cached_tokens=self._tokens_cacheados(chunk.usage),
+                    cache=False
+                )
+
+        if clave is not None and partes:
+            self.cache.guardar(clave, "".join(partes))
+
+    def _prompt_respuesta(self, texto_pdf, escenario):
+        documento, fragmentos = partes_contexto(texto_pdf)
+
+        def plantilla(fragmentos, secciones, escenario):
+            citas = "Cita los artículos/secciones aplicables tal como aparecen en las secciones indicadas.\n\n" \
+                if secciones else ""
+            return seccion_fragmentos(fragmentos) + seccion_indice(secciones) + (
+                f"{citas}Responde al siguiente escenario aplicado a este contenido:\n\n"
+                f"{escenario}"
             )
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            logging.error(f"Error al generar respuesta: {e}", exc_info=True)
-            return "❌ Ocurrió un error al generar la respuesta."
+
+        return construir_prompt("respuesta", plantilla, [
+            ("fragmentos", fragmentos, 1, 0),
+            ("secciones", secciones_contexto(texto_pdf), 2, 0),
+            ("escenario", escenario, 3, 0),
+        ], self.model_name, documento=documento)
+
+    def generar_respuesta(self, texto_pdf, escenario, usar_cache=True):
+        """Lanza ErrorProveedor si Azure no responde tras los reintentos"""
+        prompt = self._prompt_respuesta(texto_pdf, escenario)
+        return self._completar(prompt, usar_cache, temperature=0.3, max_tokens=1500)
+
+    def generar_respuesta_stream(self, texto_pdf, escenario, usar_cache=True, uso=None):
+        """Igual que generar_respuesta, pero devuelve el texto por partes a medida que se genera"""
+        prompt = self._prompt_respuesta(texto_pdf, escenario)
+        yield from self._completar_stream(prompt, usar_cache, uso, temperature=0.3, max_tokens=1500)
 
     def comparar_respuestas(self, respuesta_ia, respuesta_usuario):
-        vectorizer = TfidfVectorizer().fit_transform([respuesta_ia, respuesta_usuario])
-        similarity = cosine_similarity(vectorizer[0:1], vectorizer[1:2])
-        return round(float(similarity[0][0]), 2)
+        return self.similitud(respuesta_ia, respuesta_usuario)
 
     
-    def generar_caso_de_uso(self, texto_pdf):
-
-        prompt = f"""
-        Como consultor experto en normativas técnicas, genera UN CASO DE USO REALISTA basado en este documento.
-        El formato debe ser:
-
-        [CONTEXTO EMPRESARIAL]
-        - Tipo de organización (ej: empresa de software médio, consultora TI multinacional)
-        - Sector industrial (ej: financiero, salud, gobierno)
-        - Situación actual (1-2 oraciones)
-
-        [PROBLEMA CONCRETO]
-        - Descripción detallada del problema que requiere aplicar esta normativa
-        - Consecuencias de no resolverlo (ej: multas, pérdida de contratos)
-        - Necesidad específica que justifica usar este estándar
-
-        Reglas:
-        1. Máximo 2 párrafos (6-8 oraciones total)
-        2. Basado estrictamente en el ámbito de aplicación del documento
-        3. Usar ejemplos realistas (no hipotéticos)
-        4. Sin lenguaje técnico complejo
-        5. Incluir datos contextuales específicos (tamaño empresa, ubicación, etc.)
-
-        Ejemplo:
-        "Una consultora de TI en Quito con 50 empleados necesita evaluar sus procesos de desarrollo para participar en una licitación del Ministerio de Salud que exige certificación SPICE Nivel 3. Actualmente tienen evaluaciones inconsistentes entre proyectos, lo que ha causado rechazo en 3 licitaciones internacionales el último año."
-
-        Documento normativo:
-        {texto_pdf[:8000]}
-        """
+    def _prompt_caso_de_uso(self, texto_pdf):
+        documento, fragmentos = partes_contexto(texto_pdf)
+
+        def plantilla(fragmentos):
+            return seccion_fragmentos(fragmentos) + f"""
+            Como consultor experto en normativas técnicas, genera UN CASO DE USO REALISTA basado en este documento.
+            El formato debe ser:
+
+            [CONTEXTO EMPRESARIAL]
+            - Tipo de organización (ej: empresa de software médio, consultora TI multinacional)
+            - Sector industrial (ej: financiero, salud, gobierno)
+            - Situación actual (1-2 oraciones)
+
+            [PROBLEMA CONCRETO]
+            - Descripción detallada del problema que requiere aplicar esta normativa
+            - Consecuencias de no resolverlo (ej: multas, pérdida de contratos)
+            - Necesidad específica que justifica usar este estándar
+
+            Reglas:
+            1. Máximo 2 párrafos (6-8 oraciones total)
+            2. Basado estrictamente en el ámbito de aplicación del documento
+            3. Usar ejemplos realistas (no hipotéticos)
+            4. Sin lenguaje técnico complejo
+            5. Incluir datos contextuales específicos (tamaño empresa, ubicación, etc.)
+
+            Ejemplo:
+            "Una consultora de TI en Quito con 50 empleados necesita evaluar sus procesos de desarrollo para participar en una licitación del Ministerio de Salud que exige certificación SPICE Nivel 3. Actualmente tienen evaluaciones inconsistentes entre proyectos, lo que ha causado rechazo en 3 licitaciones internacionales el último año."
+            """
+
+        return construir_prompt("caso_de_uso", plantilla, [
+            ("fragmentos", fragmentos, 1, 0),
+        ], self.model_name, documento=documento)
+
+    def generar_caso_de_uso(self, texto_pdf, usar_cache=True):
+        prompt = self._prompt_caso_de_uso(texto_pdf)
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
+            caso = self._completar(
+                prompt,
+                usar_cache,
                 temperature=0.4,  # Balance realismo/creatividad
                 max_tokens=400,
                 top_p=0.9
             )
-            caso = response.choices[0].message.content
             
             # Post-procesamiento para asegurar formato
             return caso.replace("**", "").replace("- ", "").strip()
             
         except Exception as e:
             logging.error(f"Error al generar caso real: {e}")
-            return "No se pudo generar el caso. Por favor ingrésalo manualmente."
+            return MENSAJE_ERROR_CASO_DE_USO
+
+    def generar_caso_de_uso_stream(self, texto_pdf, usar_cache=True, uso=None):
+        """Igual que generar_caso_de_uso, pero por partes (los errores se propagan)"""
+        prompt = self._prompt_caso_de_uso(texto_pdf)
+        partes = self._completar_stream(prompt, usar_cache, uso, temperature=0.4, max_tokens=400, top_p=0.9)
+        yield from _limpiar_formato_stream(partes)
         
-    def evaluar_calidad_respuestas(self, texto_pdf: str, pregunta: str, respuesta_azure: str, respuesta_gemini: str, respuesta_usuario: str) -> dict:
+    def evaluar_calidad_respuestas(self, texto_pdf: Contexto, pregunta: str, respuesta_azure: str, respuesta_gemini: str, respuesta_usuario: str, usar_cache: bool = True) -> dict:
 
         # 1. Comparación textual local
         sim_azure = self.comparar_respuestas(respuesta_azure, respuesta_usuario)
         sim_gemini = self.comparar_respuestas(respuesta_gemini, respuesta_usuario)
         
         # 2. Evaluación cualitativa mejorada
-        prompt = f"""
-        Evalúa estas respuestas según 3 criterios (0-100%):
-        - Coherencia normativa: Alineación con estándares
-        - Precisión técnica: Exactitud técnica
-        - Aplicabilidad práctica: Utilidad real
-
-        [CONTEXTO]
-        Documento: {texto_pdf[:3000]}...
-        Pregunta: {pregunta}
-
-        [RESPUESTAS]
-        - Azure: {respuesta_azure[:500]}...
-        - Gemini: {respuesta_gemini[:500]}...
-        - Usuario: {respuesta_usuario[:500]}...
-
-        Devuelve SOLO JSON con:
-        {{
-            "puntuaciones": {{
-                "azure": {{"coherencia": 0-100, "precision": 0-100, "aplicabilidad": 0-100}},
-                "gemini": {{"coherencia": 0-100, "precision": 0-100, "aplicabilidad": 0-100}},
-                "usuario": {{"coherencia": 0-100, "precision": 0-100, "aplicabilidad": 0-100}}
-            }},
-            "analisis": "Comparación concisa (2-3 oraciones)",
-            "mejor_respuesta": "azure|gemini|usuario"
-        }}
-        """
+        documento, fragmentos = partes_contexto(texto_pdf)
+
+        def plantilla(fragmentos, pregunta, respuesta_azure, respuesta_gemini, respuesta_usuario):
+            return seccion_fragmentos(fragmentos) + f"""
+            Evalúa estas respuestas según 3 criterios (0-100%):
+            - Coherencia normativa: Alineación con estándares
+            - Precisión técnica: Exactitud técnica
+            - Aplicabilidad práctica: Utilidad real
+
+            [CONTEXTO]
+            Pregunta: {pregunta}
+
+            [RESPUESTAS]
+            - Azure: {respuesta_azure}
+            - Gemini: {respuesta_gemini}
+            - Usuario: {respuesta_usuario}
+
+            Devuelve SOLO JSON con:
+            {{
+                "puntuaciones": {{
+                    "azure": {{"coherencia": 0-100, "precision": 0-100, "aplicabilidad": 0-100}},
+                    "gemini": {{"coherencia": 0-100, "precision": 0-100, "aplicabilidad": 0-100}},
+                    "usuario": {{"coherencia": 0-100, "precision": 0-100, "aplicabilidad": 0-100}}
+                }},
+                "analisis": "Comparación concisa (2-3 oraciones)",
+                "mejor_respuesta": "azure|gemini|usuario"
+            }}
+            """
+
+        prompt = construir_prompt("evaluacion", plantilla, [
+            ("fragmentos", fragmentos, 1, 0),
+            ("pregunta", pregunta, 3, 0),
+            ("respuesta_azure", respuesta_azure, 2, 100),
+            ("respuesta_gemini", respuesta_gemini, 2, 100),
+            ("respuesta_usuario", respuesta_usuario, 2, 100),
+        ], self.model_name, documento=documento)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
+            evaluacion = self._completar(
+                prompt,
+                usar_cache,
+                interpretar=_objeto_json,
                 temperature=0.1,
                 max_tokens=400,
                 response_format={"type": "json_object"}
             )
-            evaluacion = json.loads(response.choices[0].message.content)
 
             return {
                 "similarity_azure": sim_azure,
@@ -160,43 +372,200 @@ class Consulta_ia_openai:
                 "error": "Error en evaluación cualitativa"
             }
 
-    def combinar_respuestas(self, texto_pdf: str, respuesta_azure: str, respuesta_gemini: str, respuesta_usuario: str) -> str:
+    def _prompt_evaluacion_lote(self, texto_pdf: Contexto, pregunta: str, candidatos: dict, combinar: bool) -> str:
+        respuestas = "\n".join(f'- "{id_candidato}": {texto}' for id_candidato, texto in candidatos.items())
+        ids = ", ".join(f'"{id_candidato}"' for id_candidato in candidatos)
+        combinacion = (
+            ',\n                "respuesta_combinada": "Análisis integrado que combine lo mejor de todas las respuestas '
+            '(párrafo introductorio, 3-5 ideas principales, conclusión breve)"'
+        ) if combinar else ""
+        documento, fragmentos = partes_contexto(texto_pdf)
+        return prefijo_documento(documento, modelo=self.model_name) + seccion_fragmentos(fragmentos) + f"""
+            Evalúa CADA una de estas respuestas según 3 criterios (0-100):
+            - Coherencia normativa: Alineación con estándares
+            - Precisión técnica: Exactitud técnica
+            - Aplicabilidad práctica: Utilidad real
+
+            [CONTEXTO]
+            Pregunta: {pregunta}
+
+            [RESPUESTAS]
+            {respuestas}
+
+            Devuelve SOLO JSON, con una entrada en "evaluaciones" por cada id ({ids}) y nada más:
+            {{
+                "evaluaciones": {{
+                    "<id>": {{"coherencia": 0-100, "precision": 0-100, "aplicabilidad": 0-100, "comentario": "1 oración"}}
+                }},
+                "mejor_respuesta": "<id>",
+                "analisis": "Comparación concisa (2-3 oraciones)"{combinacion}
+            }}
+            """
+
+    def agrupar_candidatos(self, texto_pdf: Contexto, pregunta: str, candidatos: dict) -> List[dict]:
         """
-        Combina las respuestas en un análisis integrado y bien redactado.
+        Reparte los candidatos (en orden) en grupos que caben en el presupuesto de una
+        llamada junto con el contexto compartido. Cada respuesta se recorta a MAX_TOKENS_CANDIDATO.
+        """
+        base = contar_tokens(self._prompt_evaluacion_lote(texto_pdf, pregunta, {}, True), self.model_name)
+        grupos, actual, tokens = [], {}, base
+        for id_candidato, texto in candidatos.items():
+            texto = recortar_tokens(texto or "", MAX_TOKENS_CANDIDATO, self.model_name)
+            costo = contar_tokens(f'- "{id_candidato}": {texto}\n', self.model_name)
+            if actual and (tokens + costo > PRESUPUESTOS["evaluacion_lote"] or len(actual) >= MAX_CANDIDATOS_LLAMADA):
+                grupos.append(actual)
+                actual, tokens = {}, base
+            actual[id_candidato] = texto
+            tokens += costo
+        if actual:
+            grupos.append(actual)
+        return grupos
+
+    def _evaluar_grupo(self, texto_pdf: Contexto, pregunta: str, grupo: dict, combinar: bool, usar_cache: bool) -> dict:
+        prompt = self._prompt_evaluacion_lote(texto_pdf, pregunta, grupo, combinar)
+        salida = TOKENS_SALIDA_CANDIDATO * len(grupo) + 200 + (TOKENS_SALIDA_COMBINACION if combinar else 0)
+        return self._completar(
+            prompt,
+            usar_cache,
+            interpretar=lambda contenido: validar_evaluacion_lote(json.loads(contenido), list(grupo), combinar),
+            temperature=0.1,
+            max_tokens=salida,
+            response_format={"type": "json_object"}
+        )
+
+    def evaluar_candidatos(self, texto_pdf: Contexto, pregunta: str, candidatos: dict,
+                           usar_cache: bool = True, combinar: bool = False) -> dict:
         """
-        resumen_azure = respuesta_azure[:200] + "..." if len(respuesta_azure) > 200 else respuesta_azure
-        resumen_gemini = respuesta_gemini[:200] + "..." if len(respuesta_gemini) > 200 else respuesta_gemini
-        resumen_usuario = respuesta_usuario[:200] + "..." if len(respuesta_usuario) > 200 else respuesta_usuario
-
-        prompt = f"""
-        **Objetivo**: Genera un análisis integrado que combine las perspectivas clave de las 3 respuestas, 
-        priorizando claridad y coherencia normativa. Sigue estas instrucciones:
-
-        1. **Contexto**: Usa el documento base como referencia principal.
-        2. **Síntesis**: Integra los aportes únicos de cada fuente:
-        - Azure: Fortalezas técnicas
-        - Gemini: Perspectiva contextual
-        - Usuario: Enfoque práctico/normativo
-        3. **Formato**:
-        - Párrafo introductorio (2-3 líneas).
-        - 3-5 ideas principales (cada una con 1-2 oraciones).
-        - Conclusión breve (opcional).
-        4. **Estilo**: Lenguaje formal pero fluido, como un informe técnico-jurídico.
-
-        [DOCUMENTO BASE]: {texto_pdf[:1000]}...
-        [RESUMEN AZURE]: {resumen_azure}
-        [RESUMEN GEMINI]: {resumen_gemini}
-        [RESUMEN USUARIO]: {resumen_usuario}
+        Evalúa muchas respuestas con pocas llamadas en modo JSON, compartiendo el contexto.
+        candidatos: {id: respuesta}. Si no caben en una llamada se reparten en grupos; si una
+        respuesta no cumple el esquema, el grupo se divide y se reintenta. Con combinar, la
+        solución combinada se pide en la primera llamada (cuando todo cabe en una, la ve completa).
+        Devuelve {"evaluaciones", "mejor_respuesta", "analisis", "errores", "llamadas"[, "respuesta_combinada"]}.
+        Lanza ErrorProveedor si Azure no responde.
         """
+        resultado = {"evaluaciones": {}, "errores": {}, "llamadas": 0}
+        analisis = []
+        pendientes = [(grupo, combinar and i == 0)
+                      for i, grupo in enumerate(self.agrupar_candidatos(texto_pdf, pregunta, candidatos))]
+        while pendientes:
+            grupo, con_combinacion = pendientes.pop(0)
+            resultado["llamadas"] += 1
+            try:
+                datos = self._evaluar_grupo(texto_pdf, pregunta, grupo, con_combinacion, usar_cache)
+            except (ValueError, TypeError) as e:
+                # JSON inválido o fuera de esquema (no se guardó en caché): se reintenta por mitades
+                logging.warning(f"⚠️ Evaluación empaquetada inválida ({len(grupo)} respuestas): {e}")
+                if len(grupo) == 1:
+                    resultado["errores"][next(iter(grupo))] = "Evaluación inválida"
+                    continue
+                ids = list(grupo)
+                mitad = len(ids) // 2
+                pendientes[:0] = [
+                    ({i: grupo[i] for i in ids[:mitad]}, con_combinacion),
+                    ({i: grupo[i] for i in ids[mitad:]}, False),
+                ]
+                continue
+
+            resultado["evaluaciones"].update(datos["evaluaciones"])
+            analisis.append(datos["analisis"])
+            elegida = datos["mejor_respuesta"]
+            if "respuesta_combinada" in datos:
+                resultado["respuesta_combinada"] = datos["respuesta_combinada"]
+
+        evaluaciones = resultado["evaluaciones"]
+        if len(analisis) == 1 and not resultado["errores"]:
+            # Una sola llamada vio todas las respuestas: se respeta su elección
+            resultado["mejor_respuesta"] = elegida
+        else:
+            resultado["mejor_respuesta"] = max(evaluaciones, key=lambda i: _promedio(evaluaciones[i])) if evaluaciones else ""
+        resultado["analisis"] = " ".join(analisis)
+        return resultado
+
+    def evaluar_y_combinar(self, texto_pdf: Contexto, pregunta: str, respuesta_azure: str, respuesta_gemini: str,
+                           respuesta_usuario: str, usar_cache: bool = True) -> dict:
+        """
+        Evaluación de las 3 respuestas y solución combinada en una sola llamada.
+        Mismo formato que evaluar_calidad_respuestas, más "respuesta_combinada".
+        """
+        sim_azure = self.comparar_respuestas(respuesta_azure, respuesta_usuario)
+        sim_gemini = self.comparar_respuestas(respuesta_gemini, respuesta_usuario)
+        candidatos = {"azure": respuesta_azure, "gemini": respuesta_gemini, "usuario": respuesta_usuario}
+        try:
+            resultado = self.evaluar_candidatos(texto_pdf, pregunta, candidatos, usar_cache, combinar=True)
+        except Exception as e:
+            logging.error(f"Error en evaluación empaquetada: {str(e)}")
+            return {
+                "similarity_azure": sim_azure,
+                "similarity_gemini": sim_gemini,
+                "error": "Error en evaluación cualitativa"
+            }
+
+        evaluacion = {
+            "similarity_azure": sim_azure,
+            "similarity_gemini": sim_gemini,
+            "puntuaciones": {
+                id_candidato: {c: valor[c] for c in CRITERIOS_EVALUACION}
+                for id_candidato, valor in resultado["evaluaciones"].items()
+            },
+            "analisis": resultado["analisis"],
+            "mejor_respuesta": resultado["mejor_respuesta"]
+        }
+        if "respuesta_combinada" in resultado:
+            evaluacion["respuesta_combinada"] = resultado["respuesta_combinada"]
+        if resultado["errores"]:
+            evaluacion["error"] = "Error en evaluación cualitativa"
+        return evaluacion
+
+    def _prompt_combinacion(self, texto_pdf: Contexto, respuesta_azure: str, respuesta_gemini: str, respuesta_usuario: str) -> str:
+        documento, fragmentos = partes_contexto(texto_pdf)
+
+        def plantilla(fragmentos, resumen_azure, resumen_gemini, resumen_usuario):
+            return seccion_fragmentos(fragmentos) + f"""
+            **Objetivo**: Genera un análisis integrado que combine las perspectivas clave de las 3 respuestas, 
+            priorizando claridad y coherencia normativa. Sigue estas instrucciones:
+
+            1. **Contexto**: Usa el documento normativo como referencia principal.
+            2. **Síntesis**: Integra los aportes únicos de cada fuente:
+            - Azure: Fortalezas técnicas
+            - Gemini: Perspectiva contextual
+            - Usuario: Enfoque práctico/normativo
+            3. **Formato**:
+            - Párrafo introductorio (2-3 líneas).
+            - 3-5 ideas principales (cada una con 1-2 oraciones).
+            - Conclusión breve (opcional).
+            4. **Estilo**: Lenguaje formal pero fluido, como un informe técnico-jurídico.
+
+            [RESUMEN AZURE]: {resumen_azure}
+            [RESUMEN GEMINI]: {resumen_gemini}
+            [RESUMEN USUARIO]: {resumen_usuario}
+            """
+
+        # Las respuestas se resumen recortándolas al presupuesto de la llamada
+        return construir_prompt("combinacion", plantilla, [
+            ("fragmentos", fragmentos, 1, 0),
+            ("resumen_azure", respuesta_azure, 2, 50),
+            ("resumen_gemini", respuesta_gemini, 2, 50),
+            ("resumen_usuario", respuesta_usuario, 2, 50),
+        ], self.model_name, documento=documento)
+
+    def combinar_respuestas(self, texto_pdf: Contexto, respuesta_azure: str, respuesta_gemini: str, respuesta_usuario: str, usar_cache: bool = True) -> str:
+        """
+        Combina las respuestas en un análisis integrado y bien redactado.
+        """
+        prompt = self._prompt_combinacion(texto_pdf, respuesta_azure, respuesta_gemini, respuesta_usuario)
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
+            return self._completar(
+                prompt,
+                usar_cache,
                 temperature=0.3,  # Un poco más creativo
                 max_tokens=400    # Permite mayor desarrollo
             )
-            return response.choices[0].message.content
         except Exception as e:
             logging.error(f"Error al combinar respuestas: {str(e)}")
             return "❌ Error al generar la solución combinada"
+
+    def combinar_respuestas_stream(self, texto_pdf: Contexto, respuesta_azure: str, respuesta_gemini: str, respuesta_usuario: str, usar_cache: bool = True, uso: Optional[dict] = None):
+        """Igual que combinar_respuestas, pero por partes (los errores se propagan)"""
+        prompt = self._prompt_combinacion(texto_pdf, respuesta_azure, respuesta_gemini, respuesta_usuario)
+        yield from self._completar_stream(prompt, usar_cache, uso, temperature=0.3, max_tokens=400)
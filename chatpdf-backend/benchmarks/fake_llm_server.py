@@ -0,0 +1,278 @@
+"""
+Servidor local que imita la API de chat completions de Azure OpenAI y la API REST
+de Gemini (generateContent / streamGenerateContent / cachedContents), con latencia y
+ritmo de tokens configurables. También imita las cachés de prompts: Azure informa como
+cacheado un mensaje de sistema ya visto y Gemini el contenido de un cachedContent.
+No usa red externa: sirve para benchmarks y pruebas de carga.
+
+Uso:
+    python benchmarks/fake_llm_server.py --port 8900 --latencia 0.3 --tokens-por-segundo 80
+
+El backend se apunta a este servidor con:
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8900/
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8900
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PALABRAS = (
+    "Según el artículo aplicable la organización debe documentar el proceso evaluar los riesgos "
+    "y establecer controles de seguridad proporcionales al impacto identificado en el análisis"
+).split()
+
+EVALUACION_JSON = {
+    "puntuaciones": {
+        "azure": {"coherencia": 85, "precision": 80, "aplicabilidad": 78},
+        "gemini": {"coherencia": 82, "precision": 79, "aplicabilidad": 81},
+        "usuario": {"coherencia": 70, "precision": 65, "aplicabilidad": 72},
+    },
+    "analisis": "Las respuestas de la IA citan la normativa con más precisión.",
+    "mejor_respuesta": "azure",
+}
+
+
+def _evaluacion_lote(prompt: str) -> dict:
+    """Respuesta con el esquema de evaluación empaquetada para los ids listados en el prompt"""
+    ids = re.findall(r'^\s*- "([^"]+)": ', prompt, flags=re.MULTILINE)
+    evaluaciones = {
+        id_candidato: {"coherencia": 60 + n % 40, "precision": 65 + n % 30, "aplicabilidad": 70 + n % 25,
+                       "comentario": "Cita la normativa aplicable."}
+        for n, id_candidato in enumerate(ids)
+    }
+    datos = {"evaluaciones": evaluaciones, "mejor_respuesta": ids[0] if ids else "",
+             "analisis": "Las respuestas difieren en el detalle normativo."}
+    if '"respuesta_combinada"' in prompt:
+        datos["respuesta_combinada"] = " ".join(_tokens_respuesta(120))
+    return datos
+
+
+class ConfiguracionFalsa:
+    def __init__(self, latencia: float = 0.3, tokens_por_segundo: float = 80, tokens: int = 200):
+        self.latencia = latencia
+        self.tokens_por_segundo = tokens_por_segundo
+        self.tokens = tokens
+
+
+def _tokens_respuesta(cantidad: int) -> list:
+    return [(" " if i else "") + PALABRAS[i % len(PALABRAS)] for i in range(cantidad)]
+
+
+def _tokens_prompt(cuerpo: dict) -> int:
+    # Estimación suficiente para el benchmark: ~4 caracteres por token
+    return max(1, len(json.dumps(cuerpo, ensure_ascii=False)) // 4)
+
+
+# Azure solo cachea prefijos de al menos 1024 tokens, en bloques de 128
+MIN_TOKENS_PREFIJO_AZURE = 1024
+
+
+class ManejadorFalso(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def config(self) -> ConfiguracionFalsa:
+        return self.server.config
+
+    def _leer(self) -> dict:
+        longitud = int(self.headers.get("content-length") or 0)
+        return json.loads(self.rfile.read(longitud) or b"{}")
+
+    def do_POST(self):
+        cuerpo = self._leer()
+        if self.path.split("?")[0].endswith("/cachedContents"):
+            self._crear_contenido_cacheado(cuerpo)
+            return
+        time.sleep(self.config.latencia)
+
+        if "cachedContent" in cuerpo and cuerpo["cachedContent"] not in self.server.contenidos:
+            self._error(404, f"CachedContent not found: {cuerpo['cachedContent']}")
+        elif ":streamGenerateContent" in self.path:
+            self._gemini_stream(cuerpo)
+        elif ":generateContent" in self.path:
+            self._gemini(cuerpo)
+        elif cuerpo.get("stream"):
+            self._azure_stream(cuerpo)
+        else:
+            self._azure(cuerpo)
+
+    def do_PATCH(self):
+        cuerpo = self._leer()
+        nombre = self._nombre_contenido()
+        if nombre not in self.server.contenidos:
+            self._error(404, f"CachedContent not found: {nombre}")
+            return
+        self.server.contenidos[nombre].update(cuerpo)
+        self._json(self.server.contenidos[nombre])
+
+    def do_DELETE(self):
+        self.server.contenidos.pop(self._nombre_contenido(), None)
+        self._json({})
+
+    # --- utilidades HTTP ---
+
+    def _json(self, datos: dict, estado: int = 200):
+        contenido = json.dumps(datos).encode()
+        self.send_response(estado)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(contenido)))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    def _error(self, estado: int, mensaje: str):
+        self._json({"error": {"code": estado, "message": mensaje, "status": "NOT_FOUND"}}, estado)
+
+    def _iniciar_chunked(self, tipo: str):
+        self.send_response(200)
+        self.send_header("content-type", tipo)
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, datos: bytes):
+        self.wfile.write(f"{len(datos):x}\r\n".encode() + datos + b"\r\n")
+        self.wfile.flush()
+
+    def _esperar_tokens(self, cantidad: int):
+        if self.config.tokens_por_segundo > 0:
+            time.sleep(cantidad / self.config.tokens_por_segundo)
+
+    # --- Azure OpenAI ---
+
+    def _texto_azure(self, cuerpo: dict) -> str:
+        if (cuerpo.get("response_format") or {}).get("type") == "json_object":
+            prompt = cuerpo["messages"][-1]["content"]
+            if '"evaluaciones"' in prompt:
+                return json.dumps(_evaluacion_lote(prompt), ensure_ascii=False)
+            return json.dumps(EVALUACION_JSON, ensure_ascii=False)
+        return "".join(_tokens_respuesta(min(self.config.tokens, cuerpo.get("max_tokens") or self.config.tokens)))
+
+    def _uso_azure(self, cuerpo: dict, salida: int) -> dict:
+        entrada = _tokens_prompt(cuerpo)
+        return {"prompt_tokens": entrada, "completion_tokens": salida, "total_tokens": entrada + salida,
+                "prompt_tokens_details": {"cached_tokens": self._cacheados_azure(cuerpo)}}
+
+    def _cacheados_azure(self, cuerpo: dict) -> int:
+        """Tokens del mensaje de sistema si ya se vio antes (caché automática de prefijos)"""
+        sistema = next((m["content"] for m in cuerpo.get("messages", []) if m["role"] == "system"), "")
+        tokens = len(sistema) // 4
+        if tokens < MIN_TOKENS_PREFIJO_AZURE:
+            return 0
+        clave = hashlib.sha256(sistema.encode()).hexdigest()
+        with self.server.lock:
+            visto = clave in self.server.prefijos
+            self.server.prefijos.add(clave)
+        return tokens // 128 * 128 if visto else 0
+
+    def _azure(self, cuerpo: dict):
+        texto = self._texto_azure(cuerpo)
+        salida = len(texto.split())
+        self._esperar_tokens(salida)
+        self._json({
+            "id": "chatcmpl-falso", "object": "chat.completion", "created": int(time.time()),
+            "model": cuerpo.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": texto}}],
+            "usage": self._uso_azure(cuerpo, salida),
+        })
+
+    def _azure_stream(self, cuerpo: dict):
+        self._iniciar_chunked("text/event-stream")
+        partes = self._texto_azure(cuerpo).split(" ")
+        base = {"id": "chatcmpl-falso", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": cuerpo.get("model", "gpt-4o")}
+        for i, parte in enumerate(partes):
+            self._esperar_tokens(1)
+            delta = {"content": (" " if i else "") + parte}
+            evento = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self._chunk(f"data: {json.dumps(evento)}\n\n".encode())
+        if (cuerpo.get("stream_options") or {}).get("include_usage"):
+            evento = {**base, "choices": [], "usage": self._uso_azure(cuerpo, len(partes))}
+            self._chunk(f"data: {json.dumps(evento)}\n\n".encode())
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    # --- Gemini (REST) ---
+
+    def _nombre_contenido(self) -> str:
+        return "cachedContents/" + self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+
+    def _crear_contenido_cacheado(self, cuerpo: dict):
+        nombre = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        ahora = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        contenido = {
+            "name": nombre, "model": cuerpo.get("model", ""), "displayName": cuerpo.get("displayName", ""),
+            "createTime": ahora, "updateTime": ahora, "expireTime": ahora,
+            "usageMetadata": {"totalTokenCount": _tokens_prompt({"contents": cuerpo.get("contents")})},
+        }
+        self.server.contenidos[nombre] = contenido
+        self._json(contenido)
+
+    def _respuesta_gemini(self, texto: str, entrada: int, salida: int, cacheados: int = 0) -> dict:
+        return {
+            "candidates": [{"content": {"parts": [{"text": texto}], "role": "model"},
+                            "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": entrada + cacheados, "candidatesTokenCount": salida,
+                              "totalTokenCount": entrada + cacheados + salida,
+                              "cachedContentTokenCount": cacheados},
+        }
+
+    def _cacheados_gemini(self, cuerpo: dict) -> int:
+        contenido = self.server.contenidos.get(cuerpo.get("cachedContent"))
+        return contenido["usageMetadata"]["totalTokenCount"] if contenido else 0
+
+    def _gemini(self, cuerpo: dict):
+        tokens = _tokens_respuesta(self.config.tokens)
+        self._esperar_tokens(len(tokens))
+        self._json(self._respuesta_gemini("".join(tokens), _tokens_prompt(cuerpo), len(tokens),
+                                          self._cacheados_gemini(cuerpo)))
+
+    def _gemini_stream(self, cuerpo: dict):
+        # El transporte REST del SDK lee un arreglo JSON que llega por partes
+        self._iniciar_chunked("application/json")
+        entrada, cacheados = _tokens_prompt(cuerpo), self._cacheados_gemini(cuerpo)
+        for i, token in enumerate(_tokens_respuesta(self.config.tokens)):
+            self._esperar_tokens(1)
+            parte = json.dumps(self._respuesta_gemini(token, entrada, i + 1, cacheados))
+            self._chunk((("[" if i == 0 else ",") + parte).encode())
+        self._chunk(b"]")
+        self._chunk(b"")
+
+
+def arrancar_servidor(puerto: int = 0, config: ConfiguracionFalsa = None) -> ThreadingHTTPServer:
+    """Arranca el servidor en un hilo y lo devuelve (server_port tiene el puerto real)"""
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), ManejadorFalso)
+    servidor.daemon_threads = True
+    servidor.config = config or ConfiguracionFalsa()
+    servidor.lock = threading.Lock()
+    servidor.prefijos = set()  # mensajes de sistema ya vistos (caché de prefijos de Azure)
+    servidor.contenidos = {}  # cachedContents de Gemini por nombre
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso de Azure OpenAI y Gemini")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latencia", type=float, default=0.3, help="segundos hasta el primer token")
+    parser.add_argument("--tokens-por-segundo", type=float, default=80)
+    parser.add_argument("--tokens", type=int, default=200, help="tokens por respuesta")
+    args = parser.parse_args()
+
+    servidor = arrancar_servidor(args.port, ConfiguracionFalsa(args.latencia, args.tokens_por_segundo, args.tokens))
+    print(f"🤖 Servidor LLM falso en http://127.0.0.1:{servidor.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Prueba de carga sin red: arranca el servidor LLM falso, levanta el backend con uvicorn
+apuntando a él y ejecuta cada endpoint de main.py con la concurrencia indicada,
+para PDFs de ejemplo de 1, 50 y 500 páginas. Al añadir una ruta a main.py se añade también
+a endpoints().
+
+Reporta throughput, latencias p50/p95/p99 y RSS pico del servidor. Con --base se
+compara el p95 con una ejecución anterior (--json) y termina con código 1 si hay regresión.
+
+Uso (desde chatpdf-backend/):
+    python benchmarks/load_test.py --peticiones 40 --concurrencia 8
+    python benchmarks/load_test.py --paginas 50 --json actual.json --base referencia.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from fake_llm_server import ConfiguracionFalsa, arrancar_servidor
+from sample_pdfs import TAMANOS, ruta_pdf
+
+DIRECTORIO_BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RESPUESTA = "La organización debe documentar el proceso y evaluar los riesgos según el artículo 5."
+ESCENARIO = "Una empresa de software necesita certificar su proceso de evaluación de riesgos."
+
+
+def datos_semanticos(doc_id: str) -> dict:
+    """Formulario de /compare_semantic/ (se usa para medirlo y para saber si está habilitado)"""
+    return {
+        "doc_id": doc_id, "scenario": ESCENARIO, "reference_responses": [RESPUESTA] * 3,
+        "user_response": ESCENARIO, "align": "true"
+    }
+
+
+def endpoints(doc_id: str, no_cache: bool, ids: dict) -> list:
+    """
+    (nombre, ruta, datos del formulario) de cada endpoint a medir; sin datos se mide con GET.
+    ids trae los trabajos, la sesión, la sección y la revisión creados por preparar().
+    """
+    cache = {"no_cache": str(no_cache).lower()}
+    opcionales = []
+    if ids["semantico"]:
+        opcionales.append(("compare_semantic", "/compare_semantic/", datos_semanticos(doc_id)))
+    if ids["ocr_job_id"]:
+        opcionales.append(("ocr_job_status", f"/ocr_jobs/{ids['ocr_job_id']}", None))
+    respuestas = {"azure_response": RESPUESTA, "gemini_response": RESPUESTA, "user_response": RESPUESTA}
+    return [
+        ("solve_case", "/solve_case/", {"doc_id": doc_id, "scenario": ESCENARIO, **cache}),
+        ("solve_case_gemini", "/solve_case_gemini/", {"doc_id": doc_id, "escenario": ESCENARIO, **cache}),
+        ("solve_case_all", "/solve_case_all/", {"doc_id": doc_id, "scenario": ESCENARIO, **cache}),
+        ("solve_case_stream", "/solve_case_stream/", {"doc_id": doc_id, "scenario": ESCENARIO, **cache}),
+        ("solve_case_gemini_stream", "/solve_case_gemini_stream/", {"doc_id": doc_id, "escenario": ESCENARIO, **cache}),
+        ("generate_use_case", "/generate_use_case/", {"doc_id": doc_id, **cache}),
+        ("generate_use_case_stream", "/generate_use_case_stream/", {"doc_id": doc_id, **cache}),
+        ("evaluate_three_responses", "/evaluate_three_responses/", {"doc_id": doc_id, "question": ESCENARIO, **respuestas, **cache}),
+        ("combine_responses", "/combine_responses/", {"doc_id": doc_id, **respuestas, **cache}),
+        ("combine_responses_stream", "/combine_responses_stream/", {"doc_id": doc_id, **respuestas, **cache}),
+        ("compare_responses", "/compare_responses/", {"ai_response": RESPUESTA, "user_response": ESCENARIO}),
+        ("compare_gemini_response", "/compare_gemini_response/", {"gemini_response": RESPUESTA, "user_response": ESCENARIO}),
+        ("compare_batch", "/compare_batch/", {
+            "doc_id": doc_id, "reference_responses": [RESPUESTA] * 3, "user_responses": [ESCENARIO] * 30
+        }),
+        ("descargar_reporte", "/descargar-reporte/", {
+            "caso_uso": ESCENARIO, "respuesta_usuario": RESPUESTA, "respuesta_azure": RESPUESTA,
+            "respuesta_gemini": RESPUESTA, "respuesta_combinada": RESPUESTA
+        }),
+        ("grade_batch", "/jobs/grade_batch", {
+            "doc_id": doc_id, "scenario": ESCENARIO, "user_responses": [ESCENARIO] * 3, **cache
+        }),
+        ("job_status", f"/jobs/{ids['job_id']}", None),
+        ("job_results", f"/jobs/{ids['job_id']}/results", None),
+        ("sessions", "/sessions", {"doc_id": doc_id, "user_response": RESPUESTA, **cache}),
+        ("session_status", f"/sessions/{ids['session_id']}", None),
+        ("session_report", f"/sessions/{ids['session_id']}/report", None),
+        ("document_sections", f"/documents/{doc_id}/sections", None),
+        ("document_sections_cite", f"/documents/{doc_id}/sections?cite=Artículo 2", None),
+        ("document_section", f"/documents/{doc_id}/sections/{ids['section_id']}", None),
+        ("document_revision", f"/documents/{ids['revision_id']}/revision", None),
+    ] + opcionales
+
+
+def percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados))) - 1))]
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_pico_mb(pid: int):
+    """VmHWM del servidor y sus procesos hijos (pools de extracción y reportes), en MB"""
+    def vmhwm(p):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for linea in f:
+                    if linea.startswith("VmHWM:"):
+                        return int(linea.split()[1]) / 1024
+        except OSError:
+            return 0.0
+        return 0.0
+
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            hijos = [int(p) for p in f.read().split()]
+    except OSError:
+        return None  # Sin /proc (ej: macOS)
+    return {"servidor": round(vmhwm(pid), 1), "hijos": round(sum(vmhwm(h) for h in hijos), 1)}
+
+
+class Backend:
+    """Backend lanzado con uvicorn en un proceso aparte, apuntando al servidor LLM falso"""
+
+    def __init__(self, url_llm: str, env_extra: dict):
+        self.puerto = _puerto_libre()
+        self.url = f"http://127.0.0.1:{self.puerto}"
+        env = {
+            **os.environ,
+            "OPENAI_API_KEY": "benchmark", "GEMINI_API_KEY": "benchmark",
+            "AZURE_OPENAI_ENDPOINT": url_llm + "/", "GEMINI_API_ENDPOINT": url_llm,
+            "LLM_CACHE_SQLITE": "", "DOCUMENT_STORE_SQLITE": "",
+            **env_extra,
+        }
+        self.proceso = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.puerto), "--log-level", "warning"],
+            cwd=DIRECTORIO_BACKEND, env=env
+        )
+
+    def esperar(self, timeout: float = 60):
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            if self.proceso.poll() is not None:
+                raise RuntimeError("El backend terminó al arrancar")
+            try:
+                if httpx.get(self.url + "/ready", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("El backend no respondió a tiempo")
+
+    def detener(self):
+        self.proceso.terminate()
+        try:
+            self.proceso.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proceso.kill()
+
+
+async def medir(cliente: httpx.AsyncClient, ruta: str, peticiones: int, concurrencia: int,
+                datos: dict = None, archivos_fn=None) -> dict:
+    """Lanza las peticiones con la concurrencia indicada y resume sus latencias"""
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias, errores = [], 0
+
+    async def una():
+        nonlocal errores
+        async with semaforo:
+            inicio = time.perf_counter()
+            try:
+                # Las respuestas SSE se leen completas: se mide hasta el último evento
+                if datos is None and archivos_fn is None:
+                    respuesta = await cliente.get(ruta)
+                else:
+                    respuesta = await cliente.post(ruta, data=datos, files=archivos_fn() if archivos_fn else None)
+                if respuesta.status_code >= 400:
+                    errores += 1
+            except httpx.HTTPError:
+                errores += 1
+            latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una() for _ in range(peticiones)))
+    duracion = time.perf_counter() - inicio
+    return {
+        "peticiones": peticiones,
+        "errores": errores,
+        "throughput_rps": round(peticiones / duracion, 2),
+        "p50_ms": round(percentil(latencias, 50) * 1000, 1),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 1),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 1),
+    }
+
+
+async def esperar_estado(cliente: httpx.AsyncClient, ruta: str, timeout: float) -> dict:
+    """Consulta un trabajo o sesión en segundo plano hasta que termina"""
+    limite = time.monotonic() + timeout
+    while True:
+        estado = (await cliente.get(ruta)).json()
+        if estado["status"] in ("completed", "failed") or time.monotonic() > limite:
+            return estado
+        await asyncio.sleep(0.2)
+
+
+async def preparar(cliente: httpx.AsyncClient, doc_id: str, archivo_revision, archivo_escaneado, args) -> dict:
+    """Crea el trabajo, la sesión, la revisión y el OCR cuyas rutas de consulta se miden"""
+    cache = {"no_cache": str(not args.con_cache).lower()}
+    respuesta = await cliente.post("/jobs/grade_batch", data={
+        "doc_id": doc_id, "scenario": ESCENARIO, "user_responses": [ESCENARIO] * 3, **cache
+    })
+    respuesta.raise_for_status()
+    job_id = respuesta.json()["job_id"]
+    respuesta = await cliente.post("/sessions", data={
+        "doc_id": doc_id, "user_response": RESPUESTA, "stream": "false", **cache
+    })
+    respuesta.raise_for_status()
+    session_id = respuesta.json()["session_id"]
+    await esperar_estado(cliente, f"/jobs/{job_id}", args.timeout)
+    await esperar_estado(cliente, f"/sessions/{session_id}", args.timeout)
+
+    secciones = (await cliente.get(f"/documents/{doc_id}/sections")).json()["sections"]
+    respuesta = await cliente.post("/upload_pdf/", data={"previous_doc_id": doc_id}, files=archivo_revision())
+    respuesta.raise_for_status()
+
+    # Rutas opcionales: /compare_semantic/ responde 501 sin SIMILARITY_BACKEND=semantic y,
+    # sin Tesseract, el PDF escaneado se rechaza con 422 en vez de crear un trabajo de OCR
+    habilitado = (await cliente.post("/compare_semantic/", data=datos_semanticos(doc_id))).status_code != 501
+    if not habilitado:
+        print("  ⚠️ Similitud semántica no habilitada en el backend: no se mide /compare_semantic/")
+    ocr_job_id = None
+    escaneado = await cliente.post("/upload_pdf/", files=archivo_escaneado())
+    if escaneado.status_code == 202:
+        ocr_job_id = escaneado.json()["ocr_job_id"]
+    else:
+        print("  ⚠️ OCR no disponible en el backend: no se mide /ocr_jobs")
+    return {
+        "job_id": job_id, "session_id": session_id, "section_id": secciones[0]["id"] if secciones else "",
+        "revision_id": respuesta.json()["doc_id"], "semantico": habilitado, "ocr_job_id": ocr_job_id
+    }
+
+
+async def ejecutar_tamano(backend: Backend, paginas: int, args) -> dict:
+    contenidos = {}
+    for variante in ("", "revision"):
+        with open(ruta_pdf(paginas, variante=variante), "rb") as f:
+            contenidos[variante] = f.read()
+    # Para consultar el progreso del OCR basta con un escaneo de una página
+    with open(ruta_pdf(1, variante="escaneado"), "rb") as f:
+        contenidos["escaneado"] = f.read()
+
+    def archivo(variante: str = ""):
+        return {"file": (f"normativa_{paginas}p.pdf", contenidos[variante], "application/pdf")}
+
+    resultados = {}
+    limites = httpx.Limits(max_connections=args.concurrencia * 2)
+    async with httpx.AsyncClient(base_url=backend.url, timeout=args.timeout, limits=limites) as cliente:
+        respuesta = await cliente.post("/upload_pdf/", files=archivo())
+        respuesta.raise_for_status()
+        doc_id = respuesta.json()["doc_id"]
+
+        resultados["upload_pdf"] = await medir(cliente, "/upload_pdf/", args.peticiones, args.concurrencia, archivos_fn=archivo)
+        resultados["upload_pdf_revision"] = await medir(
+            cliente, "/upload_pdf/", args.peticiones, args.concurrencia,
+            datos={"previous_doc_id": doc_id}, archivos_fn=lambda: archivo("revision")
+        )
+        ids = await preparar(cliente, doc_id, lambda: archivo("revision"), lambda: archivo("escaneado"), args)
+        for nombre, ruta, datos in endpoints(doc_id, not args.con_cache, ids):
+            if args.endpoints and nombre not in args.endpoints:
+                continue
+            resultados[nombre] = await medir(cliente, ruta, args.peticiones, args.concurrencia, datos)
+            print(f"  {nombre:<28} {resultados[nombre]['p95_ms']:>9.1f} ms p95")
+    return resultados
+
+
+def imprimir(informe: dict):
+    print(f"\n{'páginas':>7} {'endpoint':<28} {'n':>4} {'err':>4} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for paginas, datos in informe["resultados"].items():
+        for nombre, r in datos["endpoints"].items():
+            print(f"{paginas:>7} {nombre:<28} {r['peticiones']:>4} {r['errores']:>4} {r['throughput_rps']:>8} "
+                  f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}")
+        print(f"{paginas:>7} RSS pico (MB): {datos['rss_pico_mb']}")
+
+
+def comparar_con_base(informe: dict, ruta_base: str, tolerancia: float) -> list:
+    """Endpoints cuyo p95 empeoró más que la tolerancia respecto a la ejecución de referencia"""
+    with open(ruta_base, encoding="utf-8") as f:
+        base = json.load(f)
+    regresiones = []
+    for paginas, datos in informe["resultados"].items():
+        anteriores = base.get("resultados", {}).get(paginas, {}).get("endpoints", {})
+        for nombre, r in datos["endpoints"].items():
+            anterior = anteriores.get(nombre)
+            if anterior and r["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia):
+                regresiones.append(f"{paginas}p {nombre}: p95 {anterior['p95_ms']} → {r['p95_ms']} ms")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del backend con un LLM falso")
+    parser.add_argument("--paginas", type=int, nargs="+", default=list(TAMANOS))
+    parser.add_argument("--peticiones", type=int, default=20, help="peticiones por endpoint")
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--endpoints", nargs="*", help="medir solo estos endpoints")
+    parser.add_argument("--con-cache", action="store_true", help="permitir respuestas desde la caché de la IA")
+    parser.add_argument("--latencia", type=float, default=0.3, help="segundos hasta el primer token del LLM falso")
+    parser.add_argument("--tokens-por-segundo", type=float, default=200)
+    parser.add_argument("--tokens", type=int, default=150)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="guardar el informe en este archivo")
+    parser.add_argument("--base", help="informe JSON de referencia para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="empeoramiento de p95 admitido (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    servidor_llm = arrancar_servidor(0, ConfiguracionFalsa(args.latencia, args.tokens_por_segundo, args.tokens))
+    url_llm = f"http://127.0.0.1:{servidor_llm.server_port}"
+    informe = {"parametros": vars(args), "resultados": {}}
+
+    try:
+        for paginas in args.paginas:
+            print(f"📄 PDF de {paginas} página(s)")
+            # Un backend nuevo por tamaño: el RSS pico corresponde solo a ese documento
+            backend = Backend(url_llm, {})
+            try:
+                backend.esperar()
+                resultados = asyncio.run(ejecutar_tamano(backend, paginas, args))
+                informe["resultados"][str(paginas)] = {
+                    "endpoints": resultados, "rss_pico_mb": rss_pico_mb(backend.proceso.pid)
+                }
+            finally:
+                backend.detener()
+    finally:
+        servidor_llm.shutdown()
+
+    imprimir(informe)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+
+    if args.base:
+        regresiones = comparar_con_base(informe, args.base, args.tolerancia)
+        for regresion in regresiones:
+            print(f"❌ Regresión: {regresion}")
+        if regresiones:
+            sys.exit(1)
+        print("✅ Sin regresiones de p95 respecto a la referencia")
+
+
+if __name__ == "__main__":
+    main()
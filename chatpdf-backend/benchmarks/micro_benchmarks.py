@@ -0,0 +1,77 @@
+"""
+Micro-benchmarks de las partes de CPU del backend, sin red:
+extracción de texto del PDF, comparación TF-IDF de respuestas y generación del reporte.
+
+Uso (desde chatpdf-backend/):
+    python benchmarks/micro_benchmarks.py --repeticiones 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import timeit
+
+# La caché de extracción se desactiva para medir siempre la extracción real
+os.environ["PDF_CACHE_MAX_DOCS"] = "0"
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_utils import Consulta_ia_openai  # noqa: E402
+from pdf_utils import extract_text_from_pdf  # noqa: E402
+from report_utils import PROMPT_CASO_USO_DEFECTO, PROMPT_COMBINAR_DEFECTO, renderizar_reporte  # noqa: E402
+from sample_pdfs import TAMANOS, ruta_pdf  # noqa: E402
+
+RESPUESTA_LARGA = " ".join(
+    f"Según el artículo {i}, la organización debe documentar el control {i} y evaluar su eficacia."
+    for i in range(120)
+)
+
+
+def cronometrar(funcion, repeticiones: int, numero: int = 1) -> dict:
+    """Mínimo y mediana por llamada, en milisegundos"""
+    tiempos = [t / numero * 1000 for t in timeit.repeat(funcion, number=numero, repeat=repeticiones)]
+    return {"min_ms": round(min(tiempos), 2), "mediana_ms": round(statistics.median(tiempos), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks del backend")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--paginas", type=int, nargs="+", default=list(TAMANOS))
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    resultados = {}
+
+    for paginas in args.paginas:
+        ruta = ruta_pdf(paginas)
+        resultados[f"extract_text_from_pdf[{paginas}p]"] = cronometrar(
+            lambda: extract_text_from_pdf(ruta), args.repeticiones
+        )
+
+    ai = Consulta_ia_openai()
+    resultados["comparar_respuestas"] = cronometrar(
+        lambda: ai.comparar_respuestas(RESPUESTA_LARGA, RESPUESTA_LARGA[::-1]), args.repeticiones, numero=20
+    )
+
+    campos = {
+        "caso_uso": RESPUESTA_LARGA[:800], "respuesta_usuario": RESPUESTA_LARGA,
+        "respuesta_azure": RESPUESTA_LARGA, "respuesta_gemini": RESPUESTA_LARGA,
+        "respuesta_combinada": RESPUESTA_LARGA,
+    }
+    prompts = {"caso_uso": PROMPT_CASO_USO_DEFECTO, "combinar": PROMPT_COMBINAR_DEFECTO}
+    resultados["renderizar_reporte"] = cronometrar(
+        lambda: renderizar_reporte(campos, prompts, "2024-01-01"), args.repeticiones
+    )
+
+    print(f"{'benchmark':<36} {'min ms':>10} {'mediana ms':>12}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<36} {r['min_ms']:>10} {r['mediana_ms']:>12}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
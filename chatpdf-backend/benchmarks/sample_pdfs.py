@@ -0,0 +1,67 @@
+"""
+PDFs de ejemplo (1, 50 y 500 páginas) con estructura de documento normativo,
+generados con PyMuPDF para que los benchmarks no dependan de archivos externos.
+También una revisión (última página modificada) y una versión escaneada (sin capa de texto).
+"""
+import os
+import tempfile
+
+import fitz  # PyMuPDF
+
+TAMANOS = (1, 50, 500)
+
+PARRAFO = (
+    "La organización debe establecer, implementar y mantener un proceso documentado para "
+    "evaluar los riesgos de seguridad de la información del proceso {n}, considerando su "
+    "impacto en la confidencialidad, integridad y disponibilidad de los activos."
+)
+
+
+def generar_pdf(paginas: int, revision: bool = False) -> bytes:
+    """Documento con capítulos, artículos y cláusulas numeradas en cada página"""
+    documento = fitz.open()
+    for i in range(paginas):
+        pagina = documento.new_page()
+        if i % 10 == 0:
+            pagina.insert_text((72, 60), f"CAPÍTULO {i // 10 + 1}", fontsize=16)
+        rect = fitz.Rect(72, 80, 540, 770)
+        texto = "\n\n".join(
+            f"Artículo {i * 3 + j + 1}. {j + 1}.{i + 1} " + PARRAFO.format(n=i * 3 + j)
+            for j in range(3)
+        )
+        if revision and i == paginas - 1:
+            texto += "\n\nDisposición final. La presente revisión sustituye a la versión anterior."
+        pagina.insert_textbox(rect, texto, fontsize=10)
+    contenido = documento.tobytes()
+    documento.close()
+    return contenido
+
+
+def generar_pdf_escaneado(paginas: int) -> bytes:
+    """El mismo documento con cada página convertida en imagen, como un escaneo"""
+    original = fitz.open(stream=generar_pdf(paginas), filetype="pdf")
+    documento = fitz.open()
+    for pagina in original:
+        imagen = pagina.get_pixmap(dpi=150, colorspace=fitz.csGRAY)
+        nueva = documento.new_page(width=pagina.rect.width, height=pagina.rect.height)
+        nueva.insert_image(nueva.rect, stream=imagen.tobytes("png"))
+    contenido = documento.tobytes()
+    documento.close()
+    original.close()
+    return contenido
+
+
+def ruta_pdf(paginas: int, directorio: str = None, variante: str = "") -> str:
+    """Genera (una sola vez) el PDF de ejemplo de la variante indicada y devuelve su ruta"""
+    directorio = directorio or os.path.join(tempfile.gettempdir(), "chatpdf_benchmarks")
+    os.makedirs(directorio, exist_ok=True)
+    sufijo = f"_{variante}" if variante else ""
+    ruta = os.path.join(directorio, f"normativa_{paginas}p{sufijo}.pdf")
+    if not os.path.exists(ruta):
+        if variante == "escaneado":
+            contenido = generar_pdf_escaneado(paginas)
+        else:
+            contenido = generar_pdf(paginas, revision=variante == "revision")
+        with open(ruta, "wb") as f:
+            f.write(contenido)
+    return ruta
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+from shared_state import conectar_sqlite, ruta_compartida
+
+
+def calcular_doc_id(texto: str) -> str:
+    """ID de documento: hash SHA-256 del texto extraído"""
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+class DocumentStore:
+    """
+    Almacén de documentos en el servidor.
+    Mantiene un LRU en memoria y, opcionalmente, una copia en SQLite para que
+    los documentos sobrevivan a reinicios y a la expulsión del LRU.
+    Cada documento puede tener artefactos derivados (valores JSON por clave).
+    """
+
+    def __init__(self, max_documentos: int = 32, ruta_sqlite: Optional[str] = None):
+        self.max_documentos = max_documentos
+        self.ruta_sqlite = ruta_sqlite
+        self._memoria = OrderedDict()
+        self._artefactos = {}
+        self._lock = threading.Lock()
+
+        if self.ruta_sqlite:
+            with self._conectar() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS documentos (doc_id TEXT PRIMARY KEY, texto TEXT NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS artefactos ("
+                    "doc_id TEXT NOT NULL, clave TEXT NOT NULL, valor TEXT NOT NULL, "
+                    "PRIMARY KEY (doc_id, clave))"
+                )
+
+    def _conectar(self):
+        return conectar_sqlite(self.ruta_sqlite)
+
+    def _recordar(self, doc_id: str, texto: str):
+        self._memoria[doc_id] = texto
+        self._memoria.move_to_end(doc_id)
+        while len(self._memoria) > self.max_documentos:
+            expulsado, _ = self._memoria.popitem(last=False)
+            self._artefactos.pop(expulsado, None)
+
+    def guardar(self, texto: str) -> str:
+        """Guarda el texto y devuelve su doc_id (idempotente)"""
+        doc_id = calcular_doc_id(texto)
+        with self._lock:
+            self._recordar(doc_id, texto)
+
+        if self.ruta_sqlite:
+            try:
+                with self._conectar() as conn:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO documentos (doc_id, texto) VALUES (?, ?)",
+                        (doc_id, texto)
+                    )
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ No se pudo persistir el documento {doc_id}: {e}")
+        return doc_id
+
+    def obtener(self, doc_id: str) -> Optional[str]:
+        """Devuelve el texto del documento o None si no existe"""
+        with self._lock:
+            texto = self._memoria.get(doc_id)
+            if texto is not None:
+                self._memoria.move_to_end(doc_id)
+                return texto
+
+        if not self.ruta_sqlite:
+            return None
+
+        try:
+            with self._conectar() as conn:
+                fila = conn.execute(
+                    "SELECT texto FROM documentos WHERE doc_id = ?", (doc_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ No se pudo leer el documento {doc_id}: {e}")
+            return None
+
+        if fila is None:
+            return None
+        with self._lock:
+            self._recordar(doc_id, fila[0])
+        return fila[0]
+
+    def guardar_artefacto(self, doc_id: str, clave: str, valor: Any):
+        """Guarda un artefacto derivado del documento (debe ser serializable a JSON)"""
+        with self._lock:
+            self._artefactos.setdefault(doc_id, {})[clave] = valor
+
+        if self.ruta_sqlite:
+            try:
+                with self._conectar() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO artefactos (doc_id, clave, valor) VALUES (?, ?, ?)",
+                        (doc_id, clave, json.dumps(valor, ensure_ascii=False))
+                    )
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ No se pudo persistir el artefacto {clave} de {doc_id}: {e}")
+
+    def _artefacto_en_memoria(self, doc_id: str, clave: str, default: Any) -> Any:
+        with self._lock:
+            return self._artefactos.get(doc_id, {}).get(clave, default)
+
+    def obtener_artefacto(self, doc_id: str, clave: str, default: Any = None) -> Any:
+        """
+        Devuelve un artefacto del documento o default si no existe. Con SQLite se lee
+        siempre de la base: otro worker puede haberlo modificado (p. ej. el pool de casos).
+        """
+        if not self.ruta_sqlite:
+            return self._artefacto_en_memoria(doc_id, clave, default)
+
+        try:
+            with self._conectar() as conn:
+                fila = conn.execute(
+                    "SELECT valor FROM artefactos WHERE doc_id = ? AND clave = ?", (doc_id, clave)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ No se pudo leer el artefacto {clave} de {doc_id}: {e}")
+            return self._artefacto_en_memoria(doc_id, clave, default)
+
+        if fila is None:
+            return default
+        valor = json.loads(fila[0])
+        with self._lock:
+            self._artefactos.setdefault(doc_id, {})[clave] = valor
+        return valor
+
+    def actualizar_artefacto(self, doc_id: str, clave: str, funcion: Callable[[Any], Tuple[Any, Any]],
+                             default: Any = None) -> Any:
+        """
+        Lee, modifica y guarda un artefacto de forma atómica, también entre workers
+        (BEGIN IMMEDIATE en SQLite). funcion recibe el valor actual y devuelve
+        (nuevo valor, resultado); se devuelve el resultado.
+        """
+        if self.ruta_sqlite:
+            conn = self._conectar()
+            conn.isolation_level = None  # transacción explícita
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                fila = conn.execute(
+                    "SELECT valor FROM artefactos WHERE doc_id = ? AND clave = ?", (doc_id, clave)
+                ).fetchone()
+                valor, resultado = funcion(json.loads(fila[0]) if fila else default)
+                conn.execute(
+                    "INSERT OR REPLACE INTO artefactos (doc_id, clave, valor) VALUES (?, ?, ?)",
+                    (doc_id, clave, json.dumps(valor, ensure_ascii=False))
+                )
+                conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                logging.warning(f"⚠️ No se pudo actualizar el artefacto {clave} de {doc_id}: {e}")
+            else:
+                with self._lock:
+                    self._artefactos.setdefault(doc_id, {})[clave] = valor
+                return resultado
+            finally:
+                conn.close()
+
+        with self._lock:
+            artefactos = self._artefactos.setdefault(doc_id, {})
+            artefactos[clave], resultado = funcion(artefactos.get(clave, default))
+        return resultado
+
+    def __contains__(self, doc_id: str) -> bool:
+        return self.obtener(doc_id) is not None
+
+
+def crear_document_store() -> DocumentStore:
+    """Crea el almacén según las variables de entorno"""
+    return DocumentStore(
+        max_documentos=int(os.getenv("DOCUMENT_STORE_MAX_DOCS", "32")),
+        ruta_sqlite=ruta_compartida("DOCUMENT_STORE_SQLITE", "documentos.db")
+    )
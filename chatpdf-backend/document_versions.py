@@ -0,0 +1,72 @@
+import hashlib
+import os
+from difflib import SequenceMatcher
+from typing import List
+
+# Artefactos del documento: estado por página del PDF (pdf_utils.VersionPDF) y resumen
+# de los cambios respecto a la versión anterior
+CLAVE_VERSION_PDF = "version_pdf"
+CLAVE_REVISION = "revision"
+
+# Proporción mínima de líneas de un PDF que ya estaban en la versión anterior indicada
+MIN_LINEAS_COMUNES = float(os.getenv("VERSION_MIN_SHARED_LINES", "0.3"))
+# Líneas más cortas (números de página, viñetas) no cuentan para comparar versiones
+MIN_CARACTERES_LINEA = 20
+
+
+def _lineas(texto: str) -> set:
+    return {
+        " ".join(linea.split()).lower() for linea in texto.splitlines()
+        if len(linea.strip()) >= MIN_CARACTERES_LINEA
+    }
+
+
+def es_revision(texto_anterior: str, texto: str) -> bool:
+    """
+    Comprueba que un PDF sea de verdad una versión del anterior: una parte suficiente de sus
+    líneas ya estaba en él. Las huellas de página no sirven para esto (si cambia la numeración
+    o el pie, cambian todas).
+    """
+    lineas = _lineas(texto)
+    if not lineas:
+        return False
+    return len(lineas & _lineas(texto_anterior)) >= MIN_LINEAS_COMUNES * len(lineas)
+
+
+def comparar_paginas(huellas_anteriores: List[str], huellas: List[str]) -> dict:
+    """
+    Diferencias página a página entre dos versiones (por huella de contenido), alineadas
+    como un diff: una página insertada no marca como cambiadas todas las siguientes.
+    Los números de página empiezan en 1 (las eliminadas, en la numeración anterior).
+    """
+    resumen = {"unchanged": 0, "modified": [], "added": [], "removed": []}
+    comparador = SequenceMatcher(None, huellas_anteriores, huellas, autojunk=False)
+    for operacion, a1, a2, b1, b2 in comparador.get_opcodes():
+        if operacion == "equal":
+            resumen["unchanged"] += b2 - b1
+            continue
+        comunes = min(a2 - a1, b2 - b1) if operacion == "replace" else 0
+        resumen["modified"].extend(range(b1 + 1, b1 + comunes + 1))
+        resumen["added"].extend(range(b1 + comunes + 1, b2 + 1))
+        resumen["removed"].extend(range(a1 + comunes + 1, a2 + 1))
+    return resumen
+
+
+def _huellas_secciones(texto: str, secciones: List[dict]) -> dict:
+    return {
+        s["id"]: hashlib.sha1(texto[s["start"]:s["end"]].encode("utf-8")).hexdigest()
+        for s in secciones
+    }
+
+
+def comparar_secciones(texto_anterior: str, secciones_anteriores: List[dict],
+                       texto: str, secciones: List[dict]) -> dict:
+    """Ids de las secciones añadidas, eliminadas y con el texto modificado entre dos versiones"""
+    anteriores = _huellas_secciones(texto_anterior, secciones_anteriores)
+    actuales = _huellas_secciones(texto, secciones)
+    return {
+        "unchanged": sum(1 for i, h in actuales.items() if anteriores.get(i) == h),
+        "modified": [i for i, h in actuales.items() if i in anteriores and anteriores[i] != h],
+        "added": [i for i in actuales if i not in anteriores],
+        "removed": [i for i in anteriores if i not in actuales],
+    }
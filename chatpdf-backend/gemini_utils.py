@@ -1,14 +1,139 @@
 import google.generativeai as genai
+import datetime
+import hashlib
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
+from google.generativeai import caching
+from similarity_utils import similitud_textos
+from llm_cache import CacheLLM
+from prompt_budget import (PRESUPUESTOS, Contexto, ContextoDocumento, construir_prompt, contar_tokens, dividir_prompt,
+                           partes_contexto, prefijo_documento, seccion_fragmentos, seccion_indice,
+                           secciones_contexto)
+from provider_clients import ErrorProveedor, SolicitudRechazadaError, crear_circuito, crear_politica_reintentos
+from metrics import registrar_tokens
+from typing import Callable, Optional
 
 load_dotenv()
 
+
+class CacheContextoGemini:
+    """
+    Caché explícita de contexto de Gemini: un CachedContent por documento con el prefijo
+    estable del prompt (instrucciones + documento), con TTL. Se renueva cuando se usa cerca
+    de expirar y se borra al desalojarlo. Los prefijos por debajo del mínimo de tokens del
+    proveedor, o cuya creación falló, se envían completos como siempre.
+    """
+
+    def __init__(self, modelo: str, ttl_s: int = 3600, min_tokens: int = 32768, max_entradas: int = 16):
+        self.modelo = modelo
+        self.ttl_s = ttl_s
+        self.min_tokens = min_tokens
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()  # clave -> (cached_content, GenerativeModel, expira)
+        self._descartadas = set()
+        self._creando = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clave(prefijo: str) -> str:
+        return hashlib.sha256(prefijo.encode("utf-8")).hexdigest()
+
+    def _ttl(self) -> datetime.timedelta:
+        return datetime.timedelta(seconds=self.ttl_s)
+
+    def modelo_para(self, prefijo: str):
+        """GenerativeModel ligado al contenido cacheado del prefijo, o None si no aplica"""
+        clave = self.clave(prefijo)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                contenido, modelo, expira = entrada
+                restante = expira - time.time()
+                if restante > self.ttl_s / 4:
+                    self._entradas.move_to_end(clave)
+                    return modelo
+                del self._entradas[clave]
+            if clave in self._descartadas or clave in self._creando:
+                return None
+            self._creando.add(clave)
+
+        try:
+            if entrada is not None and restante > 0:
+                contenido.update(ttl=self._ttl())
+                logging.info(f"♻️ TTL renovado para el contexto cacheado de Gemini {clave[:12]}")
+            else:
+                # Un token ocupa al menos un carácter: los prefijos cortos ni se cuentan
+                if len(prefijo) < self.min_tokens or contar_tokens(prefijo) < self.min_tokens:
+                    return None
+                contenido = caching.CachedContent.create(
+                    model=self.modelo,
+                    display_name=f"chatpdf-{clave[:16]}",
+                    contents=[prefijo],
+                    ttl=self._ttl()
+                )
+                logging.info(f"📦 Contexto del documento cacheado en Gemini ({contenido.name})")
+            modelo = genai.GenerativeModel.from_cached_content(contenido)
+        except Exception as e:
+            logging.warning(f"⚠️ No se pudo cachear el contexto en Gemini, se envía sin caché: {e}")
+            with self._lock:
+                self._descartadas.add(clave)
+            return None
+        finally:
+            with self._lock:
+                self._creando.discard(clave)
+
+        with self._lock:
+            self._entradas[clave] = (contenido, modelo, time.time() + self.ttl_s)
+            desalojadas = []
+            while len(self._entradas) > self.max_entradas:
+                desalojadas.append(self._entradas.popitem(last=False)[1][0])
+        for vieja in desalojadas:
+            self._borrar(vieja)
+        return modelo
+
+    def invalidar(self, prefijo: str):
+        """Olvida el contenido cacheado (p. ej. si el proveedor ya no lo reconoce)"""
+        with self._lock:
+            entrada = self._entradas.pop(self.clave(prefijo), None)
+        if entrada is not None:
+            self._borrar(entrada[0])
+
+    @staticmethod
+    def _borrar(contenido):
+        try:
+            contenido.delete()
+        except Exception as e:
+            logging.warning(f"⚠️ No se pudo borrar el contexto cacheado de Gemini: {e}")
+
+
+def crear_cache_contexto(model_name: str) -> Optional[CacheContextoGemini]:
+    """
+    Caché de contexto según GEMINI_CONTEXT_CACHE; None si está desactivada o si el bloque de
+    documento de Gemini (PROMPT_BUDGET_DOCUMENTO_GEMINI) nunca alcanzaría el mínimo de tokens
+    """
+    if os.getenv("GEMINI_CONTEXT_CACHE", "1") != "1":
+        return None
+    min_tokens = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "32768"))
+    if PRESUPUESTOS["documento_gemini"] < min_tokens:
+        logging.warning(
+            f"⚠️ Caché de contexto de Gemini desactivada: el bloque de documento "
+            f"({PRESUPUESTOS['documento_gemini']} tokens) no llega al mínimo de {min_tokens}"
+        )
+        return None
+    return CacheContextoGemini(
+        modelo=os.getenv("GEMINI_CACHE_MODEL", f"models/{model_name}-002"),
+        ttl_s=int(os.getenv("GEMINI_CACHE_TTL_S", "3600")),
+        min_tokens=min_tokens,
+        max_entradas=int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "16"))
+    )
+
+
 class ConsultaIA_Gemini:
-    def __init__(self):
+    def __init__(self, cache: Optional[CacheLLM] = None, similitud: Optional[Callable[[str, str], float]] = None):
         self.api_key = os.getenv("GEMINI_API_KEY")  # Clave desde .env (¡nunca hardcodeada!)
         self.model_name = "gemini-1.5-flash"  # Modelo a usar
         
@@ -16,25 +141,48 @@ class ConsultaIA_Gemini:
             logging.error("❌ Falta la API Key de Gemini en variables de entorno.")
             raise ValueError("GEMINI_API_KEY no configurada.")
 
-        # Configuración inicial
-        genai.configure(api_key=self.api_key)
+        # Configuración inicial; GEMINI_API_ENDPOINT permite apuntar a un servidor local (REST)
+        endpoint = os.getenv("GEMINI_API_ENDPOINT")
+        if endpoint:
+            genai.configure(api_key=self.api_key, transport="rest", client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=self.api_key)
+
+        # El modelo (y su cliente/conexión) se crea una vez y se reutiliza
+        self.model = genai.GenerativeModel(self.model_name)
+        self.cache = cache
+        self.similitud = similitud or similitud_textos
+        self.reintentos = crear_politica_reintentos()
+        self.circuito = crear_circuito("gemini")
+        self.cache_contexto = crear_cache_contexto(self.model_name)
+
+    def _contexto_efectivo(self, contexto: Contexto) -> Contexto:
+        """
+        El bloque largo del documento solo se envía si su prefijo está (o queda) en la caché de
+        contexto; si la creación falla o no aplica, se usa el bloque normal para no mandarlo
+        completo sin cachear en cada llamada.
+        """
+        if not isinstance(contexto, ContextoDocumento) or contexto.reducido is None:
+            return contexto
+        if self.cache_contexto is not None and \
+                self.cache_contexto.modelo_para(prefijo_documento(contexto.documento, "documento_gemini")) is not None:
+            return contexto
+        return contexto.reducido
+
+    def _prompt_respuesta(self, texto_pdf: Contexto, escenario: str) -> str:
+        contexto = self._contexto_efectivo(texto_pdf)
+        documento, fragmentos = partes_contexto(contexto)
+
+        def plantilla(fragmentos, secciones, escenario):
+            return seccion_fragmentos(fragmentos) + seccion_indice(secciones) + f"""
+            Basa tu respuesta EXCLUSIVAMENTE en el documento anterior.
 
-    def generar_respuesta(self, texto_pdf: str, escenario: str) -> str:
-        
-        try:
-            prompt = f"""
-            Eres un experto en análisis normativo. Basa tu respuesta EXCLUSIVAMENTE en este documento:
-            
-            --- TEXTO NORMATIVO ---
-            {texto_pdf}
-            --- FIN DEL DOCUMENTO ---
-            
             Escenario a resolver:
             {escenario}
             
             Instrucciones:
-            1. Analiza el documento completo
-            2. Identifica artículos/secciones aplicables
+            1. Analiza los fragmentos del documento proporcionados
+            2. Identifica artículos/secciones aplicables (entre las secciones indicadas, si las hay, y con su título)
             3. Fundamenta tu respuesta citando los fragmentos relevantes
             4. Si el escenario no está regulado, indícalo claramente
             5. Estructura tu respuesta en:
@@ -44,26 +192,109 @@ class ConsultaIA_Gemini:
             
             Respuesta:
             """
-            
-            model = genai.GenerativeModel(self.model_name)
-            response = model.generate_content(prompt)
-            
-            if response.candidates and response.candidates[0].content.parts:
-                return response.candidates[0].content.parts[0].text
-            else:
-                logging.warning("⚠️ Gemini no devolvió contenido válido.")
-                return "No se pudo generar respuesta basada en la normativa."
-                
-        except Exception as e:
-            logging.error(f"Error en Gemini: {e}")
-            return "❌ Error al consultar la normativa con Gemini."
-        
+
+        return construir_prompt("respuesta_gemini", plantilla, [
+            ("fragmentos", fragmentos, 1, 0),
+            ("secciones", secciones_contexto(contexto), 2, 0),
+            ("escenario", escenario, 3, 0),
+        ], documento=documento, tipo_documento="documento_gemini")
+
+    def _clave_cache(self, prompt: str, usar_cache: bool) -> Optional[str]:
+        if self.cache is None or not usar_cache:
+            return None
+        return CacheLLM.clave(self.model_name, prompt, {})
+
+    def _generar(self, prompt: str, stream: bool = False):
+        """
+        generate_content con reintentos y circuito del proveedor. Si el prefijo del documento
+        está en la caché de contexto, solo se envía la parte variable del prompt.
+        """
+        prefijo, resto = dividir_prompt(prompt)
+        modelo = self.cache_contexto.modelo_para(prefijo) if self.cache_contexto and prefijo else None
+        if modelo is not None:
+            try:
+                return self.reintentos.ejecutar(
+                    "gemini", self.circuito, modelo.generate_content, resto, stream=stream
+                )
+            except SolicitudRechazadaError:
+                # El contenido cacheado expiró o se borró en el proveedor: se envía completo
+                self.cache_contexto.invalidar(prefijo)
+        return self.reintentos.ejecutar(
+            "gemini", self.circuito, self.model.generate_content, prompt, stream=stream
+        )
+
+    @staticmethod
+    def _tokens_cacheados(metadatos) -> int:
+        return getattr(metadatos, "cached_content_token_count", None) or 0
+
+    def generar_respuesta(self, texto_pdf: Contexto, escenario: str, usar_cache: bool = True) -> str:
+        """Lanza ErrorProveedor si Gemini no responde tras los reintentos"""
+        prompt = self._prompt_respuesta(texto_pdf, escenario)
+        clave = self._clave_cache(prompt, usar_cache)
+        if clave is not None:
+            guardado = self.cache.obtener(clave)
+            if guardado is not None:
+                return guardado
+
+        response = self._generar(prompt)
+        metadatos = getattr(response, "usage_metadata", None)
+        if metadatos is not None:
+            registrar_tokens("gemini", metadatos.prompt_token_count, metadatos.candidates_token_count,
+                             self._tokens_cacheados(metadatos))
+
+        if response.candidates and response.candidates[0].content.parts:
+            texto = response.candidates[0].content.parts[0].text
+            if clave is not None:
+                self.cache.guardar(clave, texto)
+            return texto
+        else:
+            # Sin candidatos (p. ej. bloqueado por seguridad): es un fallo, para que el router pase al otro proveedor
+            logging.warning("⚠️ Gemini no devolvió contenido válido.")
+            raise ErrorProveedor("gemini", "Gemini no devolvió contenido válido")
+
+    def generar_respuesta_stream(self, texto_pdf: Contexto, escenario: str, usar_cache: bool = True, uso: Optional[dict] = None):
+        """
+        Igual que generar_respuesta, pero devuelve el texto por partes a medida que se genera.
+        Si se pasa uso, al terminar se rellena con los tokens consumidos (usage_metadata).
+        """
+        prompt = self._prompt_respuesta(texto_pdf, escenario)
+        clave = self._clave_cache(prompt, usar_cache)
+        if clave is not None:
+            guardado = self.cache.obtener(clave)
+            if guardado is not None:
+                if uso is not None:
+                    uso.update(prompt_tokens=0, completion_tokens=0, total_tokens=0, cached_tokens=0, cache=True)
+                yield guardado
+                return
+
+        response = self._generar(prompt, stream=True)
+        partes = []
+        metadatos = None
+        for chunk in response:
+            if chunk.candidates and chunk.candidates[0].content.parts:
+                partes.append(chunk.candidates[0].content.parts[0].text)
+                yield partes[-1]
+            # Cada fragmento trae el consumo acumulado; el último es el total
+            metadatos = getattr(chunk, "usage_metadata", None)
+            if metadatos is not None and uso is not None:
+                uso.update(
+                    prompt_tokens=metadatos.prompt_token_count,
+                    completion_tokens=metadatos.candidates_token_count,
+                    total_tokens=metadatos.total_token_count,
+                    cached_tokens=self._tokens_cacheados(metadatos),
+                    cache=False
+                )
+
+        if metadatos is not None:
+            registrar_tokens("gemini", metadatos.prompt_token_count, metadatos.candidates_token_count,
+                             self._tokens_cacheados(metadatos))
+        if clave is not None and partes:
+            self.cache.guardar(clave, "".join(partes))
+
     def comparar_respuestas(self, respuesta_gemini: str, respuesta_usuario: str) -> float:
 
         try:
-            vectorizer = TfidfVectorizer().fit_transform([respuesta_gemini, respuesta_usuario])
-            similarity = cosine_similarity(vectorizer[0:1], vectorizer[1:2])
-            return round(float(similarity[0][0]), 2)
+            return self.similitud(respuesta_gemini, respuesta_usuario)
         except Exception as e:
             logging.error(f"Error al comparar respuestas: {e}")
             return 0.0  # Devuelve 0 si hay error
\ No newline at end of file
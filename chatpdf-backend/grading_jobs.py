@@ -0,0 +1,326 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+from prompt_budget import Contexto
+from shared_state import conectar_sqlite, ruta_compartida
+
+SIN_RESPUESTA = "(sin respuesta de referencia)"
+CRITERIOS = ("coherencia", "precision", "aplicabilidad")
+FUENTES = ("azure", "gemini", "usuario")
+
+
+def _proceso_vivo(pid: Optional[int]) -> bool:
+    # El propio pid no cuenta: al arrancar, este proceso aún no tiene trabajos (p. ej. pid 1 reiniciado)
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AlmacenTrabajos:
+    """
+    Estado y resultados de los trabajos de calificación (y de otros trabajos en segundo plano,
+    identificados por campo_id). LRU en memoria y, opcionalmente, copia en SQLite para
+    consultarlos tras un reinicio.
+    """
+
+    def __init__(self, max_trabajos: int = 256, ruta_sqlite: Optional[str] = None, campo_id: str = "job_id"):
+        self.max_trabajos = max_trabajos
+        self.ruta_sqlite = ruta_sqlite
+        self.campo_id = campo_id
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.ruta_sqlite:
+            with self._conectar() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS trabajos (job_id TEXT PRIMARY KEY, datos TEXT NOT NULL, pid INTEGER)"
+                )
+                try:
+                    conn.execute("ALTER TABLE trabajos ADD COLUMN pid INTEGER")
+                except sqlite3.OperationalError:
+                    pass  # la columna ya existe
+
+                # Los trabajos que quedaron a medias no se reanudan: la cola vive en el proceso.
+                # Con varios workers compartiendo la base solo se cierran los de procesos muertos
+                for job_id, datos, pid in conn.execute("SELECT job_id, datos, pid FROM trabajos").fetchall():
+                    trabajo = json.loads(datos)
+                    if trabajo["status"] in ("queued", "running") and not _proceso_vivo(pid):
+                        trabajo.update(status="failed", error="Interrumpido por un reinicio del servidor")
+                        conn.execute("UPDATE trabajos SET datos = ? WHERE job_id = ?",
+                                     (json.dumps(trabajo, ensure_ascii=False), job_id))
+
+    def _conectar(self):
+        return conectar_sqlite(self.ruta_sqlite)
+
+    def guardar(self, trabajo: dict):
+        job_id = trabajo[self.campo_id]
+        with self._lock:
+            self._memoria[job_id] = trabajo
+            self._memoria.move_to_end(job_id)
+            while len(self._memoria) > self.max_trabajos:
+                self._memoria.popitem(last=False)
+
+        if self.ruta_sqlite:
+            try:
+                with self._conectar() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO trabajos (job_id, datos, pid) VALUES (?, ?, ?)",
+                        (job_id, json.dumps(trabajo, ensure_ascii=False), os.getpid())
+                    )
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ No se pudo persistir el trabajo {job_id}: {e}")
+
+    def obtener(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            if job_id in self._memoria:
+                return self._memoria[job_id]
+
+        if not self.ruta_sqlite:
+            return None
+        try:
+            with self._conectar() as conn:
+                fila = conn.execute("SELECT datos FROM trabajos WHERE job_id = ?", (job_id,)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ No se pudo leer el trabajo {job_id}: {e}")
+            return None
+        return json.loads(fila[0]) if fila else None
+
+
+class ServicioCalificacion:
+    """
+    Califica en segundo plano las respuestas de un grupo de estudiantes contra el mismo caso:
+    genera una sola vez las respuestas de referencia (Azure y Gemini) y evalúa las
+    respuestas con paralelismo acotado, por defecto varias por llamada (empaquetado).
+    Cola en el proceso, sin broker externo.
+    """
+
+    def __init__(self, almacen: AlmacenTrabajos, planificador, ai, ai_gemini,
+                 concurrencia: int = 4, trabajadores: int = 1, empaquetado: bool = True):
+        self.almacen = almacen
+        self.planificador = planificador
+        self.ai = ai
+        self.ai_gemini = ai_gemini
+        self.concurrencia = concurrencia
+        self.trabajadores = trabajadores
+        self.empaquetado = empaquetado
+        self._cola = None
+        self._tareas = []
+        self._entradas = {}
+
+    def _iniciar(self):
+        # La cola se crea dentro del event loop del servidor, con el primer trabajo
+        if self._cola is None:
+            self._cola = asyncio.Queue()
+            self._tareas = [asyncio.create_task(self._trabajador()) for _ in range(self.trabajadores)]
+
+    def encolar(self, doc_id: str, escenario: str, respuestas: List[str], estudiantes: List[str],
+                contextos: dict, usar_cache: bool = True) -> dict:
+        """contextos: fragmentos del documento para 'azure', 'gemini' y 'evaluacion'"""
+        self._iniciar()
+        trabajo = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "created_at": time.time(),
+            "finished_at": None,
+            "doc_id": doc_id,
+            "scenario": escenario,
+            "total": len(respuestas),
+            "processed": 0,
+            "reference": {},
+            "results": [],
+            "error": None,
+        }
+        self._entradas[trabajo["job_id"]] = {
+            "respuestas": respuestas, "estudiantes": estudiantes,
+            "contextos": contextos, "usar_cache": usar_cache,
+        }
+        self.almacen.guardar(trabajo)
+        self._cola.put_nowait(trabajo["job_id"])
+        return trabajo
+
+    async def _trabajador(self):
+        while True:
+            job_id = await self._cola.get()
+            trabajo = self.almacen.obtener(job_id)
+            entrada = self._entradas.pop(job_id, None)
+            try:
+                if trabajo is not None and entrada is not None:
+                    await self._calificar(trabajo, entrada)
+            except Exception as e:
+                logging.error(f"❌ Falló el trabajo de calificación {job_id}: {e}")
+                trabajo.update(status="failed", error=getattr(e, "detail", None) or str(e), finished_at=time.time())
+                self.almacen.guardar(trabajo)
+            finally:
+                self._cola.task_done()
+
+    async def _referencias(self, trabajo: dict, entrada: dict) -> dict:
+        contextos, usar_cache = entrada["contextos"], entrada["usar_cache"]
+        azure, gemini = await asyncio.gather(
+            self.planificador.ejecutar("azure", self.ai.generar_respuesta,
+                                       contextos["azure"], trabajo["scenario"], usar_cache),
+            self.planificador.ejecutar("gemini", self.ai_gemini.generar_respuesta,
+                                       contextos["gemini"], trabajo["scenario"], usar_cache),
+            return_exceptions=True
+        )
+        if isinstance(azure, Exception) and isinstance(gemini, Exception):
+            raise azure
+        for nombre, valor in (("Azure", azure), ("Gemini", gemini)):
+            if isinstance(valor, Exception):
+                logging.warning(f"⚠️ Sin respuesta de referencia de {nombre} para el trabajo {trabajo['job_id']}: {valor}")
+        return {
+            "azure": SIN_RESPUESTA if isinstance(azure, Exception) else azure,
+            "gemini": SIN_RESPUESTA if isinstance(gemini, Exception) else gemini,
+        }
+
+    async def _calificar(self, trabajo: dict, entrada: dict):
+        trabajo["status"] = "running"
+        self.almacen.guardar(trabajo)
+
+        referencias = await self._referencias(trabajo, entrada)
+        trabajo["reference"] = referencias
+        self.almacen.guardar(trabajo)
+
+        if self.empaquetado:
+            resultados = await self._evaluar_empaquetado(trabajo, entrada, referencias)
+        else:
+            resultados = await self._evaluar_individual(trabajo, entrada, referencias)
+
+        trabajo.update(results=resultados, status="completed", finished_at=time.time())
+        self.almacen.guardar(trabajo)
+        logging.info(f"✅ Trabajo de calificación {trabajo['job_id']} completado ({trabajo['total']} respuestas)")
+
+    async def _evaluar_individual(self, trabajo: dict, entrada: dict, referencias: dict) -> list:
+        """Una llamada de evaluación por estudiante (3 respuestas cada una)"""
+        semaforo = asyncio.Semaphore(self.concurrencia)
+        resultados = [None] * trabajo["total"]
+
+        async def evaluar(indice: int, respuesta: str):
+            async with semaforo:
+                try:
+                    evaluacion = await self.planificador.ejecutar(
+                        "azure",
+                        self.ai.evaluar_calidad_respuestas,
+                        texto_pdf=entrada["contextos"]["evaluacion"],
+                        pregunta=trabajo["scenario"],
+                        respuesta_azure=referencias["azure"],
+                        respuesta_gemini=referencias["gemini"],
+                        respuesta_usuario=respuesta,
+                        usar_cache=entrada["usar_cache"]
+                    )
+                except Exception as e:
+                    evaluacion = {"error": getattr(e, "detail", None) or str(e)}
+            resultados[indice] = {"student_id": entrada["estudiantes"][indice], "response": respuesta, **evaluacion}
+            trabajo["processed"] += 1
+            self.almacen.guardar(trabajo)  # el progreso también lo consultan los otros workers
+
+        await asyncio.gather(*(evaluar(i, r) for i, r in enumerate(entrada["respuestas"])))
+        return resultados
+
+    def _evaluar_grupo(self, contexto: Contexto, pregunta: str, grupo: dict, referencias: dict, usar_cache: bool) -> dict:
+        """Evalúa un grupo empaquetado y calcula las similitudes de sus estudiantes con las referencias"""
+        evaluacion = self.ai.evaluar_candidatos(contexto, pregunta, grupo, usar_cache)
+        evaluacion["similitudes"] = {
+            id_candidato: (self.ai.comparar_respuestas(referencias["azure"], texto),
+                           self.ai.comparar_respuestas(referencias["gemini"], texto))
+            for id_candidato, texto in grupo.items() if id_candidato not in ("azure", "gemini")
+        }
+        return evaluacion
+
+    async def _evaluar_empaquetado(self, trabajo: dict, entrada: dict, referencias: dict) -> list:
+        """
+        Evalúa muchas respuestas por llamada: las referencias se puntúan una sola vez
+        (primer grupo) y cada grupo de estudiantes comparte el contexto del documento.
+        """
+        candidatos = {"azure": referencias["azure"], "gemini": referencias["gemini"]}
+        candidatos.update({f"estudiante_{i}": r for i, r in enumerate(entrada["respuestas"])})
+        grupos = self.ai.agrupar_candidatos(entrada["contextos"]["evaluacion"], trabajo["scenario"], candidatos)
+
+        semaforo = asyncio.Semaphore(self.concurrencia)
+        evaluaciones, similitudes, errores = {}, {}, {}
+
+        async def evaluar(grupo: dict):
+            estudiantes = [i for i in grupo if i not in ("azure", "gemini")]
+            async with semaforo:
+                try:
+                    resultado = await self.planificador.ejecutar(
+                        "azure", self._evaluar_grupo, entrada["contextos"]["evaluacion"], trabajo["scenario"],
+                        grupo, referencias, entrada["usar_cache"]
+                    )
+                    evaluaciones.update(resultado["evaluaciones"])
+                    similitudes.update(resultado["similitudes"])
+                    errores.update(resultado["errores"])
+                except Exception as e:
+                    errores.update({i: getattr(e, "detail", None) or str(e) for i in grupo})
+            trabajo["processed"] += len(estudiantes)
+            self.almacen.guardar(trabajo)
+
+        await asyncio.gather(*(evaluar(g) for g in grupos))
+
+        resultados = []
+        for i, respuesta in enumerate(entrada["respuestas"]):
+            id_candidato = f"estudiante_{i}"
+            fila = {"student_id": entrada["estudiantes"][i], "response": respuesta}
+            if id_candidato not in evaluaciones:
+                fila["error"] = errores.get(id_candidato, "Evaluación inválida")
+                resultados.append(fila)
+                continue
+            fila["similarity_azure"], fila["similarity_gemini"] = similitudes[id_candidato]
+            puntuaciones = {"usuario": {c: evaluaciones[id_candidato][c] for c in CRITERIOS}}
+            for fuente in ("azure", "gemini"):
+                if fuente in evaluaciones:
+                    puntuaciones[fuente] = {c: evaluaciones[fuente][c] for c in CRITERIOS}
+            fila["puntuaciones"] = puntuaciones
+            fila["analisis"] = evaluaciones[id_candidato]["comentario"]
+            fila["mejor_respuesta"] = max(puntuaciones, key=lambda f: sum(puntuaciones[f].values()))
+            resultados.append(fila)
+        return resultados
+
+
+def resultados_csv(trabajo: dict) -> str:
+    """Una fila por estudiante: similitudes, puntuaciones por fuente y criterio, y análisis"""
+    columnas = ["student_id", "similarity_azure", "similarity_gemini"]
+    columnas += [f"{fuente}_{criterio}" for fuente in FUENTES for criterio in CRITERIOS]
+    columnas += ["mejor_respuesta", "analisis", "error"]
+
+    salida = io.StringIO()
+    escritor = csv.DictWriter(salida, fieldnames=columnas)
+    escritor.writeheader()
+    for resultado in trabajo["results"]:
+        fila = {c: resultado.get(c, "") for c in ("student_id", "similarity_azure", "similarity_gemini",
+                                                   "mejor_respuesta", "analisis", "error")}
+        puntuaciones = resultado.get("puntuaciones") or {}
+        for fuente in FUENTES:
+            for criterio in CRITERIOS:
+                fila[f"{fuente}_{criterio}"] = (puntuaciones.get(fuente) or {}).get(criterio, "")
+        escritor.writerow(fila)
+    return salida.getvalue()
+
+
+def crear_servicio_calificacion(planificador, ai, ai_gemini) -> ServicioCalificacion:
+    """Crea el servicio con la configuración de las variables de entorno"""
+    almacen = AlmacenTrabajos(
+        max_trabajos=int(os.getenv("GRADE_JOBS_MAX", "256")),
+        ruta_sqlite=ruta_compartida("GRADE_JOBS_SQLITE", "trabajos.db")
+    )
+    return ServicioCalificacion(
+        almacen, planificador, ai, ai_gemini,
+        concurrencia=int(os.getenv("GRADE_JOB_CONCURRENCY", "4")),
+        trabajadores=int(os.getenv("GRADE_JOB_WORKERS", "1")),
+        empaquetado=os.getenv("GRADE_JOB_PACKED", "1") == "1"
+    )
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from shared_state import conectar_sqlite, ruta_compartida
+
+
+class CacheLLM:
+    """
+    Caché de respuestas de los modelos, compartida por ambos proveedores.
+    Nivel 1: LRU en memoria con TTL. Nivel 2 (opcional): SQLite, sobrevive a reinicios.
+    """
+
+    def __init__(self, max_entradas: int = 1024, ttl_segundos: int = 86400, ruta_sqlite: Optional[str] = None):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.ruta_sqlite = ruta_sqlite
+        self.hits = 0
+        self.misses = 0
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.ruta_sqlite:
+            with self._conectar() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS respuestas (clave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira REAL NOT NULL)"
+                )
+
+    def _conectar(self):
+        return conectar_sqlite(self.ruta_sqlite)
+
+    @staticmethod
+    def clave(modelo: str, prompt: str, parametros: dict) -> str:
+        """Clave de caché: hash de (modelo, prompt, parámetros de muestreo)"""
+        contenido = json.dumps(
+            {"modelo": modelo, "prompt": prompt, "parametros": parametros},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    def _recordar(self, clave: str, valor: str, expira: float):
+        self._memoria[clave] = (valor, expira)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+
+    def _leer_sqlite(self, clave: str):
+        try:
+            with self._conectar() as conn:
+                return conn.execute(
+                    "SELECT valor, expira FROM respuestas WHERE clave = ?", (clave,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ No se pudo leer la caché en disco: {e}")
+            return None
+
+    def obtener(self, clave: str) -> Optional[str]:
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None and entrada[1] > ahora:
+                self._memoria.move_to_end(clave)
+                self.hits += 1
+                return entrada[0]
+            if entrada is not None:
+                del self._memoria[clave]
+
+        if self.ruta_sqlite:
+            fila = self._leer_sqlite(clave)
+            if fila is not None and fila[1] > ahora:
+                with self._lock:
+                    self._recordar(clave, fila[0], fila[1])
+                    self.hits += 1
+                return fila[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def guardar(self, clave: str, valor: str):
+        expira = time.time() + self.ttl_segundos
+        with self._lock:
+            self._recordar(clave, valor, expira)
+
+        if self.ruta_sqlite:
+            try:
+                with self._conectar() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO respuestas (clave, valor, expira) VALUES (?, ?, ?)",
+                        (clave, valor, expira)
+                    )
+                    conn.execute("DELETE FROM respuestas WHERE expira <= ?", (time.time(),))
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ No se pudo guardar en la caché en disco: {e}")
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "entradas_memoria": len(self._memoria)
+            }
+
+
+def crear_cache_llm() -> CacheLLM:
+    """Crea la caché según las variables de entorno"""
+    return CacheLLM(
+        max_entradas=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+        ttl_segundos=int(os.getenv("LLM_CACHE_TTL_S", "86400")),
+        ruta_sqlite=ruta_compartida("LLM_CACHE_SQLITE", "cache_llm.db")
+    )
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from metrics import DURACION_LLM
+
+
+class ColaLlenaError(HTTPException):
+    """La cola del proveedor está llena: se responde 429 con Retry-After"""
+
+    def __init__(self, proveedor: str, retry_after: int):
+        super().__init__(
+            status_code=429,
+            detail=f"El servicio {proveedor} está saturado, inténtalo de nuevo en unos segundos",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+class _EstadoProveedor:
+    def __init__(self, nombre: str, concurrencia: int, max_cola: int):
+        self.nombre = nombre
+        self.concurrencia = concurrencia
+        self.max_cola = max_cola
+        self.executor = ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix=f"llm-{nombre}")
+        self.semaforo = asyncio.Semaphore(concurrencia)
+        self.en_espera = 0
+        self.en_curso = 0
+
+
+class PlanificadorLLM:
+    """
+    Ejecuta las llamadas bloqueantes de los SDK fuera del event loop.
+    Cada proveedor tiene su propio pool de hilos, un límite de llamadas
+    concurrentes y una cola acotada; si la cola se llena se rechaza con 429.
+    """
+
+    def __init__(self, limites: dict, retry_after: int = 5):
+        self.retry_after = retry_after
+        self._proveedores = {
+            nombre: _EstadoProveedor(nombre, concurrencia, max_cola)
+            for nombre, (concurrencia, max_cola) in limites.items()
+        }
+
+    @asynccontextmanager
+    async def ranura(self, proveedor: str):
+        """Reserva un hueco de ejecución para el proveedor y devuelve su executor"""
+        estado = self._proveedores[proveedor]
+        if estado.semaforo.locked() and estado.en_espera >= estado.max_cola:
+            logging.warning(f"⚠️ Cola de {proveedor} llena ({estado.en_espera} en espera)")
+            raise ColaLlenaError(proveedor, self.retry_after)
+
+        estado.en_espera += 1
+        try:
+            await estado.semaforo.acquire()
+        finally:
+            estado.en_espera -= 1
+
+        estado.en_curso += 1
+        try:
+            yield estado.executor
+        finally:
+            estado.en_curso -= 1
+            estado.semaforo.release()
+
+    async def ejecutar(self, proveedor: str, funcion, *args, **kwargs):
+        """Ejecuta funcion(*args, **kwargs) en el pool del proveedor"""
+        async with self.ranura(proveedor) as executor:
+            loop = asyncio.get_running_loop()
+            with DURACION_LLM.medir(provider=proveedor):
+                futuro = loop.run_in_executor(executor, functools.partial(funcion, *args, **kwargs))
+                try:
+                    return await asyncio.shield(futuro)
+                except asyncio.CancelledError:
+                    # El hilo no se puede interrumpir: la ranura sigue ocupada hasta que termine
+                    await asyncio.gather(futuro, return_exceptions=True)
+                    raise
+
+    async def iterar(self, proveedor: str, generador, *args, **kwargs):
+        """Consume un generador bloqueante (streaming del SDK) en el pool del proveedor"""
+        async with self.ranura(proveedor) as executor:
+            loop = asyncio.get_running_loop()
+            partes = generador(*args, **kwargs)
+            fin = object()
+            inicio = time.perf_counter()
+            try:
+                while True:
+                    parte = await loop.run_in_executor(executor, next, partes, fin)
+                    if parte is fin:
+                        break
+                    yield parte
+            finally:
+                DURACION_LLM.observar(time.perf_counter() - inicio, provider=proveedor)
+                try:
+                    await loop.run_in_executor(executor, partes.close)
+                except ValueError:
+                    # Un hilo sigue dentro de next(): el generador se descarta al terminar
+                    pass
+
+    def estado(self) -> dict:
+        return {
+            nombre: {"en_curso": e.en_curso, "en_espera": e.en_espera,
+                     "concurrencia": e.concurrencia, "max_cola": e.max_cola}
+            for nombre, e in self._proveedores.items()
+        }
+
+
+def crear_planificador() -> PlanificadorLLM:
+    """Crea el planificador con los límites de las variables de entorno"""
+    return PlanificadorLLM(
+        limites={
+            "azure": (int(os.getenv("AZURE_MAX_CONCURRENCY", "8")), int(os.getenv("AZURE_MAX_QUEUE", "32"))),
+            "gemini": (int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")), int(os.getenv("GEMINI_MAX_QUEUE", "32"))),
+        },
+        retry_after=int(os.getenv("LLM_RETRY_AFTER_S", "5"))
+    )
@@ -1,18 +1,136 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pdf_utils import extract_text_from_pdf
-from ai_utils import Consulta_ia_openai
-from gemini_utils import ConsultaIA_Gemini
+from starlette.concurrency import run_in_threadpool
+from upload_utils import MiddlewareLimiteSubida, recibir_pdf
+from document_store import crear_document_store
+from document_versions import CLAVE_REVISION, CLAVE_VERSION_PDF, comparar_paginas, comparar_secciones, es_revision
+from llm_cache import crear_cache_llm
+from llm_scheduler import crear_planificador
+from streaming_utils import flujo_texto, fusionar_flujos
+from prompt_budget import ContextoDocumento, caracteres_para
+from provider_clients import ErrorProveedor
+from provider_router import crear_router
+from grading_jobs import resultados_csv
+from startup_utils import EstadoArranque, MiddlewareArranque, ProveedorNoDisponible
+from metrics import CACHE_LLM, LLM_EN_CURSO, LLM_EN_ESPERA, MiddlewareMetricas, RutaMedida, registro
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import asyncio
 import os
 import logging
-from fpdf import FPDF
 from datetime import datetime
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pathlib import Path
 
-app = FastAPI()
-ai = Consulta_ia_openai()
-ai_gemini = ConsultaIA_Gemini()
+# Estado ligero, disponible desde la importación (con SHARED_STATE_DIR lo comparten todos los workers)
+cache_llm = crear_cache_llm()
+documentos = crear_document_store()
+planificador = crear_planificador()
+router = crear_router(planificador)
+
+# Clientes de IA y módulos pesados (PyMuPDF, scikit-learn, fpdf, SDKs): se crean en inicializar()
+ai = None
+ai_gemini = None
+motor_semantico = None
+indices = None
+reportes = None
+pool_casos = None
+calificaciones = None
+servicio_ocr = None
+sesiones = None
+
+arranque = EstadoArranque(timeout=float(os.getenv("STARTUP_TIMEOUT_S", "60")))
+
+def _crear_proveedor(nombre: str, crear):
+    """Un proveedor sin configurar no impide arrancar: sus endpoints responden 503"""
+    try:
+        cliente = crear()
+        arranque.componentes[nombre] = "ok"
+        return cliente
+    except Exception as e:
+        logging.error(f"❌ {nombre} no disponible: {e}")
+        arranque.componentes[nombre] = f"no disponible: {e}"
+        return ProveedorNoDisponible(nombre, str(e))
+
+def inicializar(estado: EstadoArranque):
+    """Importa los módulos pesados y crea los servicios (en un hilo, tras empezar a escuchar)"""
+    global ai, ai_gemini, motor_semantico, indices, reportes, pool_casos, calificaciones, servicio_ocr, sesiones
+    from ai_utils import Consulta_ia_openai
+    from gemini_utils import ConsultaIA_Gemini
+    from grading_jobs import crear_servicio_calificacion
+    from ocr_jobs import crear_servicio_ocr
+    from report_utils import GeneradorReportes, cargar_prompts
+    from retrieval_utils import RegistroIndices
+    from semantic_similarity import crear_motor_similitud
+    from session_pipeline import crear_servicio_sesiones
+    from use_case_pool import PoolCasosDeUso
+    import similarity_utils  # noqa: F401 (scikit-learn queda cargado antes de la primera petición)
+
+    # Similitud por embeddings (SIMILARITY_BACKEND=semantic); None mantiene TF-IDF
+    motor_semantico = crear_motor_similitud()
+    similitud = motor_semantico.similitud if motor_semantico else None
+    ai = _crear_proveedor("azure", lambda: Consulta_ia_openai(cache=cache_llm, similitud=similitud))
+    ai_gemini = _crear_proveedor("gemini", lambda: ConsultaIA_Gemini(cache=cache_llm, similitud=similitud))
+
+    indices = RegistroIndices()
+    reportes = GeneradorReportes(
+        prompts=cargar_prompts(os.path.join(os.path.dirname(__file__), "prompt.txt")),
+        procesos=int(os.getenv("REPORT_WORKERS", "2"))
+    )
+
+    # Casos de uso pre-generados por documento (0 desactiva el pool)
+    pool_casos = PoolCasosDeUso(
+        documentos, indices, planificador, ai,
+        tamano=int(os.getenv("USE_CASE_POOL_SIZE", "0")),
+        minimo=int(os.getenv("USE_CASE_POOL_MIN", "1")),
+        max_caracteres=CONTEXTO_CASO_USO,
+        max_documento=CONTEXTO_DOCUMENTO
+    )
+
+    # Calificación de grupos en segundo plano (/jobs/grade_batch)
+    calificaciones = crear_servicio_calificacion(planificador, ai, ai_gemini)
+
+    # OCR en segundo plano de las páginas escaneadas (/ocr_jobs/{job_id})
+    servicio_ocr = crear_servicio_ocr(registrar_documento)
+
+    # Sesiones de análisis completas en el servidor (/sessions)
+    sesiones = crear_servicio_sesiones()
+    estado.componentes["similarity"] = "semantic" if motor_semantico else "tfidf"
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    arranque.iniciar(inicializar)
+    yield
+    cerrar_pools()
+
+def cerrar_pools():
+    """Los procesos hijos no terminan solos: heredan el socket y los manejadores de señales de uvicorn"""
+    from pdf_utils import cerrar_pool as cerrar_pool_extraccion
+    if reportes is not None:
+        reportes.cerrar()
+    cerrar_pool_extraccion()
+
+app = FastAPI(lifespan=ciclo_de_vida)
+app.router.route_class = RutaMedida
+
+@app.exception_handler(ErrorProveedor)
+async def error_proveedor_handler(request, exc: ErrorProveedor):
+    """Un proveedor de IA no disponible se informa como 503 (con Retry-After si el circuito está abierto)"""
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    return JSONResponse(status_code=503, content={"detail": exc.detail}, headers=headers)
+
+# Las peticiones esperan a que termine inicializar(); /ready y /metrics responden siempre
+app.add_middleware(MiddlewareArranque, estado=arranque, exentas=("/ready", "/metrics"))
+
+# Duración de cada petición por endpoint (ver /metrics)
+app.add_middleware(MiddlewareMetricas)
+
+# Configuración de subida: el archivo se recibe por bloques, así que el límite no depende de la RAM
+MAX_FILE_SIZE_MB = int(os.getenv("MAX_UPLOAD_MB", "100"))
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or None  # None: directorio temporal del sistema
+app.add_middleware(MiddlewareLimiteSubida, rutas=("/upload_pdf/",), max_mb=MAX_FILE_SIZE_MB)
+# El cliente trabaja con doc_id: el texto completo solo se devuelve si se pide (include_text)
+CARACTERES_VISTA_PREVIA = int(os.getenv("UPLOAD_PREVIEW_CHARS", "1000"))
 
 # Configuración CORS (ajusta esto en producción)
 app.add_middleware(
@@ -23,13 +141,154 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configuración de directorios
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-MAX_FILE_SIZE_MB = 10  # Límite de 10MB para los PDFs
+# Contexto preseleccionado del documento (caracteres), según el presupuesto de tokens de cada llamada
+CONTEXTO_DOCUMENTO = caracteres_para("documento")
+CONTEXTO_DOCUMENTO_GEMINI = caracteres_para("documento_gemini")
+CONTEXTO_RESPUESTA = caracteres_para("respuesta")
+CONTEXTO_RESPUESTA_GEMINI = caracteres_para("respuesta_gemini")
+CONTEXTO_CASO_USO = caracteres_para("caso_de_uso")
+CONTEXTO_EVALUACION = caracteres_para("evaluacion")
+CONTEXTO_COMBINACION = caracteres_para("combinacion")
+
+# Artefacto del documento con el índice de secciones (/documents/{doc_id}/sections)
+CLAVE_SECCIONES = "secciones"
+MAX_SECCIONES_CONSULTA = int(os.getenv("PROMPT_MAX_SECTIONS", "8"))
+
+async def registrar_documento(texto: str, anterior_id: Optional[str] = None) -> str:
+    """
+    Guarda el texto extraído, lo indexa y programa sus casos de uso; devuelve el doc_id.
+    Si es una nueva versión de anterior_id, reutiliza su índice y los casos de uso vigentes.
+    """
+    doc_id = documentos.guardar(texto)
+    texto_anterior = documentos.obtener(anterior_id) if anterior_id and anterior_id != doc_id else None
+    if texto_anterior is not None:
+        indice = await run_in_threadpool(indices.revisar, doc_id, texto, anterior_id, texto_anterior)
+        pool_casos.heredar(anterior_id, doc_id, indice)
+    else:
+        await run_in_threadpool(indices.obtener, doc_id, texto)
+    pool_casos.programar_relleno(doc_id, texto)
+    return doc_id
+
+def version_anterior(anterior_id: Optional[str]):
+    """(VersionPDF, texto) de la versión previa, o None si no hay una registrada"""
+    if not anterior_id:
+        return None
+    datos = documentos.obtener_artefacto(anterior_id, CLAVE_VERSION_PDF)
+    texto = documentos.obtener(anterior_id)
+    if datos is None or texto is None:
+        logging.warning(f"⚠️ Versión anterior {anterior_id} no disponible: se procesa el PDF completo")
+        return None
+    from pdf_utils import VersionPDF
+    return VersionPDF.desde_json(datos), texto
+
+def resumen_revision(anterior_id: str, anterior, doc_id: str, texto: str, version, secciones: List[dict],
+                     procesadas: int) -> dict:
+    """Cambios respecto a la versión anterior (se guarda como artefacto de la nueva)"""
+    version_previa, texto_anterior = anterior
+    return {
+        "previous_doc_id": anterior_id,
+        "pages_processed": procesadas,
+        "pages": comparar_paginas(version_previa.huellas, version.huellas),
+        "sections": comparar_secciones(
+            texto_anterior, obtener_secciones(anterior_id, texto_anterior), texto, secciones
+        ),
+        "use_cases_kept": pool_casos.disponibles(doc_id),
+    }
+
+# Tiempo máximo por proveedor en los endpoints de streaming (segundos)
+TIMEOUTS_PROVEEDOR = {
+    "azure": float(os.getenv("AZURE_TIMEOUT_S", "60")),
+    "gemini": float(os.getenv("GEMINI_TIMEOUT_S", "60")),
+}
+
+def respuesta_sse(flujos: dict, usos: Optional[dict] = None) -> StreamingResponse:
+    """Transmite los flujos por SSE: tokens a medida que llegan y un resumen final por proveedor"""
+    return StreamingResponse(
+        fusionar_flujos(flujos, TIMEOUTS_PROVEEDOR, usos),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def resolver_documento(doc_id: Optional[str], pdf_text: Optional[str]):
+    """Obtiene (doc_id, texto) a partir de doc_id, o de pdf_text como respaldo"""
+    if doc_id:
+        texto = documentos.obtener(doc_id)
+        if texto is not None:
+            return doc_id, texto
+        if not pdf_text:
+            raise HTTPException(
+                status_code=404,
+                detail="Documento no encontrado, vuelve a subir el PDF"
+            )
+    if not pdf_text or not pdf_text.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="El texto del PDF no puede estar vacío"
+        )
+    return documentos.guardar(pdf_text), pdf_text
+
+def obtener_secciones(doc_id: str, texto: str) -> List[dict]:
+    """Índice de secciones del documento; sin PDF (texto pegado u OCR) se construye del texto"""
+    secciones = documentos.obtener_artefacto(doc_id, CLAVE_SECCIONES)
+    if secciones is None:
+        from pdf_utils import TextoExtraido, indexar_secciones
+        secciones = indexar_secciones(TextoExtraido(doc_id, texto, [(0, len(texto))]))
+        documentos.guardar_artefacto(doc_id, CLAVE_SECCIONES, secciones)
+    return secciones
+
+def secciones_consulta(doc_id: str, texto: str, fragmentos) -> str:
+    """
+    Entradas del índice de secciones (id/título/página) que contienen los fragmentos más
+    relevantes, para que el modelo cite los artículos tal como están indexados
+    """
+    secciones = obtener_secciones(doc_id, texto)
+    lineas = []
+    for fragmento in fragmentos:
+        # La sección más profunda que contiene el inicio del fragmento
+        seccion = max((s for s in secciones if s["start"] <= fragmento.inicio < s["end"]),
+                      key=lambda s: s["level"], default=None)
+        if seccion is None:
+            continue
+        linea = f"- {seccion['title']} (id {seccion['id']}, pág. {seccion['page_start']})"
+        if linea not in lineas:
+            lineas.append(linea)
+    return "\n".join(lineas[:MAX_SECCIONES_CONSULTA])
+
+def seleccionar_contexto(doc_id: str, texto: str, consulta: str, max_caracteres: int,
+                         max_documento: int = CONTEXTO_DOCUMENTO) -> ContextoDocumento:
+    """
+    Bloque fijo del documento (el mismo prefijo en todas sus llamadas, sin importar la consulta)
+    y los fragmentos más relevantes para la consulta que no están ya en ese bloque. Con un
+    bloque mayor que el normal se incluye también la selección normal, por si no se cachea.
+    """
+    indice = indices.obtener(doc_id, texto)
+    bloque = indice.seleccion_representativa(max_documento)
+    reducido = None
+    if max_documento > CONTEXTO_DOCUMENTO:
+        reducido = seleccionar_contexto(doc_id, texto, consulta, max_caracteres)
+    return ContextoDocumento(
+        indice.contexto_representativo(max_documento),
+        indice.contexto(consulta, max_caracteres, excluir=bloque),
+        reducido=reducido,
+        secciones=secciones_consulta(doc_id, texto, indice.buscar(consulta))
+    )
+
+def contexto_caso_de_uso(doc_id: str, texto: str) -> ContextoDocumento:
+    """Bloque fijo del documento y una muestra representativa del resto"""
+    indice = indices.obtener(doc_id, texto)
+    bloque = indice.seleccion_representativa(CONTEXTO_DOCUMENTO)
+    return ContextoDocumento(
+        indice.contexto_representativo(CONTEXTO_DOCUMENTO),
+        indice.contexto_representativo(CONTEXTO_CASO_USO, excluir=bloque)
+    )
 
 @app.post("/upload_pdf/")
-async def upload_pdf(file: UploadFile = File(...)):
+async def upload_pdf(
+    file: UploadFile = File(...),
+    previous_doc_id: Optional[str] = Form(None),
+    include_text: bool = False
+):
+    ruta = None
     try:
         # Validación del tipo de archivo
         if not file.filename.lower().endswith('.pdf'):
@@ -38,52 +297,105 @@ async def upload_pdf(file: UploadFile = File(...)):
                 detail="Solo se permiten archivos PDF"
             )
 
-        # Validación del tamaño del archivo
-        contents = await file.read()
-        if len(contents) > MAX_FILE_SIZE_MB * 1024 * 1024:
-            raise HTTPException(
-                status_code=413,
-                detail=f"El archivo excede el tamaño máximo de {MAX_FILE_SIZE_MB}MB"
-            )
+        # Validación del tamaño por bloques al recibir (el Content-Length ya lo filtró el middleware)
+        ruta, sha256 = await recibir_pdf(file, MAX_FILE_SIZE_MB, UPLOAD_TMP_DIR)
+
+        # Extracción de texto desde el archivo temporal (cacheada por SHA-256). Si es una nueva
+        # versión de un PDF ya subido (previous_doc_id), solo se procesan las páginas que cambiaron
+        from pdf_utils import extraer_version, indexar_secciones, ocr_disponible, paginas_sin_texto
+        anterior_id = previous_doc_id
+        anterior = version_anterior(anterior_id)
+        extraido, version, procesadas = await run_in_threadpool(extraer_version, ruta, sha256, anterior)
+        text = extraido.texto
+        if anterior is not None and not es_revision(anterior[1], text):
+            # Solo se reutilizaron páginas idénticas; no se compara ni se heredan sus casos de uso
+            logging.warning(f"⚠️ El PDF no parece una versión de {anterior_id}: se trata como documento nuevo")
+            anterior = None
 
-        # Guardado temporal del archivo
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        # Índice de capítulos/artículos/cláusulas con la fuente de cada línea (para las citas)
+        secciones = await run_in_threadpool(indexar_secciones, extraido, ruta, version) if text.strip() else []
 
-        # Extracción de texto
-        text = extract_text_from_pdf(file_path)
-        
-        # Eliminación del archivo temporal
-        os.remove(file_path)
+        # Páginas escaneadas: OCR en segundo plano solo de las páginas sin capa de texto
+        sin_texto = paginas_sin_texto(extraido)
+        trabajo_ocr = None
+        if sin_texto and ocr_disponible():
+            trabajo_ocr = servicio_ocr.encolar(ruta, sha256, len(extraido.paginas), len(sin_texto))
+            ruta = None  # el trabajo borra el archivo al terminar
 
         if not text.strip():
-            raise HTTPException(
-                status_code=422,
-                detail="No se pudo extraer texto del PDF (puede ser un PDF escaneado o protegido)"
-            )
+            if trabajo_ocr is None:
+                raise HTTPException(
+                    status_code=422,
+                    detail="No se pudo extraer texto del PDF (puede ser un PDF escaneado o protegido)"
+                )
+            return JSONResponse(status_code=202, content={
+                "ocr_job_id": trabajo_ocr["job_id"],
+                "status": trabajo_ocr["status"],
+                "pages": len(extraido.paginas),
+                "ocr_pages": len(sin_texto)
+            })
 
-        return {"text": text}
+        doc_id = await registrar_documento(text, anterior_id if anterior else None)
+        documentos.guardar_artefacto(doc_id, CLAVE_SECCIONES, secciones)
+        documentos.guardar_artefacto(doc_id, CLAVE_VERSION_PDF, version.a_json())
+        respuesta = {
+            "doc_id": doc_id, "pages": len(extraido.paginas), "sections": len(secciones),
+            "preview": text[:CARACTERES_VISTA_PREVIA]
+        }
+        if include_text:
+            respuesta["text"] = text
+        if anterior is not None and anterior_id != doc_id:
+            revision = resumen_revision(anterior_id, anterior, doc_id, text, version, secciones, len(procesadas))
+            documentos.guardar_artefacto(doc_id, CLAVE_REVISION, revision)
+            respuesta["revision"] = revision
+        if trabajo_ocr is not None:
+            # Documento mixto: ya se puede usar; el OCR entregará un doc_id con el texto completo
+            respuesta["ocr_job_id"] = trabajo_ocr["job_id"]
+        return respuesta
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error al procesar PDF: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Error al procesar el archivo: {str(e)}"
         )
+    finally:
+        if ruta:
+            os.unlink(ruta)
 
 @app.post("/solve_case/")
-async def solve_case(pdf_text: str = Form(...), scenario: str = Form(...)):
+async def solve_case(
+    scenario: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
+    hedge: bool = Form(False)
+):
+    """
+    Respuesta de Azure; solo si Azure falla responde Gemini (provider lo indica).
+    Con hedge=true, si Azure tarda más que su p95 se lanza también Gemini y gana el primero.
+    """
     try:
-        if not pdf_text.strip() or not scenario.strip():
+        if not scenario.strip():
             raise HTTPException(
                 status_code=400,
                 detail="El texto del PDF y el escenario no pueden estar vacíos"
             )
+        doc_id, texto = resolver_documento(doc_id, pdf_text)
+        contexto = seleccionar_contexto(doc_id, texto, scenario, CONTEXTO_RESPUESTA)
+        contexto_gemini = seleccionar_contexto(doc_id, texto, scenario, CONTEXTO_RESPUESTA_GEMINI, CONTEXTO_DOCUMENTO_GEMINI)
 
-        response = ai.generar_respuesta(pdf_text, scenario)
-        return {"ai_response": response}
+        # Proveedor primario con failover; la petición de cobertura solo si el cliente la pide
+        proveedor, response = await router.resolver({
+            "azure": (ai.generar_respuesta, (contexto, scenario, not no_cache)),
+            "gemini": (ai_gemini.generar_respuesta, (contexto_gemini, scenario, not no_cache)),
+        }, cobertura=hedge)
+        return {"ai_response": response, "provider": proveedor}
 
+    except (HTTPException, ErrorProveedor):
+        raise
     except Exception as e:
         logging.error(f"Error al generar respuesta: {str(e)}")
         raise HTTPException(
@@ -91,6 +403,13 @@ async def solve_case(pdf_text: str = Form(...), scenario: str = Form(...)):
             detail="Ocurrió un error al procesar tu solicitud"
         )
 
+def comparar_textos(respuesta: str, respuesta_usuario: str) -> float:
+    """Similitud entre dos respuestas; es local, no necesita la clave de ningún proveedor"""
+    if motor_semantico is not None:
+        return motor_semantico.similitud(respuesta, respuesta_usuario)
+    from similarity_utils import similitud_textos
+    return similitud_textos(respuesta, respuesta_usuario)
+
 @app.post("/compare_responses/")
 async def compare(
     ai_response: str = Form(...),
@@ -103,12 +422,14 @@ async def compare(
                 detail="Ambas respuestas deben contener texto"
             )
 
-        similarity_score = ai.comparar_respuestas(ai_response, user_response)
+        similarity_score = comparar_textos(ai_response, user_response)
         return {
             "similarity": similarity_score,
             "interpretation": interpret_similarity(similarity_score)
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error al comparar respuestas: {str(e)}")
         raise HTTPException(
@@ -116,23 +437,37 @@ async def compare(
             detail="Ocurrió un error al comparar las respuestas"
         )
     
+async def generar_caso_de_uso(doc_id: str, texto: str, usar_cache: bool) -> dict:
+    """Caso de uso del pool pre-generado o, si no hay, generado en el momento"""
+    if pool_casos.activo and usar_cache:
+        use_case = pool_casos.tomar(doc_id)
+        pool_casos.programar_relleno(doc_id, texto)
+        if use_case:
+            return {"use_case": use_case, "source": "azure_ai_pool"}
+
+    contexto = contexto_caso_de_uso(doc_id, texto)
+    use_case = await planificador.ejecutar("azure", ai.generar_caso_de_uso, contexto, usar_cache)
+    if not use_case:
+        raise HTTPException(status_code=500, detail="Error al generar caso de uso con IA")
+    return {"use_case": use_case, "source": "azure_ai"}
+
 @app.post("/generate_use_case/")
 async def generate_use_case(
-    pdf_text: str = Form(...),
-    generate_automatically: bool = Form(True)  
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    generate_automatically: bool = Form(True),
+    no_cache: bool = Form(False)
 ):
     try:
-        if not pdf_text.strip():
-            raise HTTPException(status_code=400, detail="El texto del PDF no puede estar vacío")
+        doc_id, texto = resolver_documento(doc_id, pdf_text)
 
         if generate_automatically:
-            use_case = ai.generar_caso_de_uso(pdf_text)
-            if not use_case:
-                raise HTTPException(status_code=500, detail="Error al generar caso de uso con IA")
-            return {"use_case": use_case, "source": "azure_ai"}
+            return await generar_caso_de_uso(doc_id, texto, not no_cache)
         else:
             return {"use_case": "", "source": "manual"}  
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error en /generate_use_case: {str(e)}")
         raise HTTPException(status_code=500, detail="Error interno al generar caso de uso")
@@ -150,12 +485,14 @@ async def compare_gemini_response(
                 detail="Ambas respuestas deben contener texto"
             )
 
-        similarity_score = ai_gemini.comparar_respuestas(gemini_response, user_response)
+        similarity_score = comparar_textos(gemini_response, user_response)
         return {
             "similarity": similarity_score,
             "interpretation": interpret_similarity(similarity_score)
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error al comparar respuestas Gemini: {str(e)}")
         raise HTTPException(
@@ -163,33 +500,149 @@ async def compare_gemini_response(
             detail="Error al comparar respuestas con Gemini"
         )
 
+@app.post("/compare_batch/")
+async def compare_batch(
+    reference_responses: List[str] = Form(...),
+    user_responses: List[str] = Form(...),
+    doc_id: Optional[str] = Form(None)
+):
+    """Compara N respuestas de referencia con M respuestas de usuarios en una sola operación"""
+    try:
+        if not any(r.strip() for r in reference_responses) or not any(r.strip() for r in user_responses):
+            raise HTTPException(
+                status_code=400,
+                detail="Ambas listas de respuestas deben contener texto"
+            )
+
+        # Con doc_id se reutiliza el vocabulario/IDF ajustado sobre el documento
+        vectorizador = None
+        if doc_id:
+            texto = documentos.obtener(doc_id)
+            if texto is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Documento no encontrado, vuelve a subir el PDF"
+                )
+            vectorizador = indices.obtener(doc_id, texto).vectorizador
+
+        from similarity_utils import matriz_similitud
+        matriz = await run_in_threadpool(
+            matriz_similitud, reference_responses, user_responses, vectorizador
+        )
+        return {
+            "similarity": matriz.tolist(),
+            "interpretation": [[interpret_similarity(s) for s in fila] for fila in matriz]
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error al comparar respuestas en lote: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Error al comparar las respuestas en lote"
+        )
+
+@app.post("/compare_semantic/")
+async def compare_semantic(
+    scenario: str = Form(...),
+    reference_responses: List[str] = Form(...),
+    user_response: str = Form(...),
+    reference_names: Optional[List[str]] = Form(None),
+    doc_id: Optional[str] = Form(None),
+    align: bool = Form(False)
+):
+    """
+    Similitud semántica de una respuesta con las referencias de un escenario.
+    Las referencias se embeben una vez por documento y escenario; con align=true
+    indica qué pasajes de cada referencia cubre la respuesta.
+    """
+    try:
+        if motor_semantico is None:
+            raise HTTPException(
+                status_code=501,
+                detail="La similitud semántica no está habilitada (SIMILARITY_BACKEND=semantic)"
+            )
+        if not user_response.strip() or not any(r.strip() for r in reference_responses):
+            raise HTTPException(
+                status_code=400,
+                detail="La respuesta y las referencias deben contener texto"
+            )
+        nombres = reference_names or [f"referencia_{i + 1}" for i in range(len(reference_responses))]
+        if len(nombres) != len(reference_responses):
+            raise HTTPException(
+                status_code=400,
+                detail="reference_names debe tener un nombre por referencia"
+            )
+
+        indice = await run_in_threadpool(
+            motor_semantico.indice, doc_id, scenario, dict(zip(nombres, reference_responses))
+        )
+        if align:
+            alineacion = await run_in_threadpool(indice.alinear, user_response)
+            for datos in alineacion.values():
+                datos["interpretation"] = interpret_similarity(datos["similarity"])
+            return {"references": alineacion}
+
+        similitudes = await run_in_threadpool(indice.similitudes, user_response)
+        return {
+            "similarity": similitudes,
+            "interpretation": {n: interpret_similarity(v) for n, v in similitudes.items()}
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error al comparar respuestas semánticamente: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Error al comparar las respuestas semánticamente"
+        )
+
 @app.post("/evaluate_three_responses/")
 async def evaluate_three_responses(
-    pdf_text: str = Form(...),
     question: str = Form(...),
     azure_response: str = Form(...),
     gemini_response: str = Form(...),
-    user_response: str = Form(...)
+    user_response: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
+    combine: bool = Form(False)
 ):
-    """Evalúa cualitativamente las 3 respuestas (Azure, Gemini y usuario)"""
+    """
+    Evalúa cualitativamente las 3 respuestas (Azure, Gemini y usuario).
+    Con combine=true también devuelve la solución combinada, en la misma llamada al modelo.
+    """
     try:
-        if not all([pdf_text.strip(), question.strip(), azure_response.strip(), 
+        if not all([question.strip(), azure_response.strip(), 
                    gemini_response.strip(), user_response.strip()]):
             raise HTTPException(
                 status_code=400,
                 detail="Todos los campos deben contener texto"
             )
+        doc_id, texto = resolver_documento(doc_id, pdf_text)
+        contexto = seleccionar_contexto(
+            doc_id, texto, f"{question}\n{user_response}", CONTEXTO_EVALUACION
+        )
 
-        evaluation = ai.evaluar_calidad_respuestas(
-            texto_pdf=pdf_text,
+        evaluation = await planificador.ejecutar(
+            "azure",
+            ai.evaluar_y_combinar if combine else ai.evaluar_calidad_respuestas,
+            texto_pdf=contexto,
             pregunta=question,
             respuesta_azure=azure_response,
             respuesta_gemini=gemini_response,
-            respuesta_usuario=user_response
+            respuesta_usuario=user_response,
+            usar_cache=not no_cache
         )
+        if "respuesta_combinada" in evaluation:
+            evaluation["combined_solution"] = evaluation.pop("respuesta_combinada")
 
         return evaluation
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error al evaluar tres respuestas: {str(e)}")
         raise HTTPException(
@@ -199,29 +652,40 @@ async def evaluate_three_responses(
 
 @app.post("/combine_responses/")
 async def combine_responses(
-    pdf_text: str = Form(...),
     azure_response: str = Form(...),
     gemini_response: str = Form(...),
-    user_response: str = Form(...)
+    user_response: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False)
 ):
     """Combina las 3 respuestas en una solución integrada"""
     try:
-        if not all([pdf_text.strip(), azure_response.strip(), 
+        if not all([azure_response.strip(), 
                    gemini_response.strip(), user_response.strip()]):
             raise HTTPException(
                 status_code=400,
                 detail="Todos los campos deben contener texto"
             )
+        doc_id, texto = resolver_documento(doc_id, pdf_text)
+        contexto = seleccionar_contexto(
+            doc_id, texto, f"{azure_response}\n{gemini_response}\n{user_response}", CONTEXTO_COMBINACION
+        )
 
-        combined = ai.combinar_respuestas(
-            texto_pdf=pdf_text,
+        combined = await planificador.ejecutar(
+            "azure",
+            ai.combinar_respuestas,
+            texto_pdf=contexto,
             respuesta_azure=azure_response,
             respuesta_gemini=gemini_response,
-            respuesta_usuario=user_response
+            respuesta_usuario=user_response,
+            usar_cache=not no_cache
         )
 
         return {"combined_solution": combined}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error al combinar respuestas: {str(e)}")
         raise HTTPException(
@@ -230,22 +694,26 @@ async def combine_responses(
         )
     
 @app.post("/solve_case_gemini/")
-async def solve_case_gemini(pdf_text: str = Form(...), escenario: str = Form(...)):
+async def solve_case_gemini(
+    escenario: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False)
+):
     try:
-        if not pdf_text.strip():
-            raise HTTPException(
-                status_code=400,
-                detail="El texto del PDF no puede estar vacío"
-            )
         if not escenario.strip():
             raise HTTPException(
                 status_code=400,
                 detail="El escenario no puede estar vacío"
             )
+        doc_id, texto = resolver_documento(doc_id, pdf_text)
+        contexto = seleccionar_contexto(doc_id, texto, escenario, CONTEXTO_RESPUESTA_GEMINI, CONTEXTO_DOCUMENTO_GEMINI)
 
-        response = ai_gemini.generar_respuesta(pdf_text, escenario)
+        response = await planificador.ejecutar("gemini", ai_gemini.generar_respuesta, contexto, escenario, not no_cache)
         return {"gemini_response": response}
 
+    except (HTTPException, ErrorProveedor):
+        raise
     except Exception as e:
         logging.error(f"Error al generar respuesta normativa con Gemini: {str(e)}")
         raise HTTPException(
@@ -253,6 +721,432 @@ async def solve_case_gemini(pdf_text: str = Form(...), escenario: str = Form(...
             detail="Error al interpretar la normativa con Gemini"
         )
     
+@app.post("/solve_case_all/")
+async def solve_case_all(
+    scenario: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False)
+):
+    """Resuelve el caso con Azure y Gemini en paralelo y transmite ambas respuestas por SSE"""
+    if not scenario.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="El escenario no puede estar vacío"
+        )
+    doc_id, texto = resolver_documento(doc_id, pdf_text)
+    contexto = seleccionar_contexto(doc_id, texto, scenario, CONTEXTO_RESPUESTA)
+    contexto_gemini = seleccionar_contexto(doc_id, texto, scenario, CONTEXTO_RESPUESTA_GEMINI, CONTEXTO_DOCUMENTO_GEMINI)
+
+    usos = {"azure": {}, "gemini": {}}
+    flujos = {
+        "azure": planificador.iterar("azure", ai.generar_respuesta_stream, contexto, scenario, not no_cache, uso=usos["azure"]),
+        "gemini": planificador.iterar("gemini", ai_gemini.generar_respuesta_stream, contexto_gemini, scenario, not no_cache, uso=usos["gemini"]),
+    }
+    return respuesta_sse(flujos, usos)
+
+@app.post("/solve_case_stream/")
+async def solve_case_stream(
+    scenario: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False)
+):
+    """Versión SSE de /solve_case/ (solo Azure, sin enrutado entre proveedores)"""
+    if not scenario.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="El escenario no puede estar vacío"
+        )
+    doc_id, texto = resolver_documento(doc_id, pdf_text)
+    contexto = seleccionar_contexto(doc_id, texto, scenario, CONTEXTO_RESPUESTA)
+
+    usos = {"azure": {}}
+    flujos = {"azure": planificador.iterar("azure", ai.generar_respuesta_stream, contexto, scenario, not no_cache, uso=usos["azure"])}
+    return respuesta_sse(flujos, usos)
+
+@app.post("/solve_case_gemini_stream/")
+async def solve_case_gemini_stream(
+    escenario: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False)
+):
+    """Versión SSE de /solve_case_gemini/"""
+    if not escenario.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="El escenario no puede estar vacío"
+        )
+    doc_id, texto = resolver_documento(doc_id, pdf_text)
+    contexto = seleccionar_contexto(doc_id, texto, escenario, CONTEXTO_RESPUESTA_GEMINI, CONTEXTO_DOCUMENTO_GEMINI)
+
+    usos = {"gemini": {}}
+    flujos = {"gemini": planificador.iterar("gemini", ai_gemini.generar_respuesta_stream, contexto, escenario, not no_cache, uso=usos["gemini"])}
+    return respuesta_sse(flujos, usos)
+
+@app.post("/generate_use_case_stream/")
+async def generate_use_case_stream(
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False)
+):
+    """Versión SSE de /generate_use_case/ (si hay un caso pre-generado se envía de una vez)"""
+    doc_id, texto = resolver_documento(doc_id, pdf_text)
+
+    if pool_casos.activo and not no_cache:
+        use_case = pool_casos.tomar(doc_id)
+        pool_casos.programar_relleno(doc_id, texto)
+        if use_case:
+            return respuesta_sse({"azure": flujo_texto(use_case)}, {"azure": {"pool": True}})
+
+    contexto = contexto_caso_de_uso(doc_id, texto)
+    usos = {"azure": {}}
+    flujos = {"azure": planificador.iterar("azure", ai.generar_caso_de_uso_stream, contexto, not no_cache, uso=usos["azure"])}
+    return respuesta_sse(flujos, usos)
+
+@app.post("/combine_responses_stream/")
+async def combine_responses_stream(
+    azure_response: str = Form(...),
+    gemini_response: str = Form(...),
+    user_response: str = Form(...),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False)
+):
+    """Versión SSE de /combine_responses/"""
+    if not all([azure_response.strip(), gemini_response.strip(), user_response.strip()]):
+        raise HTTPException(
+            status_code=400,
+            detail="Todos los campos deben contener texto"
+        )
+    doc_id, texto = resolver_documento(doc_id, pdf_text)
+    contexto = seleccionar_contexto(
+        doc_id, texto, f"{azure_response}\n{gemini_response}\n{user_response}", CONTEXTO_COMBINACION
+    )
+
+    usos = {"azure": {}}
+    flujos = {"azure": planificador.iterar(
+        "azure", ai.combinar_respuestas_stream, contexto, azure_response, gemini_response, user_response,
+        not no_cache, uso=usos["azure"]
+    )}
+    return respuesta_sse(flujos, usos)
+
+@app.post("/jobs/grade_batch", status_code=202)
+async def grade_batch(
+    scenario: str = Form(...),
+    user_responses: List[str] = Form(...),
+    student_ids: Optional[List[str]] = Form(None),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False)
+):
+    """Encola la calificación de todas las respuestas de un grupo para el mismo caso"""
+    if not scenario.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="El escenario no puede estar vacío"
+        )
+    if not any(r.strip() for r in user_responses):
+        raise HTTPException(
+            status_code=400,
+            detail="Debe enviarse al menos una respuesta con texto"
+        )
+    if student_ids and len(student_ids) != len(user_responses):
+        raise HTTPException(
+            status_code=400,
+            detail="student_ids debe tener un elemento por respuesta"
+        )
+    doc_id, texto = resolver_documento(doc_id, pdf_text)
+
+    # Los fragmentos del documento se eligen una vez para todo el grupo
+    contextos = {
+        "azure": seleccionar_contexto(doc_id, texto, scenario, CONTEXTO_RESPUESTA),
+        "gemini": seleccionar_contexto(doc_id, texto, scenario, CONTEXTO_RESPUESTA_GEMINI, CONTEXTO_DOCUMENTO_GEMINI),
+        "evaluacion": seleccionar_contexto(doc_id, texto, scenario, CONTEXTO_EVALUACION),
+    }
+    estudiantes = student_ids or [str(i + 1) for i in range(len(user_responses))]
+    trabajo = calificaciones.encolar(doc_id, scenario, user_responses, estudiantes, contextos, not no_cache)
+    return {"job_id": trabajo["job_id"], "status": trabajo["status"], "total": trabajo["total"]}
+
+def obtener_trabajo(job_id: str) -> dict:
+    trabajo = calificaciones.almacen.obtener(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return trabajo
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Estado y progreso de un trabajo de calificación"""
+    trabajo = obtener_trabajo(job_id)
+    return {clave: valor for clave, valor in trabajo.items() if clave != "results"}
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(job_id: str, format: str = "json"):
+    """Resultados de un trabajo terminado, en JSON o CSV descargable"""
+    trabajo = obtener_trabajo(job_id)
+    if trabajo["status"] != "completed":
+        raise HTTPException(
+            status_code=409,
+            detail=f"El trabajo no ha terminado (estado: {trabajo['status']})"
+        )
+    if format == "csv":
+        return Response(
+            content=resultados_csv(trabajo),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="calificaciones_{job_id}.csv"'}
+        )
+    if format != "json":
+        raise HTTPException(status_code=400, detail="Formato no soportado (json o csv)")
+    return JSONResponse(
+        content=trabajo,
+        headers={"Content-Disposition": f'attachment; filename="calificaciones_{job_id}.json"'}
+    )
+
+def etapas_sesion(doc_id: str, texto: str, escenario: Optional[str], respuesta_usuario: str, usar_cache: bool) -> dict:
+    """
+    Grafo de una sesión: caso de uso → soluciones de Azure y Gemini en paralelo → comparaciones,
+    evaluación y combinación en paralelo. Cada resultado tiene la forma del endpoint equivalente.
+    """
+    from ai_utils import MENSAJE_ERROR_CASO_DE_USO
+    from session_pipeline import Etapa
+
+    async def caso_de_uso(resultados, emitir):
+        if escenario and escenario.strip():
+            return {"use_case": escenario, "source": "manual"}
+        caso = await generar_caso_de_uso(doc_id, texto, usar_cache)
+        if caso["use_case"] == MENSAJE_ERROR_CASO_DE_USO:
+            # Sin caso de uso no se resuelve nada: la etapa falla y las demás se omiten
+            raise HTTPException(status_code=500, detail="Error al generar caso de uso con IA")
+        return caso
+
+    def resolver(proveedor: str, cliente, max_caracteres: int, max_documento: int):
+        async def etapa(resultados, emitir):
+            pregunta = resultados["use_case"]["use_case"]
+            contexto = seleccionar_contexto(doc_id, texto, pregunta, max_caracteres, max_documento)
+            partes = []
+
+            async def consumir():
+                async for parte in planificador.iterar(proveedor, cliente.generar_respuesta_stream,
+                                                       contexto, pregunta, usar_cache):
+                    partes.append(parte)
+                    emitir("token", {"provider": proveedor, "text": parte})
+
+            await asyncio.wait_for(consumir(), TIMEOUTS_PROVEEDOR[proveedor])
+            return {"ai_response": "".join(partes), "provider": proveedor}
+        return etapa
+
+    def comparar(proveedor: str):
+        async def etapa(resultados, emitir):
+            similarity_score = await run_in_threadpool(
+                comparar_textos, resultados[f"solve_{proveedor}"]["ai_response"], respuesta_usuario
+            )
+            return {"similarity": similarity_score, "interpretation": interpret_similarity(similarity_score)}
+        return etapa
+
+    async def evaluar(resultados, emitir):
+        pregunta = resultados["use_case"]["use_case"]
+        contexto = seleccionar_contexto(doc_id, texto, f"{pregunta}\n{respuesta_usuario}", CONTEXTO_EVALUACION)
+        return await planificador.ejecutar(
+            "azure", ai.evaluar_calidad_respuestas,
+            texto_pdf=contexto,
+            pregunta=pregunta,
+            respuesta_azure=resultados["solve_azure"]["ai_response"],
+            respuesta_gemini=resultados["solve_gemini"]["ai_response"],
+            respuesta_usuario=respuesta_usuario,
+            usar_cache=usar_cache
+        )
+
+    async def combinar(resultados, emitir):
+        azure = resultados["solve_azure"]["ai_response"]
+        gemini = resultados["solve_gemini"]["ai_response"]
+        contexto = seleccionar_contexto(doc_id, texto, f"{azure}\n{gemini}\n{respuesta_usuario}", CONTEXTO_COMBINACION)
+        combined = await planificador.ejecutar(
+            "azure", ai.combinar_respuestas,
+            texto_pdf=contexto,
+            respuesta_azure=azure,
+            respuesta_gemini=gemini,
+            respuesta_usuario=respuesta_usuario,
+            usar_cache=usar_cache
+        )
+        return {"combined_solution": combined}
+
+    soluciones = ("solve_azure", "solve_gemini")
+    return {
+        "use_case": Etapa((), caso_de_uso),
+        "solve_azure": Etapa(("use_case",), resolver("azure", ai, CONTEXTO_RESPUESTA, CONTEXTO_DOCUMENTO)),
+        "solve_gemini": Etapa(("use_case",), resolver("gemini", ai_gemini, CONTEXTO_RESPUESTA_GEMINI, CONTEXTO_DOCUMENTO_GEMINI)),
+        "compare_azure": Etapa(("solve_azure",), comparar("azure")),
+        "compare_gemini": Etapa(("solve_gemini",), comparar("gemini")),
+        "evaluate": Etapa(soluciones, evaluar),
+        "combine": Etapa(soluciones, combinar),
+    }
+
+@app.post("/sessions")
+async def create_session(
+    user_response: str = Form(...),
+    scenario: Optional[str] = Form(None),
+    doc_id: Optional[str] = Form(None),
+    pdf_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
+    stream: bool = Form(True)
+):
+    """
+    Sesión completa en una sola petición: sin scenario se genera el caso de uso. Con stream
+    transmite por SSE los tokens de las soluciones y el resultado de cada etapa al terminar;
+    sin stream responde 202 y el estado se consulta en /sessions/{session_id}.
+    """
+    if not user_response.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="La respuesta del usuario no puede estar vacía"
+        )
+    doc_id, texto = resolver_documento(doc_id, pdf_text)
+    sesion, cola = sesiones.iniciar(
+        {"doc_id": doc_id, "scenario": scenario, "user_response": user_response},
+        etapas_sesion(doc_id, texto, scenario, user_response, not no_cache),
+        suscribir=stream
+    )
+    if not stream:
+        return JSONResponse(status_code=202, content={"session_id": sesion["session_id"], "status": sesion["status"]})
+    return StreamingResponse(
+        sesiones.transmitir(sesion, cola),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def obtener_sesion(session_id: str) -> dict:
+    sesion = sesiones.obtener(session_id)
+    if sesion is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    return sesion
+
+@app.get("/sessions/{session_id}")
+async def session_status(session_id: str):
+    return obtener_sesion(session_id)
+
+@app.get("/sessions/{session_id}/report")
+async def session_report(session_id: str):
+    """Reporte PDF a partir de los resultados guardados de la sesión (sin volver a enviarlos)"""
+    sesion = obtener_sesion(session_id)
+    etapas = sesion["stages"]
+    necesarias = ("use_case", "solve_azure", "solve_gemini", "combine")
+    if any(etapas[e]["status"] != "completed" for e in necesarias):
+        raise HTTPException(
+            status_code=409,
+            detail="La sesión todavía no tiene los resultados necesarios para el reporte"
+        )
+    try:
+        contenido = await reportes.generar({
+            "caso_uso": etapas["use_case"]["result"]["use_case"],
+            "respuesta_usuario": sesion["user_response"],
+            "respuesta_azure": etapas["solve_azure"]["result"]["ai_response"],
+            "respuesta_gemini": etapas["solve_gemini"]["result"]["ai_response"],
+            "respuesta_combinada": etapas["combine"]["result"]["combined_solution"]
+        })
+    except Exception as e:
+        logging.error(f"Error al generar el reporte de la sesión {session_id}: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al generar el reporte en PDF: {str(e)}"
+        )
+    filename = f"reporte_analisis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    return Response(
+        content=contenido,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/ocr_jobs/{job_id}")
+async def ocr_job_status(job_id: str, include_text: bool = False):
+    """Progreso del OCR; al completarse incluye el doc_id y una vista previa del texto reconocido"""
+    trabajo = servicio_ocr.almacen.obtener(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo de OCR no encontrado")
+    respuesta = dict(trabajo)
+    if trabajo["status"] == "completed":
+        texto = documentos.obtener(trabajo["doc_id"]) or ""
+        respuesta["preview"] = texto[:CARACTERES_VISTA_PREVIA]
+        if include_text:
+            respuesta["text"] = texto
+    return respuesta
+
+def documento_existente(doc_id: str) -> str:
+    texto = documentos.obtener(doc_id)
+    if texto is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Documento no encontrado, vuelve a subir el PDF"
+        )
+    return texto
+
+@app.get("/documents/{doc_id}/sections")
+async def document_sections(doc_id: str, cite: Optional[str] = None, kind: Optional[str] = None):
+    """
+    Índice de la estructura normativa (sin texto). cite busca una cita concreta
+    ("Artículo 12", "Art. 12", "4.2.1"); kind filtra por tipo (articulo, capitulo, clausula...).
+    """
+    from pdf_utils import id_de_cita
+    texto = documento_existente(doc_id)
+    secciones = await run_in_threadpool(obtener_secciones, doc_id, texto)
+    if cite:
+        buscado = id_de_cita(cite)
+        if buscado is None:
+            # Sin palabra clave se prueba como número de cláusula o de artículo
+            numero = cite.strip().lower()
+            secciones = [s for s in secciones if s["number"].lower() == numero]
+        else:
+            secciones = [s for s in secciones if s["id"] == buscado or s["id"].startswith(f"{buscado}-")]
+    if kind:
+        secciones = [s for s in secciones if s["kind"] == kind]
+    return {"doc_id": doc_id, "sections": secciones}
+
+@app.get("/documents/{doc_id}/sections/{section_id}")
+async def document_section(doc_id: str, section_id: str):
+    """Texto de una sección del índice, sin llamar a ningún modelo"""
+    texto = documento_existente(doc_id)
+    secciones = await run_in_threadpool(obtener_secciones, doc_id, texto)
+    seccion = next((s for s in secciones if s["id"] == section_id), None)
+    if seccion is None:
+        raise HTTPException(status_code=404, detail="Sección no encontrada")
+    return {**seccion, "text": texto[seccion["start"]:seccion["end"]]}
+
+@app.get("/documents/{doc_id}/revision")
+async def document_revision(doc_id: str):
+    """Cambios de esta versión del documento respecto a la anterior"""
+    documento_existente(doc_id)
+    revision = documentos.obtener_artefacto(doc_id, CLAVE_REVISION)
+    if revision is None:
+        raise HTTPException(status_code=404, detail="El documento no tiene una versión anterior registrada")
+    return revision
+
+@app.get("/ready")
+async def ready():
+    """Disponibilidad para el balanceador: 200 cuando terminó la inicialización, 503 mientras tanto"""
+    resumen = arranque.resumen()
+    return JSONResponse(status_code=200 if resumen["ready"] else 503, content=resumen)
+
+@app.get("/cache_stats/")
+async def cache_stats():
+    """Aciertos y fallos de la caché de respuestas de la IA"""
+    return cache_llm.estadisticas()
+
+def recolectar_medidores():
+    """Actualiza los medidores que se leen del estado actual (pools de la IA y caché)"""
+    for proveedor, estado in planificador.estado().items():
+        LLM_EN_CURSO.fijar(estado["en_curso"], provider=proveedor)
+        LLM_EN_ESPERA.fijar(estado["en_espera"], provider=proveedor)
+    estadisticas = cache_llm.estadisticas()
+    for stat in ("hits", "misses", "hit_ratio"):
+        CACHE_LLM.fijar(estadisticas[stat], stat=stat)
+
+registro.al_recolectar(recolectar_medidores)
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(registro.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 def interpret_similarity(score: float) -> str:
     """Ayuda a interpretar el puntaje de similitud"""
     if score >= 0.9:
@@ -280,91 +1174,31 @@ async def descargar_reporte(
         if not all([caso_uso, respuesta_usuario, respuesta_azure, respuesta_gemini, respuesta_combinada]):
             raise HTTPException(status_code=400, detail="Todos los campos deben contener texto")
 
-        # 2. Cargar prompts con valores por defecto
-        prompt_caso_uso = "Genera un caso de uso basado en el documento normativo"
-        prompt_combinar = "Combina las mejores partes de las respuestas proporcionadas"
-        
-        prompts_path = os.path.join(os.path.dirname(__file__), "prompt.txt")
-        if os.path.exists(prompts_path):
-            try:
-                with open(prompts_path, "r", encoding="utf-8") as f:
-                    prompts = f.read().split("#")
-                    if len(prompts) > 1:
-                        prompt_caso_uso = prompts[1].strip()
-                    if len(prompts) > 3:
-                        prompt_combinar = prompts[3].strip()
-            except Exception as e:
-                logging.warning(f"No se pudo leer prompts.txt: {str(e)}")
-
-        # 3. Configuración inicial del PDF
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.set_margins(left=15, top=15, right=15)
-        pdf.set_font("Arial", size=10)
-
-        # Función para manejar texto largo
-        def write_long_text(text, font_size=10):
-            pdf.set_font("Arial", size=font_size)
-            try:
-                text = str(text).encode('latin-1', 'replace').decode('latin-1')
-                pdf.multi_cell(w=180, h=6, txt=text, border=0, align='L')
-            except Exception as e:
-                pdf.multi_cell(w=180, h=6, txt="Error al procesar este texto", border=0, align='L')
-            pdf.ln(4)
-
-        # Encabezado
-        pdf.set_font("Arial", 'B', 16)
-        pdf.cell(200, 10, txt="Reporte de Análisis Normativo", ln=True, align='C')
-        pdf.ln(10)
-        
-        pdf.set_font("Arial", size=10)
-        pdf.cell(200, 10, txt=f"Generado el: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", ln=True)
-        pdf.ln(15)
-
-        # Secciones del PDF
-        sections = [
-            ("1. Caso de Uso Generado", [
-                ("Prompt utilizado:", prompt_caso_uso),
-                ("Caso de uso generado:", caso_uso)
-            ]),
-            ("2. Comparación de Respuestas", [
-                ("✍️ Tu respuesta:", respuesta_usuario),
-                ("🤖 Azure OpenAI:", respuesta_azure),
-                ("🔮 Gemini:", respuesta_gemini)
-            ]),
-            ("3. Solución Combinada", [
-                ("Prompt utilizado:", prompt_combinar),
-                ("💡 Respuesta combinada:", respuesta_combinada)
-            ])
-        ]
-
-        for section_title, items in sections:
-            pdf.set_font("Arial", 'B', 14)
-            pdf.cell(200, 10, txt=section_title, ln=True)
-            pdf.ln(5)
-            
-            for item_title, item_text in items:
-                pdf.set_font("Arial", 'B', 10)
-                write_long_text(item_title)
-                pdf.set_font("Arial", size=10)
-                write_long_text(item_text)
-                pdf.ln(5)
-            pdf.ln(10)
-
-        # Guardado del PDF
+        # 2. Generación del PDF en el pool de procesos (cacheada por contenido)
+        contenido = await reportes.generar({
+            "caso_uso": caso_uso,
+            "respuesta_usuario": respuesta_usuario,
+            "respuesta_azure": respuesta_azure,
+            "respuesta_gemini": respuesta_gemini,
+            "respuesta_combinada": respuesta_combinada
+        })
         filename = f"reporte_analisis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        temp_path = os.path.join(os.path.dirname(__file__), filename)
-        
+
         if guardar_local:
             downloads_path = str(Path.home() / "Downloads")
             local_path = os.path.join(downloads_path, filename)
-            pdf.output(local_path)
+            with open(local_path, "wb") as f:
+                f.write(contenido)
             logging.info(f"PDF guardado localmente en: {local_path}")
 
-        pdf.output(temp_path)
-        return FileResponse(temp_path, filename=filename, media_type="application/pdf")
+        return Response(
+            content=contenido,
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error al generar PDF: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -0,0 +1,217 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from fastapi import Request
+from fastapi.routing import APIRoute
+
+# Límites de los histogramas de latencia (segundos)
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear_etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas: dict) -> tuple:
+        return tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+
+    def exponer(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            for clave, valor in sorted(self._valores.items()):
+                lineas.extend(self._lineas(clave, valor))
+        return lineas
+
+    def _lineas(self, clave, valor) -> list:
+        return [f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {valor}"]
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def incrementar(self, valor: float = 1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+
+class Medidor(_Metrica):
+    tipo = "gauge"
+
+    def fijar(self, valor: float, **etiquetas):
+        with self._lock:
+            self._valores[self._clave(etiquetas)] = valor
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            conteos, suma, total = self._valores.get(clave, ([0] * len(self.buckets), 0.0, 0))
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    conteos[i] += 1
+            self._valores[clave] = (conteos, suma + valor, total + 1)
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """Observa la duración del bloque (también si termina con excepción)"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def _lineas(self, clave, valor) -> list:
+        conteos, suma, total = valor
+        lineas = []
+        for limite, conteo in list(zip(self.buckets, conteos)) + [("+Inf", total)]:
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave, 'le="%s"' % limite)
+            lineas.append(f"{self.nombre}_bucket{etiquetas} {conteo}")
+        etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+        lineas.append(f"{self.nombre}_sum{etiquetas} {suma}")
+        lineas.append(f"{self.nombre}_count{etiquetas} {total}")
+        return lineas
+
+
+class RegistroMetricas:
+    """Métricas del proceso, expuestas en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self._metricas = []
+        self._recolectores = []
+
+    def _registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Contador:
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Medidor:
+        return self._registrar(Medidor(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA) -> Histograma:
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def al_recolectar(self, funcion):
+        """Registra una función que actualiza medidores justo antes de exponerlos"""
+        self._recolectores.append(funcion)
+
+    def exponer(self) -> str:
+        for funcion in self._recolectores:
+            funcion()
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+registro = RegistroMetricas()
+
+DURACION_PETICION = registro.histograma(
+    "chatpdf_http_request_duration_seconds", "Duración de las peticiones HTTP por endpoint",
+    ("method", "endpoint", "status")
+)
+DURACION_ETAPA = registro.histograma(
+    "chatpdf_stage_duration_seconds", "Duración de cada etapa del procesamiento", ("stage",)
+)
+DURACION_LLM = registro.histograma(
+    "chatpdf_llm_call_duration_seconds", "Duración de las llamadas a la IA por proveedor", ("provider",)
+)
+TOKENS_LLM = registro.contador(
+    "chatpdf_llm_tokens_total", "Tokens consumidos por proveedor y sentido", ("provider", "direction")
+)
+LLM_EN_CURSO = registro.medidor(
+    "chatpdf_llm_in_flight", "Llamadas a la IA en curso por proveedor", ("provider",)
+)
+LLM_EN_ESPERA = registro.medidor(
+    "chatpdf_llm_queued", "Llamadas a la IA en espera por proveedor", ("provider",)
+)
+CACHE_LLM = registro.medidor(
+    "chatpdf_llm_cache", "Aciertos, fallos y tasa de aciertos de la caché de la IA", ("stat",)
+)
+
+
+def registrar_tokens(proveedor: str, entrada: int, salida: int, cacheados: int = 0):
+    """cacheados: tokens de entrada servidos desde la caché de prompts del proveedor (incluidos en entrada)"""
+    TOKENS_LLM.incrementar(entrada or 0, provider=proveedor, direction="in")
+    TOKENS_LLM.incrementar(salida or 0, provider=proveedor, direction="out")
+    TOKENS_LLM.incrementar(cacheados or 0, provider=proveedor, direction="cached")
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI que mide cada petición completa (incluidas las respuestas en streaming)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        inicio = time.perf_counter()
+        estado = {"codigo": 500}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["codigo"] = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # La plantilla de la ruta evita una serie por cada doc_id o parámetro
+            ruta = scope.get("route")
+            DURACION_PETICION.observar(
+                time.perf_counter() - inicio,
+                method=scope["method"],
+                endpoint=getattr(ruta, "path", "sin_ruta"),
+                status=estado["codigo"]
+            )
+
+
+class RequestMedida(Request):
+    """Request que mide el parseo del formulario (multipart/urlencoded)"""
+
+    async def _get_form(self, **kwargs):
+        if getattr(self, "_form", None) is not None:
+            return self._form
+        with DURACION_ETAPA.medir(stage="formulario"):
+            return await super()._get_form(**kwargs)
+
+
+class RutaMedida(APIRoute):
+    """Ruta de FastAPI que entrega RequestMedida a sus handlers"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def handler_medido(request: Request):
+            return await handler(RequestMedida(request.scope, request.receive))
+
+        return handler_medido
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable
+
+from starlette.concurrency import run_in_threadpool
+
+from grading_jobs import AlmacenTrabajos
+from pdf_utils import extraer_con_ocr
+from shared_state import ruta_compartida
+
+
+class ServicioOCR:
+    """
+    OCR en segundo plano de los PDF escaneados: reconoce solo las páginas sin capa de texto
+    y, al terminar, registra el documento con await al_completar(texto) -> doc_id.
+    El trabajo es dueño del archivo temporal y lo borra al acabar.
+    """
+
+    def __init__(self, almacen: AlmacenTrabajos, al_completar: Callable[[str], Awaitable[str]], trabajadores: int = 1):
+        self.almacen = almacen
+        self.al_completar = al_completar
+        self.trabajadores = trabajadores
+        self._cola = None
+        self._tareas = []
+        self._rutas = {}
+
+    def _iniciar(self):
+        # La cola se crea dentro del event loop del servidor, con el primer trabajo
+        if self._cola is None:
+            self._cola = asyncio.Queue()
+            self._tareas = [asyncio.create_task(self._trabajador()) for _ in range(self.trabajadores)]
+
+    def encolar(self, ruta: str, sha256: str, paginas: int, paginas_ocr: int) -> dict:
+        self._iniciar()
+        trabajo = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "created_at": time.time(),
+            "finished_at": None,
+            "sha256": sha256,
+            "pages": paginas,
+            "ocr_pages": paginas_ocr,
+            "processed": 0,
+            "doc_id": None,
+            "error": None,
+        }
+        self._rutas[trabajo["job_id"]] = ruta
+        self.almacen.guardar(trabajo)
+        self._cola.put_nowait(trabajo["job_id"])
+        return trabajo
+
+    async def _trabajador(self):
+        while True:
+            job_id = await self._cola.get()
+            trabajo = self.almacen.obtener(job_id)
+            ruta = self._rutas.pop(job_id, None)
+            try:
+                if trabajo is not None and ruta is not None:
+                    await self._reconocer(trabajo, ruta)
+            except Exception as e:
+                logging.error(f"❌ Falló el OCR del trabajo {job_id}: {e}")
+                trabajo.update(status="failed", error=str(e), finished_at=time.time())
+                self.almacen.guardar(trabajo)
+            finally:
+                if ruta and os.path.exists(ruta):
+                    os.unlink(ruta)
+                self._cola.task_done()
+
+    async def _reconocer(self, trabajo: dict, ruta: str):
+        trabajo["status"] = "running"
+        self.almacen.guardar(trabajo)
+
+        def progreso(hechas: int, total: int):
+            trabajo["processed"] = hechas
+            self.almacen.guardar(trabajo)
+
+        extraido = await run_in_threadpool(extraer_con_ocr, ruta, trabajo["sha256"], progreso)
+        if not extraido.texto.strip():
+            raise ValueError("El OCR no reconoció texto en el documento")
+
+        doc_id = await self.al_completar(extraido.texto)
+        trabajo.update(doc_id=doc_id, processed=trabajo["ocr_pages"], status="completed", finished_at=time.time())
+        self.almacen.guardar(trabajo)
+        logging.info(f"✅ OCR {trabajo['job_id']} completado ({trabajo['ocr_pages']} páginas reconocidas)")
+
+
+def crear_servicio_ocr(al_completar: Callable[[str], Awaitable[str]]) -> ServicioOCR:
+    """Crea el servicio con la configuración de las variables de entorno"""
+    almacen = AlmacenTrabajos(
+        max_trabajos=int(os.getenv("OCR_JOBS_MAX", "256")),
+        ruta_sqlite=ruta_compartida("OCR_JOBS_SQLITE", "ocr.db")
+    )
+    return ServicioOCR(almacen, al_completar, trabajadores=int(os.getenv("OCR_JOB_WORKERS", "1")))
@@ -1,8 +1,600 @@
 import fitz  # PyMuPDF
+import hashlib
+import os
+import json
+import logging
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import DURACION_ETAPA
+from shared_state import ruta_compartida
+
+# A partir de cuántas páginas se reparte la extracción entre procesos
+PAGINAS_MIN_PARALELO = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+PROCESOS_EXTRACCION = int(os.getenv("PDF_EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+MAX_DOCUMENTOS_CACHE = int(os.getenv("PDF_CACHE_MAX_DOCS", "16"))
+TAMANO_BLOQUE = 1024 * 1024
+
+# OCR de páginas escaneadas con el Tesseract local (vía PyMuPDF), en su propio pool
+OCR_IDIOMA = os.getenv("OCR_LANGUAGE", "spa+eng")
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_PROCESOS = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+OCR_PAGINAS_POR_TAREA = 4
+OCR_CACHE_DIR = ruta_compartida("OCR_CACHE_DIR", "ocr_cache")  # None: solo caché en memoria
+
+
+@dataclass
+class TextoExtraido:
+    sha256: str
+    texto: str
+    paginas: List[Tuple[int, int]]  # (inicio, fin) de cada página dentro de texto
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_pool = None
+_pool_ocr = None
+_pool_lock = threading.Lock()
+
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PROCESOS_EXTRACCION)
+        return _pool
+
+
+def _obtener_pool_ocr() -> ProcessPoolExecutor:
+    # Separado del de extracción: un OCR largo no debe retrasar las subidas con texto
+    global _pool_ocr
+    with _pool_lock:
+        if _pool_ocr is None:
+            _pool_ocr = ProcessPoolExecutor(max_workers=OCR_PROCESOS)
+        return _pool_ocr
+
+
+def cerrar_pool():
+    """Termina los procesos de extracción y de OCR (al apagar el servidor)"""
+    global _pool, _pool_ocr
+    with _pool_lock:
+        for pool in (_pool, _pool_ocr):
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+        _pool = _pool_ocr = None
+
+
+def _abrir(origen):
+    """Abre el PDF desde una ruta (MuPDF lee el archivo sin copiarlo a Python) o desde bytes"""
+    if isinstance(origen, str):
+        return fitz.open(origen, filetype="pdf")
+    return fitz.open(stream=origen, filetype="pdf")
+
+
+def _extraer_rango(origen, inicio: int, fin: int) -> List[str]:
+    """Extrae el texto de las páginas [inicio, fin) (se ejecuta en un proceso del pool)"""
+    with _abrir(origen) as doc:
+        return [doc[i].get_text() for i in range(inicio, fin)]
+
+
+def _extraer_paginas(origen) -> List[str]:
+    with _abrir(origen) as doc:
+        total = doc.page_count
+        if total < PAGINAS_MIN_PARALELO or PROCESOS_EXTRACCION <= 1:
+            return [page.get_text() for page in doc]
+
+    # Con una ruta, cada proceso abre el archivo por su cuenta: no se serializan los bytes
+    tamano = -(-total // PROCESOS_EXTRACCION)
+    rangos = [(i, min(i + tamano, total)) for i in range(0, total, tamano)]
+    pool = _obtener_pool()
+    futuros = [pool.submit(_extraer_rango, origen, inicio, fin) for inicio, fin in rangos]
+    paginas = []
+    for futuro in futuros:
+        paginas.extend(futuro.result())
+    return paginas
+
+
+def _extraer_con_cache(origen, sha256: str) -> TextoExtraido:
+    with _cache_lock:
+        if sha256 in _cache:
+            _cache.move_to_end(sha256)
+            return _cache[sha256]
+
+    # Un escaneo ya reconocido (caché de OCR en disco) no se vuelve a extraer
+    extraido = _leer_cache_ocr(sha256)
+    if extraido is not None:
+        _guardar_en_cache(extraido)
+        return extraido
+
+    with DURACION_ETAPA.medir(stage="extraccion_pdf"):
+        textos = _extraer_paginas(origen)
+    extraido = _unir_paginas(sha256, textos)
+    _guardar_en_cache(extraido)
+    return extraido
+
+
+def _guardar_en_cache(extraido: TextoExtraido):
+    with _cache_lock:
+        _cache[extraido.sha256] = extraido
+        _cache.move_to_end(extraido.sha256)
+        while len(_cache) > MAX_DOCUMENTOS_CACHE:
+            _cache.popitem(last=False)
+
+
+def _unir_paginas(sha256: str, textos: List[str]) -> TextoExtraido:
+    paginas = []
+    posicion = 0
+    for texto_pagina in textos:
+        paginas.append((posicion, posicion + len(texto_pagina)))
+        posicion += len(texto_pagina)
+    return TextoExtraido(sha256, "".join(textos), paginas)
+
+
+def textos_por_pagina(extraido: TextoExtraido) -> List[str]:
+    return [extraido.texto[inicio:fin] for inicio, fin in extraido.paginas]
+
+
+def paginas_sin_texto(extraido: TextoExtraido) -> List[int]:
+    """Índices de las páginas sin capa de texto (candidatas a OCR)"""
+    return [i for i, texto in enumerate(textos_por_pagina(extraido)) if not texto.strip()]
+
+
+def ocr_disponible() -> bool:
+    """Hay OCR si PyMuPDF encuentra Tesseract y sus datos de idioma"""
+    try:
+        return bool(fitz.get_tessdata())
+    except RuntimeError:
+        return False
+
+
+def _ocr_paginas(ruta: str, paginas: List[int], idioma: str, dpi: int) -> List[Tuple[int, str]]:
+    """Renderiza y reconoce las páginas indicadas (se ejecuta en un proceso del pool de OCR)"""
+    resultado = []
+    with _abrir(ruta) as doc:
+        for i in paginas:
+            capa = doc[i].get_textpage_ocr(language=idioma, dpi=dpi, full=True)
+            resultado.append((i, doc[i].get_text(textpage=capa)))
+    return resultado
+
+
+def _ruta_cache_ocr(sha256: str) -> Optional[str]:
+    return os.path.join(OCR_CACHE_DIR, f"{sha256}.json") if OCR_CACHE_DIR else None
+
+
+def _leer_cache_ocr(sha256: str) -> Optional[TextoExtraido]:
+    ruta = _ruta_cache_ocr(sha256)
+    if not ruta or not os.path.exists(ruta):
+        return None
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return _unir_paginas(sha256, json.load(f)["paginas"])
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"⚠️ Caché de OCR ilegible para {sha256[:12]}: {e}")
+        return None
+
+
+def _escribir_cache_ocr(extraido: TextoExtraido):
+    ruta = _ruta_cache_ocr(extraido.sha256)
+    if not ruta:
+        return
+    try:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"paginas": textos_por_pagina(extraido)}, f, ensure_ascii=False)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        logging.warning(f"⚠️ No se pudo guardar el OCR de {extraido.sha256[:12]}: {e}")
+
+
+def extraer_con_ocr(ruta: str, sha256: str,
+                    progreso: Optional[Callable[[int, int], None]] = None) -> TextoExtraido:
+    """
+    Completa la extracción con OCR solo en las páginas sin capa de texto, repartidas en el
+    pool de OCR. progreso(hechas, total) se llama a medida que terminan las páginas.
+    El resultado reemplaza a la extracción en caché, así que cada escaneo se reconoce una vez.
+    """
+    guardado = _leer_cache_ocr(sha256)
+    if guardado is not None:
+        _guardar_en_cache(guardado)
+        return guardado
+
+    extraido = extraer_texto_archivo(ruta, sha256)
+    vacias = paginas_sin_texto(extraido)
+    if not vacias:
+        return extraido
+
+    textos = textos_por_pagina(extraido)
+    lotes = [vacias[i:i + OCR_PAGINAS_POR_TAREA] for i in range(0, len(vacias), OCR_PAGINAS_POR_TAREA)]
+    pool = _obtener_pool_ocr()
+    hechas = 0
+    with DURACION_ETAPA.medir(stage="ocr_pdf"):
+        futuros = [pool.submit(_ocr_paginas, ruta, lote, OCR_IDIOMA, OCR_DPI) for lote in lotes]
+        try:
+            for futuro in as_completed(futuros):
+                for i, texto in futuro.result():
+                    textos[i] = texto
+                hechas += len(futuro.result())
+                if progreso:
+                    progreso(hechas, len(vacias))
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+
+    completo = _unir_paginas(sha256, textos)
+    _guardar_en_cache(completo)
+    _escribir_cache_ocr(completo)
+    return completo
+
+
+# Estructura normativa: encabezados con palabra clave (en cualquier fuente) y cláusulas
+# numeradas (solo si la fuente las destaca: negrita o mayor que el cuerpo)
+PATRON_SECCION = re.compile(
+    r"^\s*(?:"
+    r"(?P<clave>T[IÍ]TULO|CAP[IÍ]TULO|SECCI[OÓ]N|ART[IÍ]CULO|ART\.|ANEXO)\s+"
+    r"(?P<numero>\d+(?:\.\d+)*|[IVXLCDM]+\b|[A-Z]\b)"
+    r"|(?P<clausula>\d+(?:\.\d+)*)\.?(?=\s+\S)"
+    r")\s*[.:\-–—]?\s*(?P<titulo>.*)$",
+    re.IGNORECASE
+)
+NIVELES_SECCION = {"titulo": 1, "anexo": 1, "capitulo": 2, "seccion": 3, "articulo": 4}
+MAX_CARACTERES_ENCABEZADO = 160
+MAX_CARACTERES_TITULO = 120
+MAX_DOCUMENTOS_SECCIONES = 64
+
+_cache_secciones = OrderedDict()
+
+
+def _sin_acentos(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+
+def _clasificar_encabezado(linea: str) -> Optional[Tuple[str, str, str, int]]:
+    """(tipo, número, título, nivel) si la línea parece un encabezado normativo"""
+    coincidencia = PATRON_SECCION.match(linea)
+    if not coincidencia:
+        return None
+    titulo = coincidencia.group("titulo").strip()
+    if coincidencia.group("clave"):
+        tipo = _sin_acentos(coincidencia.group("clave").lower()).rstrip(".")
+        tipo = "articulo" if tipo == "art" else tipo
+        return tipo, coincidencia.group("numero").upper(), titulo, NIVELES_SECCION[tipo]
+    numero = coincidencia.group("clausula")
+    return "clausula", numero, titulo, NIVELES_SECCION["articulo"] + numero.count(".")
+
+
+def _estructura_rango(origen, inicio: int, fin: int) -> Tuple[List[tuple], List[Dict[float, int]]]:
+    """
+    Líneas candidatas a encabezado de las páginas [inicio, fin) con su fuente, y el histograma
+    de tamaños de fuente de cada página (caracteres por tamaño) para estimar el cuerpo del texto.
+    """
+    candidatas, histogramas = [], []
+    with _abrir(origen) as doc:
+        for i in range(inicio, fin):
+            tamanos = Counter()
+            for bloque in doc[i].get_text("dict")["blocks"]:
+                for linea in bloque.get("lines", []):
+                    spans = [s for s in linea["spans"] if s["text"].strip()]
+                    if not spans:
+                        continue
+                    texto = "".join(s["text"] for s in linea["spans"]).strip()
+                    for span in spans:
+                        tamanos[round(span["size"], 1)] += len(span["text"])
+                    if _clasificar_encabezado(texto):
+                        negrita = bool(spans[0]["flags"] & 16) or "bold" in spans[0]["font"].lower()
+                        candidatas.append((i, texto, round(spans[0]["size"], 1), negrita))
+            histogramas.append(dict(tamanos))
+    return candidatas, histogramas
+
+
+def _candidatas_pdf(origen, total: int) -> Tuple[List[tuple], List[Dict[float, int]]]:
+    if total < PAGINAS_MIN_PARALELO or PROCESOS_EXTRACCION <= 1:
+        return _estructura_rango(origen, 0, total)
+
+    tamano = -(-total // PROCESOS_EXTRACCION)
+    pool = _obtener_pool()
+    futuros = [pool.submit(_estructura_rango, origen, i, min(i + tamano, total)) for i in range(0, total, tamano)]
+    candidatas, histogramas = [], []
+    for futuro in futuros:
+        parciales, por_pagina = futuro.result()
+        candidatas.extend(parciales)
+        histogramas.extend(por_pagina)
+    return candidatas, histogramas
+
+
+def _cuerpo(histogramas: List[Dict[float, int]]) -> Optional[float]:
+    """Tamaño de fuente del cuerpo del texto: el que más caracteres ocupa"""
+    tamanos = Counter()
+    for histograma in histogramas:
+        tamanos.update(histograma)
+    return max(tamanos, key=tamanos.get) if tamanos else None
+
+
+def _candidatas_texto(extraido: TextoExtraido) -> List[tuple]:
+    """Sin PDF (texto pegado u OCR): solo las líneas con palabra clave o cortas"""
+    candidatas = []
+    for i, texto_pagina in enumerate(textos_por_pagina(extraido)):
+        for linea in texto_pagina.splitlines():
+            linea = linea.strip()
+            if _clasificar_encabezado(linea):
+                candidatas.append((i, linea, None, False))
+    return candidatas
+
+
+def indexar_secciones(extraido: TextoExtraido, origen=None, version: Optional["VersionPDF"] = None) -> List[dict]:
+    """
+    Índice compacto de la estructura normativa (títulos, capítulos, secciones, artículos
+    y cláusulas numeradas) con rangos de caracteres y páginas dentro de extraido.texto.
+    Con el PDF (ruta o bytes) usa la fuente de cada línea; sin él, solo el texto. Con la
+    VersionPDF de extraer_version no se vuelve a leer el PDF. Cacheado por SHA-256.
+    """
+    with _cache_lock:
+        if extraido.sha256 in _cache_secciones:
+            _cache_secciones.move_to_end(extraido.sha256)
+            return _cache_secciones[extraido.sha256]
+
+    with DURACION_ETAPA.medir(stage="indice_secciones"):
+        cuerpo = None
+        if version is not None:
+            candidatas = version.candidatas()
+            cuerpo = _cuerpo(version.fuentes)
+        elif origen is not None:
+            candidatas, histogramas = _candidatas_pdf(origen, len(extraido.paginas))
+            cuerpo = _cuerpo(histogramas)
+        else:
+            candidatas = _candidatas_texto(extraido)
+        secciones = _construir_secciones(extraido, candidatas, cuerpo)
+
+    with _cache_lock:
+        _cache_secciones[extraido.sha256] = secciones
+        while len(_cache_secciones) > MAX_DOCUMENTOS_SECCIONES:
+            _cache_secciones.popitem(last=False)
+    return secciones
+
+
+def _construir_secciones(extraido: TextoExtraido, candidatas: List[tuple], cuerpo: Optional[float]) -> List[dict]:
+    textos = textos_por_pagina(extraido)
+    cursores = [0] * len(textos)
+    secciones, usados = [], Counter()
+
+    for pagina, linea, tamano, negrita in candidatas:
+        tipo, numero, _, nivel = _clasificar_encabezado(linea)
+        if tipo == "clausula":
+            # Un número al inicio de un párrafo no es un encabezado salvo que la fuente lo destaque;
+            # sin fuente (texto u OCR) se exige una línea corta con numeración de varios niveles
+            if cuerpo is not None:
+                aceptada = negrita or (tamano is not None and tamano > cuerpo * 1.1)
+            else:
+                aceptada = "." in numero and len(linea) <= MAX_CARACTERES_TITULO
+            if not aceptada:
+                continue
+        elif tipo != "articulo" and len(linea) > MAX_CARACTERES_ENCABEZADO:
+            # Los artículos suelen empezar en la misma línea que su texto; el resto va solo
+            continue
+
+        # Posición de la línea dentro del texto de su página (en orden)
+        posicion = textos[pagina].find(linea, cursores[pagina])
+        if posicion < 0:
+            continue
+        cursores[pagina] = posicion + len(linea)
+
+        base = f"{tipo}-{numero.lower()}"
+        usados[base] += 1
+        secciones.append({
+            "id": base if usados[base] == 1 else f"{base}-{usados[base]}",
+            "kind": tipo,
+            "number": numero,
+            "title": linea[:MAX_CARACTERES_TITULO],
+            "level": nivel,
+            "start": extraido.paginas[pagina][0] + posicion,
+            "page_start": pagina + 1,
+        })
+
+    # Cada sección llega hasta el siguiente encabezado de su nivel o superior
+    abiertas = []
+    for seccion in secciones:
+        while abiertas and abiertas[-1]["level"] >= seccion["level"]:
+            _cerrar_seccion(extraido, abiertas.pop(), seccion["start"])
+        seccion["parent"] = abiertas[-1]["id"] if abiertas else None
+        abiertas.append(seccion)
+    for seccion in abiertas:
+        _cerrar_seccion(extraido, seccion, len(extraido.texto))
+    return secciones
+
+
+def _cerrar_seccion(extraido: TextoExtraido, seccion: dict, fin: int):
+    seccion["end"] = fin
+    seccion["page_end"] = next(
+        (i + 1 for i, (inicio, fin_pagina) in enumerate(extraido.paginas) if inicio < fin <= fin_pagina),
+        seccion["page_start"]
+    )
+
+
+def id_de_cita(cita: str) -> Optional[str]:
+    """Id de sección para una cita escrita por un usuario o un modelo ("Art. 12", "cláusula 4.2.1")"""
+    cita = re.sub(r"^\s*cl[aá]usula\s+", "", cita.strip(), flags=re.IGNORECASE)
+    numero = re.fullmatch(r"(\d+(?:\.\d+)+)\.?", cita)
+    if numero:
+        # Una cláusula citada sola ("4.2.1") no lleva el título que exige un encabezado
+        return f"clausula-{numero.group(1)}"
+    clasificado = _clasificar_encabezado(cita)
+    if not clasificado:
+        return None
+    tipo, numero, _, _ = clasificado
+    return f"{tipo}-{numero.lower()}"
+
+
+# Versiones de un mismo documento: una huella por página permite procesar solo las páginas
+# nuevas o modificadas de una revisión y reutilizar el resto de la versión anterior
+PATRON_REFERENCIA = re.compile(r"(\d+) \d+ R")
+
+
+@dataclass
+class VersionPDF:
+    """Estado por página de una versión del PDF (se guarda como artefacto del documento)"""
+    huellas: List[str]
+    paginas: List[Tuple[int, int]]   # (inicio, fin) de cada página dentro del texto
+    encabezados: List[List[tuple]]   # (línea, tamaño, negrita) candidatas a encabezado, por página
+    fuentes: List[Dict[float, int]]  # histograma de tamaños de fuente, por página
+
+    def candidatas(self) -> List[tuple]:
+        return [(i, linea, tamano, negrita)
+                for i, encabezados in enumerate(self.encabezados)
+                for linea, tamano, negrita in encabezados]
+
+    def a_json(self) -> dict:
+        return {
+            "huellas": self.huellas,
+            "paginas": self.paginas,
+            "encabezados": self.encabezados,
+            "fuentes": [sorted(histograma.items()) for histograma in self.fuentes],
+        }
+
+    @classmethod
+    def desde_json(cls, datos: dict) -> "VersionPDF":
+        return cls(
+            huellas=datos["huellas"],
+            paginas=[tuple(p) for p in datos["paginas"]],
+            encabezados=[[tuple(e) for e in pagina] for pagina in datos["encabezados"]],
+            fuentes=[{float(t): n for t, n in pagina} for pagina in datos["fuentes"]],
+        )
+
+
+def huellas_paginas(origen) -> List[str]:
+    """
+    Huella de cada página sin extraer su texto: SHA-256 de sus flujos de contenido y de los
+    XObjects que dibuja, tal como están en el archivo, más las fuentes que usa.
+    """
+    huellas = []
+    with _abrir(origen) as doc:
+        for i in range(doc.page_count):
+            huella = hashlib.sha256()
+            _, contenidos = doc.xref_get_key(doc.page_xref(i), "Contents")
+            for xref in PATRON_REFERENCIA.findall(contenidos):
+                huella.update(doc.xref_stream_raw(int(xref)) or b"")
+            for xref, *_ in doc.get_page_xobjects(i):
+                huella.update(doc.xref_stream_raw(xref) or b"")
+            for _, _, tipo, fuente, nombre, codificacion in doc.get_page_fonts(i):
+                huella.update(f"{tipo}|{fuente}|{nombre}|{codificacion}".encode("utf-8"))
+            huellas.append(huella.hexdigest())
+    return huellas
+
+
+_cache_versiones = OrderedDict()
+
+
+def _version_en_cache(sha256: str) -> Optional[Tuple[TextoExtraido, VersionPDF]]:
+    """Texto y VersionPDF ya calculados del mismo archivo (si el texto no cambió desde entonces, p. ej. por OCR)"""
+    with _cache_lock:
+        extraido, version = _cache.get(sha256), _cache_versiones.get(sha256)
+        if extraido is None or version is None or version.paginas != extraido.paginas:
+            return None
+        _cache.move_to_end(sha256)
+        _cache_versiones.move_to_end(sha256)
+        return extraido, version
+
+
+def _guardar_version(sha256: str, version: VersionPDF):
+    with _cache_lock:
+        _cache_versiones[sha256] = version
+        _cache_versiones.move_to_end(sha256)
+        while len(_cache_versiones) > MAX_DOCUMENTOS_CACHE:
+            _cache_versiones.popitem(last=False)
+
+
+def _rangos_contiguos(paginas: List[int]) -> List[Tuple[int, int]]:
+    rangos = []
+    for i in paginas:
+        if rangos and rangos[-1][1] == i:
+            rangos[-1] = (rangos[-1][0], i + 1)
+        else:
+            rangos.append((i, i + 1))
+    return rangos
+
+
+def extraer_version(ruta: str, sha256: str,
+                    anterior: Optional[Tuple[VersionPDF, str]] = None) -> Tuple[TextoExtraido, VersionPDF, List[int]]:
+    """
+    Extrae una versión del PDF con su estado por página. Con anterior (VersionPDF y texto
+    de la versión previa) solo se extraen texto y encabezados de las páginas cuya huella no
+    estaba en ella; el resto se copia. Devuelve también los índices de las páginas procesadas.
+    Cacheado por SHA-256: volver a subir el mismo archivo no lee el PDF.
+    """
+    guardado = _version_en_cache(sha256)
+    if guardado is not None:
+        return guardado[0], guardado[1], []
+
+    huellas = huellas_paginas(ruta)
+    previas = {}
+    if anterior is not None:
+        version_anterior, texto_anterior = anterior
+        for i, huella in enumerate(version_anterior.huellas):
+            previas.setdefault(huella, i)
+    nuevas = [i for i, huella in enumerate(huellas) if huella not in previas]
+
+    if len(nuevas) == len(huellas):
+        extraido = _extraer_con_cache(ruta, sha256)
+        candidatas, fuentes = _candidatas_pdf(ruta, len(huellas))
+        encabezados = [[] for _ in huellas]
+        for i, linea, tamano, negrita in candidatas:
+            encabezados[i].append((linea, tamano, negrita))
+        version = VersionPDF(huellas, extraido.paginas, encabezados, fuentes)
+        _guardar_version(sha256, version)
+        return extraido, version, nuevas
+
+    textos, encabezados, fuentes = [None] * len(huellas), [None] * len(huellas), [None] * len(huellas)
+    for i, huella in enumerate(huellas):
+        j = previas.get(huella)
+        if j is not None:
+            inicio, fin = version_anterior.paginas[j]
+            textos[i] = texto_anterior[inicio:fin]
+            encabezados[i] = version_anterior.encabezados[j]
+            fuentes[i] = version_anterior.fuentes[j]
+
+    with DURACION_ETAPA.medir(stage="extraccion_pdf"):
+        for inicio, fin in _rangos_contiguos(nuevas):
+            textos[inicio:fin] = _extraer_rango(ruta, inicio, fin)
+            candidatas, por_pagina = _estructura_rango(ruta, inicio, fin)
+            for i in range(inicio, fin):
+                encabezados[i] = []
+            for i, linea, tamano, negrita in candidatas:
+                encabezados[i].append((linea, tamano, negrita))
+            fuentes[inicio:fin] = por_pagina
+
+    extraido = _unir_paginas(sha256, textos)
+    _guardar_en_cache(extraido)
+    logging.info(f"📑 Revisión del PDF: {len(nuevas)} de {len(huellas)} páginas procesadas")
+    version = VersionPDF(huellas, extraido.paginas, encabezados, fuentes)
+    _guardar_version(sha256, version)
+    return extraido, version, nuevas
+
+
+def extraer_texto(contenido: bytes) -> TextoExtraido:
+    """
+    Extrae el texto de un PDF en memoria conservando los límites de página.
+    El resultado se cachea por SHA-256 del archivo.
+    """
+    return _extraer_con_cache(contenido, hashlib.sha256(contenido).hexdigest())
+
+
+def extraer_texto_archivo(ruta: str, sha256: Optional[str] = None) -> TextoExtraido:
+    """
+    Igual que extraer_texto, pero desde un archivo en disco. Si el SHA-256 ya se
+    calculó al recibir el archivo se reutiliza; si no, se calcula leyéndolo por bloques.
+    """
+    if sha256 is None:
+        hash_archivo = hashlib.sha256()
+        with open(ruta, "rb") as f:
+            for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b""):
+                hash_archivo.update(bloque)
+        sha256 = hash_archivo.hexdigest()
+    return _extraer_con_cache(ruta, sha256)
+
 
 def extract_text_from_pdf(file_path):
-    text = ""
-    with fitz.open(file_path) as doc:
-        for page in doc:
-            text += page.get_text()
-    return text
+    return extraer_texto_archivo(file_path).texto
@@ -0,0 +1,241 @@
+import logging
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import groupby
+from typing import Optional, Tuple, Union
+
+from metrics import DURACION_ETAPA
+
+try:
+    import tiktoken
+except ImportError:  # Dependencia opcional: sin ella se estima por caracteres
+    tiktoken = None
+
+CARACTERES_POR_TOKEN = 4
+MARCA_RECORTE = " [...]"
+
+# Prefijo estable de todos los prompts: las mismas instrucciones de sistema y el mismo bloque
+# de documento van siempre primero, byte a byte, y después la parte propia de cada llamada
+# (incluidos los fragmentos recuperados para su consulta). El bloque no depende de la consulta,
+# así las cachés de prefijos de los proveedores (Azure automática, Gemini explícita) aciertan
+# entre llamadas distintas sobre el mismo documento.
+INSTRUCCIONES_SISTEMA = (
+    "Eres un experto en análisis normativo y cumplimiento técnico. "
+    "Trabajas EXCLUSIVAMENTE con el documento normativo que se incluye a continuación."
+)
+FIN_DOCUMENTO = "--- FIN DEL DOCUMENTO ---\n\n"
+
+_PRESUPUESTO_DOCUMENTO = os.getenv("PROMPT_BUDGET_DOCUMENTO", "2000")
+
+# Presupuesto de tokens de entrada por tipo de llamada (parte variable, tras el prefijo) y de
+# los bloques fijos de documento. Gemini solo cachea contexto explícito a partir de
+# GEMINI_CACHE_MIN_TOKENS (32768 en gemini-1.5): con esa caché activa su bloque es más largo,
+# pero solo se envía si el contenido cacheado llegó a crearse (si no, el bloque normal)
+PRESUPUESTOS = {
+    "documento": int(_PRESUPUESTO_DOCUMENTO),
+    "documento_gemini": int(os.getenv(
+        "PROMPT_BUDGET_DOCUMENTO_GEMINI",
+        "40000" if os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1" else _PRESUPUESTO_DOCUMENTO
+    )),
+    "respuesta": int(os.getenv("PROMPT_BUDGET_RESPUESTA", "4000")),
+    "respuesta_gemini": int(os.getenv("PROMPT_BUDGET_RESPUESTA_GEMINI", "8000")),
+    "caso_de_uso": int(os.getenv("PROMPT_BUDGET_CASO_DE_USO", "2500")),
+    "evaluacion": int(os.getenv("PROMPT_BUDGET_EVALUACION", "1600")),
+    "evaluacion_lote": int(os.getenv("PROMPT_BUDGET_EVALUACION_LOTE", "12000")),
+    "combinacion": int(os.getenv("PROMPT_BUDGET_COMBINACION", "900")),
+}
+
+
+@lru_cache(maxsize=8)
+def _codificador(modelo: str):
+    try:
+        return tiktoken.encoding_for_model(modelo)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def contar_tokens(texto: str, modelo: str = "gpt-4o") -> int:
+    """Cuenta tokens con tiktoken si está instalado; si no, los estima por caracteres"""
+    if tiktoken is not None:
+        return len(_codificador(modelo).encode(texto))
+    return -(-len(texto) // CARACTERES_POR_TOKEN)
+
+
+def recortar_tokens(texto: str, max_tokens: int, modelo: str = "gpt-4o") -> str:
+    """Recorta el texto a max_tokens, marcando el recorte"""
+    if max_tokens <= 0:
+        return ""
+    if tiktoken is not None:
+        codificador = _codificador(modelo)
+        tokens = codificador.encode(texto)
+        if len(tokens) <= max_tokens:
+            return texto
+        return codificador.decode(tokens[:max_tokens]) + MARCA_RECORTE
+    max_caracteres = max_tokens * CARACTERES_POR_TOKEN
+    if len(texto) <= max_caracteres:
+        return texto
+    return texto[:max_caracteres] + MARCA_RECORTE
+
+
+def caracteres_para(tipo: str) -> int:
+    """Tamaño aproximado en caracteres del presupuesto (para preseleccionar contexto)"""
+    return PRESUPUESTOS[tipo] * CARACTERES_POR_TOKEN
+
+
+class PresupuestoPrompt:
+    """
+    Reparte un presupuesto de tokens entre las secciones variables de un prompt.
+    Si no caben, recorta primero las de menor prioridad; las secciones de igual
+    prioridad se recortan de forma equitativa (se limita primero la más larga).
+    """
+
+    def __init__(self, max_tokens: int, modelo: str = "gpt-4o"):
+        self.max_tokens = max_tokens
+        self.modelo = modelo
+        self._secciones = []
+        self.uso = {}
+
+    def agregar(self, nombre: str, texto: str, prioridad: int, minimo: int = 0):
+        self._secciones.append({
+            "nombre": nombre, "texto": texto or "", "prioridad": prioridad, "minimo": minimo
+        })
+        return self
+
+    def asignar(self, reserva: int = 0) -> dict:
+        """Devuelve {nombre: texto ajustado}; reserva = tokens fijos de la plantilla"""
+        for s in self._secciones:
+            s["tokens"] = contar_tokens(s["texto"], self.modelo)
+            s["asignado"] = s["tokens"]
+
+        exceso = reserva + sum(s["tokens"] for s in self._secciones) - self.max_tokens
+        por_prioridad = sorted(self._secciones, key=lambda s: s["prioridad"])
+        for _, grupo in groupby(por_prioridad, key=lambda s: s["prioridad"]):
+            if exceso <= 0:
+                break
+            exceso = self._recortar_grupo(list(grupo), exceso)
+
+        resultado = {}
+        for s in self._secciones:
+            if s["asignado"] < s["tokens"]:
+                resultado[s["nombre"]] = recortar_tokens(s["texto"], s["asignado"], self.modelo)
+            else:
+                resultado[s["nombre"]] = s["texto"]
+
+        self.uso = {
+            "presupuesto": self.max_tokens,
+            "plantilla": reserva,
+            "secciones": {s["nombre"]: s["asignado"] for s in self._secciones},
+            "total": reserva + sum(s["asignado"] for s in self._secciones),
+        }
+        return resultado
+
+    @staticmethod
+    def _recortar_grupo(grupo: list, exceso: int) -> int:
+        """Nivela por arriba las secciones del grupo hasta absorber el exceso"""
+        while exceso > 0:
+            recortables = [s for s in grupo if s["asignado"] > s["minimo"]]
+            if not recortables:
+                break
+            recortables.sort(key=lambda s: s["asignado"], reverse=True)
+            mayor = recortables[0]["asignado"]
+            siguiente = max((s["asignado"] for s in recortables if s["asignado"] < mayor), default=0)
+            empatadas = [s for s in recortables if s["asignado"] == mayor]
+            # Baja las más largas hasta la siguiente, o lo necesario para cubrir el exceso
+            paso = min(mayor - siguiente, -(-exceso // len(empatadas)))
+            for s in empatadas:
+                recorte = min(paso, s["asignado"] - s["minimo"], exceso)
+                s["asignado"] -= recorte
+                exceso -= recorte
+        return exceso
+
+
+def construir_prompt(tipo: str, plantilla, secciones: list, modelo: str = "gpt-4o",
+                     documento: Optional[str] = None, tipo_documento: str = "documento") -> str:
+    """
+    Arma el prompt ajustando sus secciones al presupuesto del tipo de llamada.
+    secciones: lista de (nombre, texto, prioridad, minimo); plantilla: función que recibe las secciones.
+    Con documento, el prompt empieza por prefijo_documento (con su propio presupuesto, tipo_documento).
+    """
+    with DURACION_ETAPA.medir(stage="prompt"):
+        prefijo, tokens_prefijo = ("", 0) if documento is None else _prefijo(documento, tipo_documento, modelo)
+        presupuesto = PresupuestoPrompt(PRESUPUESTOS[tipo], modelo)
+        for nombre, texto, prioridad, minimo in secciones:
+            presupuesto.agregar(nombre, texto, prioridad, minimo)
+
+        reserva = contar_tokens(plantilla(**{nombre: "" for nombre, *_ in secciones}), modelo)
+        prompt = prefijo + plantilla(**presupuesto.asignar(reserva))
+    logging.info(
+        f"📏 Prompt {tipo}: {tokens_prefijo + presupuesto.uso['total']} tokens (prefijo {tokens_prefijo}, "
+        f"variable {presupuesto.uso['total']}/{presupuesto.max_tokens}) {presupuesto.uso['secciones']}"
+    )
+    return prompt
+
+
+@dataclass(frozen=True)
+class ContextoDocumento:
+    """
+    Contexto de una llamada: bloque fijo del documento (igual en todas las llamadas sobre él,
+    va en el prefijo) y fragmentos recuperados para la consulta (van en la parte variable).
+    reducido: el mismo contexto con el bloque de tamaño normal, para cuando un bloque más
+    largo (el de Gemini) no llega a quedar en la caché de contexto del proveedor.
+    """
+    documento: str
+    fragmentos: str = ""
+    reducido: Optional["ContextoDocumento"] = None
+    # Entradas del índice de secciones que cubren los fragmentos (para citar artículos indexados)
+    secciones: str = ""
+
+
+# Un texto suelto se trata como bloque de documento, sin fragmentos propios
+Contexto = Union[str, ContextoDocumento]
+
+
+def partes_contexto(contexto: Contexto) -> Tuple[str, str]:
+    """(bloque del documento, fragmentos de la consulta)"""
+    if isinstance(contexto, ContextoDocumento):
+        return contexto.documento, contexto.fragmentos
+    return contexto, ""
+
+
+@lru_cache(maxsize=64)
+def _prefijo(documento: str, tipo: str, modelo: str) -> Tuple[str, int]:
+    """(prefijo, tokens del prefijo); el bloque se recorta a su presupuesto con el mismo contador"""
+    documento = recortar_tokens(documento, PRESUPUESTOS[tipo], modelo)
+    prefijo = f"{INSTRUCCIONES_SISTEMA}\n\n--- DOCUMENTO NORMATIVO ---\n{documento}\n{FIN_DOCUMENTO}"
+    return prefijo, contar_tokens(prefijo, modelo)
+
+
+def secciones_contexto(contexto: Contexto) -> str:
+    """Secciones del índice relacionadas con la consulta (vacío si no hay índice)"""
+    return contexto.secciones if isinstance(contexto, ContextoDocumento) else ""
+
+
+def prefijo_documento(documento: str, tipo: str = "documento", modelo: str = "gpt-4o") -> str:
+    """
+    Parte estable del prompt: instrucciones de sistema y bloque del documento (siempre al inicio).
+    El bloque se preselecciona por caracteres; aquí se ajusta en tokens al presupuesto de tipo.
+    """
+    return _prefijo(documento, tipo, modelo)[0]
+
+
+def seccion_fragmentos(fragmentos: str) -> str:
+    """Fragmentos propios de la consulta, en la parte variable del prompt"""
+    if not fragmentos:
+        return ""
+    return f"--- FRAGMENTOS RELEVANTES PARA ESTA CONSULTA ---\n{fragmentos}\n--- FIN DE LOS FRAGMENTOS ---\n\n"
+
+
+def seccion_indice(secciones: str) -> str:
+    """Artículos/secciones del índice del documento que cubren los fragmentos de la consulta"""
+    if not secciones:
+        return ""
+    return f"--- SECCIONES DEL DOCUMENTO PARA ESTA CONSULTA ---\n{secciones}\n--- FIN DE LAS SECCIONES ---\n\n"
+
+
+def dividir_prompt(prompt: str):
+    """(prefijo estable, parte variable) de un prompt armado con prefijo_documento"""
+    if not prompt.startswith(INSTRUCCIONES_SISTEMA) or FIN_DOCUMENTO not in prompt:
+        return "", prompt
+    corte = prompt.index(FIN_DOCUMENTO) + len(FIN_DOCUMENTO)
+    return prompt[:corte], prompt[corte:]
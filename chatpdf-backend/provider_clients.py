@@ -0,0 +1,191 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+# Códigos HTTP que justifican reintentar la llamada
+CODIGOS_REINTENTABLES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class ErrorProveedor(Exception):
+    """Fallo definitivo de un proveedor de IA (tras agotar los reintentos)"""
+
+    def __init__(self, proveedor: str, detail: str, retry_after: Optional[int] = None):
+        super().__init__(f"{proveedor}: {detail}")
+        self.proveedor = proveedor
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class CircuitoAbiertoError(ErrorProveedor):
+    """El circuito del proveedor está abierto: se falla sin llamar a la API"""
+
+
+class SolicitudRechazadaError(ErrorProveedor):
+    """El proveedor respondió, pero rechazó la petición (error no transitorio, ej: 400/404)"""
+
+
+class CircuitBreaker:
+    """
+    Circuito por proveedor: tras varios fallos seguidos se abre y las llamadas
+    fallan al instante; pasado tiempo_apertura deja pasar una llamada de prueba.
+    """
+
+    def __init__(self, proveedor: str, umbral_fallos: int = 5, tiempo_apertura: float = 30):
+        self.proveedor = proveedor
+        self.umbral_fallos = umbral_fallos
+        self.tiempo_apertura = tiempo_apertura
+        self.fallos = 0
+        self.abierto_desde = None
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            if self.abierto_desde is None:
+                return "cerrado"
+            if time.monotonic() - self.abierto_desde >= self.tiempo_apertura:
+                return "semiabierto"
+            return "abierto"
+
+    def permitir(self):
+        """Lanza CircuitoAbiertoError si el circuito no deja pasar la llamada"""
+        with self._lock:
+            if self.abierto_desde is None:
+                return
+            restante = self.tiempo_apertura - (time.monotonic() - self.abierto_desde)
+            if restante <= 0 and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return
+        raise CircuitoAbiertoError(
+            self.proveedor,
+            f"El servicio {self.proveedor} no está disponible temporalmente",
+            retry_after=max(1, int(restante))
+        )
+
+    def registrar_exito(self):
+        with self._lock:
+            self.fallos = 0
+            self.abierto_desde = None
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self.fallos += 1
+            self._prueba_en_curso = False
+            if self.abierto_desde is not None or self.fallos >= self.umbral_fallos:
+                if self.abierto_desde is None:
+                    logging.error(f"🔌 Circuito de {self.proveedor} abierto tras {self.fallos} fallos")
+                self.abierto_desde = time.monotonic()
+
+
+def _codigo_http(error: Exception) -> Optional[int]:
+    # openai: status_code; google.api_core: code (int)
+    for atributo in ("status_code", "code"):
+        codigo = getattr(error, atributo, None)
+        if isinstance(codigo, int):
+            return codigo
+    return None
+
+
+def _es_reintentable(error: Exception) -> bool:
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    nombre = type(error).__name__
+    if nombre in ("APIConnectionError", "APITimeoutError", "DeadlineExceeded", "ServiceUnavailable"):
+        return True
+    return _codigo_http(error) in CODIGOS_REINTENTABLES
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    respuesta = getattr(error, "response", None)
+    cabeceras = getattr(respuesta, "headers", None)
+    if not cabeceras:
+        return None
+    valor = cabeceras.get("retry-after-ms")
+    if valor:
+        try:
+            return float(valor) / 1000
+        except ValueError:
+            pass
+    valor = cabeceras.get("retry-after")
+    try:
+        return float(valor) if valor else None
+    except ValueError:
+        return None
+
+
+class PoliticaReintentos:
+    """Reintentos con backoff exponencial con jitter, respetando Retry-After"""
+
+    def __init__(self, intentos: int = 3, base: float = 0.5, maximo: float = 8.0):
+        self.intentos = intentos
+        self.base = base
+        self.maximo = maximo
+
+    def espera(self, intento: int, error: Exception) -> float:
+        indicado = _retry_after(error)
+        if indicado is not None:
+            return min(indicado, self.maximo)
+        return random.uniform(0, min(self.maximo, self.base * 2 ** intento))
+
+    def ejecutar(self, proveedor: str, circuito: CircuitBreaker, funcion, *args, **kwargs):
+        """Llama a funcion con reintentos; tras agotarlos lanza ErrorProveedor"""
+        for intento in range(self.intentos + 1):
+            circuito.permitir()
+            try:
+                resultado = funcion(*args, **kwargs)
+            except Exception as e:
+                if not _es_reintentable(e):
+                    # Error de la petición (ej: 400): el proveedor sí respondió
+                    circuito.registrar_exito()
+                    raise SolicitudRechazadaError(proveedor, f"El servicio {proveedor} rechazó la solicitud") from e
+                circuito.registrar_fallo()
+                if intento == self.intentos:
+                    logging.error(f"❌ {proveedor} falló tras {intento + 1} intento(s): {e}")
+                    raise ErrorProveedor(proveedor, f"El servicio {proveedor} no respondió correctamente") from e
+                espera = self.espera(intento, e)
+                logging.warning(f"⚠️ {proveedor} error transitorio ({e}); reintento en {espera:.1f}s")
+                time.sleep(espera)
+            else:
+                circuito.registrar_exito()
+                return resultado
+
+
+def crear_politica_reintentos() -> PoliticaReintentos:
+    return PoliticaReintentos(
+        intentos=int(os.getenv("LLM_MAX_RETRIES", "3")),
+        base=float(os.getenv("LLM_BACKOFF_BASE_S", "0.5")),
+        maximo=float(os.getenv("LLM_BACKOFF_MAX_S", "8"))
+    )
+
+
+def crear_circuito(proveedor: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        proveedor,
+        umbral_fallos=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+        tiempo_apertura=float(os.getenv("CIRCUIT_RESET_S", "30"))
+    )
+
+
+def crear_cliente_http(timeout: float) -> httpx.Client:
+    """Cliente HTTP compartido con keep-alive (y HTTP/2 si está instalado h2)"""
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+
+    return httpx.Client(
+        http2=http2,
+        timeout=httpx.Timeout(timeout, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "32")),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "16"))
+        )
+    )
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Optional
+
+
+class LatenciasProveedor:
+    """Ventana deslizante de latencias exitosas de un proveedor"""
+
+    def __init__(self, ventana: int = 200):
+        self._muestras = deque(maxlen=ventana)
+
+    def registrar(self, segundos: float):
+        self._muestras.append(segundos)
+
+    def percentil(self, p: float, minimo_muestras: int) -> Optional[float]:
+        if len(self._muestras) < minimo_muestras:
+            return None
+        ordenadas = sorted(self._muestras)
+        return ordenadas[min(len(ordenadas) - 1, int(p * len(ordenadas)))]
+
+
+class RouterProveedores:
+    """
+    Enruta una llamada al proveedor primario con failover y, si se pide, hedging:
+    - si el primario falla, se reintenta con el secundario;
+    - con cobertura, si el primario no responde en su p95 de latencia, se lanza una
+      petición de cobertura al secundario y gana la primera respuesta correcta.
+    La llamada que pierde la carrera no se interrumpe: su hilo termina la petición
+    (y consume tokens) y mantiene ocupada su ranura del planificador hasta entonces.
+    """
+
+    def __init__(self, planificador, primario: str, secundario: str, hedging: bool = True,
+                 retardo_defecto: float = 8.0, retardo_min: float = 1.0, retardo_max: float = 20.0,
+                 minimo_muestras: int = 20):
+        self.planificador = planificador
+        self.primario = primario
+        self.secundario = secundario
+        self.hedging = hedging
+        self.retardo_defecto = retardo_defecto
+        self.retardo_min = retardo_min
+        self.retardo_max = retardo_max
+        self.minimo_muestras = minimo_muestras
+        self.latencias = {primario: LatenciasProveedor(), secundario: LatenciasProveedor()}
+
+    def retardo_cobertura(self) -> float:
+        """Tiempo de espera antes de lanzar la petición de cobertura: p95 del primario"""
+        p95 = self.latencias[self.primario].percentil(0.95, self.minimo_muestras)
+        retardo = self.retardo_defecto if p95 is None else p95
+        return min(self.retardo_max, max(self.retardo_min, retardo))
+
+    async def _llamar(self, proveedor: str, llamadas: dict):
+        funcion, args = llamadas[proveedor]
+        inicio = time.perf_counter()
+        resultado = await self.planificador.ejecutar(proveedor, funcion, *args)
+        self.latencias[proveedor].registrar(time.perf_counter() - inicio)
+        return proveedor, resultado
+
+    async def resolver(self, llamadas: dict, cobertura: bool = False):
+        """
+        llamadas: {proveedor: (funcion, args)}. Devuelve (proveedor, resultado)
+        del primero que responda correctamente. Sin cobertura el secundario solo
+        se usa si el primario falla.
+        """
+        cobertura = cobertura and self.hedging
+        tarea_primaria = asyncio.create_task(self._llamar(self.primario, llamadas))
+        tareas = {tarea_primaria}
+        if cobertura:
+            await asyncio.wait(tareas, timeout=self.retardo_cobertura())
+
+        if cobertura and not tarea_primaria.done():
+            logging.warning(f"⏱️ {self.primario} lento: se lanza petición de cobertura a {self.secundario}")
+            tareas.add(asyncio.create_task(self._llamar(self.secundario, llamadas)))
+
+        ultimo_error = None
+        secundario_lanzado = len(tareas) > 1
+        try:
+            while tareas:
+                terminadas, tareas = await asyncio.wait(tareas, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in terminadas:
+                    if tarea.exception() is None:
+                        return tarea.result()
+                    ultimo_error = tarea.exception()
+                    logging.warning(f"⚠️ Falló un proveedor en el enrutado: {ultimo_error}")
+
+                # Failover: el primario falló antes de lanzar la cobertura
+                if not tareas and not secundario_lanzado:
+                    secundario_lanzado = True
+                    tareas = {asyncio.create_task(self._llamar(self.secundario, llamadas))}
+            raise ultimo_error
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+
+
+def crear_router(planificador) -> RouterProveedores:
+    """Crea el router con la configuración de las variables de entorno"""
+    return RouterProveedores(
+        planificador,
+        primario=os.getenv("HEDGE_PRIMARY", "azure"),
+        secundario=os.getenv("HEDGE_SECONDARY", "gemini"),
+        hedging=os.getenv("HEDGING_ENABLED", "1") == "1",
+        retardo_defecto=float(os.getenv("HEDGE_DELAY_DEFAULT_S", "8")),
+        retardo_min=float(os.getenv("HEDGE_DELAY_MIN_S", "1")),
+        retardo_max=float(os.getenv("HEDGE_DELAY_MAX_S", "20")),
+        minimo_muestras=int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    )
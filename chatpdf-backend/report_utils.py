@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from fpdf import FPDF
+
+from metrics import DURACION_ETAPA
+
+PROMPT_CASO_USO_DEFECTO = "Genera un caso de uso basado en el documento normativo"
+PROMPT_COMBINAR_DEFECTO = "Combina las mejores partes de las respuestas proporcionadas"
+
+
+def cargar_prompts(ruta: str) -> dict:
+    """Lee prompt.txt una sola vez; usa valores por defecto si no existe"""
+    prompts = {"caso_uso": PROMPT_CASO_USO_DEFECTO, "combinar": PROMPT_COMBINAR_DEFECTO}
+    if os.path.exists(ruta):
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                secciones = f.read().split("#")
+                if len(secciones) > 1:
+                    prompts["caso_uso"] = secciones[1].strip()
+                if len(secciones) > 3:
+                    prompts["combinar"] = secciones[3].strip()
+        except Exception as e:
+            logging.warning(f"No se pudo leer prompts.txt: {str(e)}")
+    return prompts
+
+
+def renderizar_reporte(campos: dict, prompts: dict, generado_el: str) -> bytes:
+    """Construye el PDF del reporte en memoria (se ejecuta en un proceso del pool)"""
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_margins(left=15, top=15, right=15)
+    pdf.set_font("Arial", size=10)
+
+    # Función para manejar texto largo
+    def write_long_text(text, font_size=10):
+        pdf.set_font("Arial", size=font_size)
+        try:
+            text = str(text).encode('latin-1', 'replace').decode('latin-1')
+            pdf.multi_cell(w=180, h=6, txt=text, border=0, align='L')
+        except Exception as e:
+            pdf.multi_cell(w=180, h=6, txt="Error al procesar este texto", border=0, align='L')
+        pdf.ln(4)
+
+    # Encabezado
+    pdf.set_font("Arial", 'B', 16)
+    pdf.cell(200, 10, txt="Reporte de Análisis Normativo", ln=True, align='C')
+    pdf.ln(10)
+
+    pdf.set_font("Arial", size=10)
+    pdf.cell(200, 10, txt=f"Generado el: {generado_el}", ln=True)
+    pdf.ln(15)
+
+    # Secciones del PDF
+    sections = [
+        ("1. Caso de Uso Generado", [
+            ("Prompt utilizado:", prompts["caso_uso"]),
+            ("Caso de uso generado:", campos["caso_uso"])
+        ]),
+        ("2. Comparación de Respuestas", [
+            ("✍️ Tu respuesta:", campos["respuesta_usuario"]),
+            ("🤖 Azure OpenAI:", campos["respuesta_azure"]),
+            ("🔮 Gemini:", campos["respuesta_gemini"])
+        ]),
+        ("3. Solución Combinada", [
+            ("Prompt utilizado:", prompts["combinar"]),
+            ("💡 Respuesta combinada:", campos["respuesta_combinada"])
+        ])
+    ]
+
+    for section_title, items in sections:
+        pdf.set_font("Arial", 'B', 14)
+        pdf.cell(200, 10, txt=section_title, ln=True)
+        pdf.ln(5)
+
+        for item_title, item_text in items:
+            pdf.set_font("Arial", 'B', 10)
+            write_long_text(item_title)
+            pdf.set_font("Arial", size=10)
+            write_long_text(item_text)
+            pdf.ln(5)
+        pdf.ln(10)
+
+    return bytes(pdf.output())
+
+
+class GeneradorReportes:
+    """
+    Genera los reportes PDF en un pool de procesos, fuera del event loop,
+    y cachea el resultado por hash de sus campos y del día en que se genera
+    (el reporte muestra la fecha, así que un reporte cacheado no arrastra la de otro día).
+    """
+
+    def __init__(self, prompts: dict, procesos: int = 2, max_reportes: int = 64):
+        self.prompts = prompts
+        self.procesos = procesos
+        self.max_reportes = max_reportes
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _obtener_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.procesos)
+            return self._pool
+
+    def cerrar(self):
+        """Termina los procesos del pool (al apagar el servidor)"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    @staticmethod
+    def clave(campos: dict, generado_el: str) -> str:
+        contenido = json.dumps([campos, generado_el], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    async def generar(self, campos: dict) -> bytes:
+        """Devuelve los bytes del PDF, desde la caché si ya se generó con los mismos campos"""
+        generado_el = datetime.now().strftime('%Y-%m-%d')
+        clave = self.clave(campos, generado_el)
+        with self._lock:
+            if clave in self._cache:
+                self._cache.move_to_end(clave)
+                return self._cache[clave]
+
+        loop = asyncio.get_running_loop()
+        with DURACION_ETAPA.medir(stage="reporte_pdf"):
+            contenido = await loop.run_in_executor(
+                self._obtener_pool(), renderizar_reporte, campos, self.prompts, generado_el
+            )
+
+        with self._lock:
+            self._cache[clave] = contenido
+            while len(self._cache) > self.max_reportes:
+                self._cache.popitem(last=False)
+        return contenido
@@ -0,0 +1,262 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+from scipy.sparse import vstack
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Encabezados típicos de documentos normativos: capítulos, artículos, secciones,
+# anexos y cláusulas numeradas (ej: "4.2.1 Requisitos")
+PATRON_ENCABEZADO = re.compile(
+    r"^[ \t]*(?:"
+    r"(?:CAP[IÍ]TULO|T[IÍ]TULO|SECCI[OÓ]N|ART[IÍ]CULO|ANEXO|DISPOSICI[OÓ]N)\b"
+    r"|Art\.\s*\d+"
+    r"|\d+(?:\.\d+)+\.?[ \t]+\S"
+    r")",
+    re.IGNORECASE | re.MULTILINE
+)
+
+MIN_CARACTERES_FRAGMENTO = 300
+MAX_CARACTERES_FRAGMENTO = 2000
+SEPARADOR_FRAGMENTOS = "\n[...]\n"
+# Por encima de esta proporción de fragmentos cambiados, una revisión se reindexa entera
+MAX_CAMBIO_INCREMENTAL = float(os.getenv("RAG_INCREMENTAL_MAX_CHANGE", "0.3"))
+
+
+@dataclass
+class Fragmento:
+    indice: int
+    inicio: int
+    fin: int
+    texto: str
+
+
+def huella_fragmento(texto: str) -> str:
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def _dividir_largo(texto: str, inicio: int, max_caracteres: int):
+    """Divide un bloque demasiado largo en saltos de párrafo o de línea"""
+    partes = []
+    pos = 0
+    while len(texto) - pos > max_caracteres:
+        corte = texto.rfind("\n\n", pos, pos + max_caracteres)
+        if corte <= pos:
+            corte = texto.rfind("\n", pos, pos + max_caracteres)
+        if corte <= pos:
+            corte = pos + max_caracteres
+        partes.append((inicio + pos, inicio + corte))
+        pos = corte
+    partes.append((inicio + pos, inicio + len(texto)))
+    return partes
+
+
+def fragmentar_documento(texto: str,
+                         min_caracteres: int = MIN_CARACTERES_FRAGMENTO,
+                         max_caracteres: int = MAX_CARACTERES_FRAGMENTO) -> List[Fragmento]:
+    """Divide el documento por artículos/secciones, con tamaños acotados"""
+    cortes = [m.start() for m in PATRON_ENCABEZADO.finditer(texto)]
+    if not cortes or cortes[0] != 0:
+        cortes.insert(0, 0)
+    cortes.append(len(texto))
+
+    # Fusiona secciones muy cortas con la siguiente
+    rangos = []
+    inicio = cortes[0]
+    for fin in cortes[1:]:
+        if fin - inicio >= min_caracteres or fin == len(texto):
+            rangos.append((inicio, fin))
+            inicio = fin
+    if inicio < len(texto):
+        rangos.append((inicio, len(texto)))
+
+    fragmentos = []
+    for inicio, fin in rangos:
+        for a, b in _dividir_largo(texto[inicio:fin], inicio, max_caracteres):
+            contenido = texto[a:b].strip()
+            if contenido:
+                fragmentos.append(Fragmento(len(fragmentos), a, b, contenido))
+    return fragmentos
+
+
+class IndiceDocumento:
+    """Índice TF-IDF local sobre los fragmentos de un documento"""
+
+    def __init__(self, texto: str):
+        self.texto = texto
+        self.fragmentos = fragmentar_documento(texto)
+        self.vectorizador = None
+        self.matriz = None
+
+        if self.fragmentos:
+            try:
+                self.vectorizador = TfidfVectorizer(strip_accents="unicode", sublinear_tf=True)
+                self.matriz = self.vectorizador.fit_transform([f.texto for f in self.fragmentos])
+            except ValueError:
+                # Documento sin vocabulario útil (solo números/símbolos)
+                self.vectorizador = None
+
+    @classmethod
+    def revisar(cls, texto: str, anterior: "IndiceDocumento") -> "IndiceDocumento":
+        """
+        Índice de una nueva versión del documento: las filas TF-IDF de los fragmentos sin
+        cambios se copian de la versión anterior y solo se vectorizan los nuevos. El IDF de
+        los términos conocidos se conserva (aproximación válida para revisiones pequeñas) y
+        los términos nuevos se añaden al vocabulario con su IDF exacto.
+        """
+        indice = cls.__new__(cls)
+        indice.texto = texto
+        indice.fragmentos = fragmentar_documento(texto)
+        indice.vectorizador = None
+        indice.matriz = None
+
+        filas = {}
+        if anterior.vectorizador is not None:
+            for i, fragmento in enumerate(anterior.fragmentos):
+                filas.setdefault(fragmento.texto, i)
+        nuevos = [f for f in indice.fragmentos if f.texto not in filas]
+        if not filas or len(nuevos) > MAX_CAMBIO_INCREMENTAL * max(len(indice.fragmentos), 1):
+            return cls(texto)
+
+        vectorizador = anterior.vectorizador
+        analizador = vectorizador.build_analyzer()
+        frecuencias = {}
+        for fragmento in nuevos:
+            for termino in set(analizador(fragmento.texto)):
+                if termino not in vectorizador.vocabulary_:
+                    frecuencias[termino] = frecuencias.get(termino, 0) + 1
+        if frecuencias:
+            # Los términos nuevos solo aparecen en fragmentos nuevos: su df se conoce exactamente
+            vocabulario = dict(vectorizador.vocabulary_)
+            for termino in sorted(frecuencias):
+                vocabulario[termino] = len(vocabulario)
+            total = len(indice.fragmentos)
+            idf_nuevos = [np.log((1 + total) / (1 + frecuencias[t])) + 1 for t in sorted(frecuencias)]
+            idf = np.concatenate([vectorizador.idf_, idf_nuevos])
+            vectorizador = TfidfVectorizer(**{**vectorizador.get_params(), "vocabulary": vocabulario})
+            vectorizador.idf_ = idf
+
+        matriz = anterior.matriz.tocsr(copy=True)
+        matriz.resize(matriz.shape[0], len(vectorizador.vocabulary_))
+        posiciones, siguiente = [], matriz.shape[0]
+        for fragmento in indice.fragmentos:
+            if fragmento.texto in filas:
+                posiciones.append(filas[fragmento.texto])
+            else:
+                posiciones.append(siguiente)
+                siguiente += 1
+        if nuevos:
+            matriz = vstack([matriz, vectorizador.transform([f.texto for f in nuevos])], format="csr")
+        indice.vectorizador = vectorizador
+        indice.matriz = matriz[posiciones]
+        return indice
+
+    def buscar(self, consulta: str, k: int = 8) -> List[Fragmento]:
+        """Devuelve los k fragmentos más relevantes para la consulta"""
+        if self.vectorizador is None or not consulta.strip():
+            return []
+        # Las filas TF-IDF están normalizadas (L2): el producto es la similitud coseno
+        puntuaciones = (self.matriz @ self.vectorizador.transform([consulta]).T).toarray().ravel()
+        orden = puntuaciones.argsort()[::-1][:k]
+        return [self.fragmentos[i] for i in orden if puntuaciones[i] > 0]
+
+    def _unir(self, seleccion: List[Fragmento]) -> str:
+        seleccion = sorted(seleccion, key=lambda f: f.indice)
+        return SEPARADOR_FRAGMENTOS.join(f.texto for f in seleccion)
+
+    def _llenar(self, candidatos: List[Fragmento], max_caracteres: int) -> List[Fragmento]:
+        seleccion, usados = [], 0
+        for fragmento in candidatos:
+            if fragmento in seleccion:
+                continue
+            if usados + len(fragmento.texto) > max_caracteres:
+                if not seleccion:
+                    # El primero no cabe entero: recortado ya ocupa todo el presupuesto
+                    seleccion.append(Fragmento(fragmento.indice, fragmento.inicio, fragmento.fin,
+                                               fragmento.texto[:max_caracteres]))
+                    break
+                continue
+            seleccion.append(fragmento)
+            usados += len(fragmento.texto) + len(SEPARADOR_FRAGMENTOS)
+        return seleccion
+
+    def contexto(self, consulta: str, max_caracteres: int, k: Optional[int] = None,
+                 excluir: Sequence[Fragmento] = ()) -> str:
+        """
+        Contexto con los fragmentos relevantes a la consulta, en orden del documento.
+        Los fragmentos de excluir (p. ej. los del bloque fijo del prompt) no se repiten.
+        """
+        vistos = {f.indice for f in excluir}
+        if not vistos and len(self.texto) <= max_caracteres:
+            return self.texto
+
+        k = k or int(os.getenv("RAG_TOP_K", "8"))
+        candidatos = [f for f in self.buscar(consulta, k + len(vistos)) if f.indice not in vistos][:k]
+        seleccion = self._llenar(candidatos, max_caracteres)
+        if not seleccion:
+            return self.contexto_representativo(max_caracteres, excluir=excluir)
+        return self._unir(seleccion)
+
+    def seleccion_representativa(self, max_caracteres: int, desplazamiento: int = 0,
+                                 excluir: Sequence[Fragmento] = ()) -> List[Fragmento]:
+        """Fragmentos repartidos por todo el documento (no solo el inicio)"""
+        vistos = {f.indice for f in excluir}
+        fragmentos = [f for f in self.fragmentos if f.indice not in vistos]
+        if not vistos and len(self.texto) <= max_caracteres:
+            return fragmentos
+
+        n = len(fragmentos)
+        if not n:
+            return []
+        promedio = max(1, sum(len(f.texto) for f in fragmentos) // n)
+        cupo = max(1, max_caracteres // promedio)
+        paso = max(1, n // cupo)
+        orden = [fragmentos[(i + desplazamiento) % n] for i in range(0, n, paso)]
+        return self._llenar(orden, max_caracteres)
+
+    def contexto_representativo(self, max_caracteres: int, desplazamiento: int = 0,
+                                excluir: Sequence[Fragmento] = ()) -> str:
+        """Muestra fragmentos repartidos por todo el documento (no solo el inicio)"""
+        if not excluir and len(self.texto) <= max_caracteres:
+            return self.texto
+        return self._unir(self.seleccion_representativa(max_caracteres, desplazamiento, excluir))
+
+
+class RegistroIndices:
+    """Caché LRU de índices por doc_id"""
+
+    def __init__(self, max_indices: int = 32):
+        self.max_indices = max_indices
+        self._indices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def indexar(self, doc_id: str, texto: str, anterior: Optional[IndiceDocumento] = None) -> IndiceDocumento:
+        indice = IndiceDocumento.revisar(texto, anterior) if anterior is not None else IndiceDocumento(texto)
+        with self._lock:
+            self._indices[doc_id] = indice
+            self._indices.move_to_end(doc_id)
+            while len(self._indices) > self.max_indices:
+                self._indices.popitem(last=False)
+        return indice
+
+    def obtener(self, doc_id: str, texto: str) -> IndiceDocumento:
+        """Devuelve el índice del documento, construyéndolo si no está en caché"""
+        with self._lock:
+            indice = self._indices.get(doc_id)
+            if indice is not None:
+                self._indices.move_to_end(doc_id)
+                return indice
+        return self.indexar(doc_id, texto)
+
+    def revisar(self, doc_id: str, texto: str, anterior_id: str, texto_anterior: str) -> IndiceDocumento:
+        """Índice de una nueva versión, reutilizando el de la versión anterior"""
+        with self._lock:
+            if doc_id in self._indices:
+                self._indices.move_to_end(doc_id)
+                return self._indices[doc_id]
+        return self.indexar(doc_id, texto, self.obtener(anterior_id, texto_anterior))
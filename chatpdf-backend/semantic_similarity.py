@@ -0,0 +1,200 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from metrics import DURACION_ETAPA
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # Dependencia opcional: sin ella se mantiene la similitud TF-IDF
+    SentenceTransformer = None
+
+MODELO_DEFECTO = "paraphrase-multilingual-MiniLM-L12-v2"
+MIN_CARACTERES_PASAJE = 40
+# Un pasaje de la referencia se considera cubierto si algún fragmento del estudiante lo alcanza
+UMBRAL_COBERTURA = float(os.getenv("SEMANTIC_COVERAGE_THRESHOLD", "0.6"))
+
+PATRON_ORACION = re.compile(r"(?<=[.;:!?])\s+|\n+")
+
+FuncionEmbeddings = Callable[[List[str]], np.ndarray]
+
+
+def dividir_pasajes(texto: str, min_caracteres: int = MIN_CARACTERES_PASAJE) -> List[str]:
+    """Divide en oraciones/líneas, uniendo las muy cortas con la siguiente"""
+    pasajes, actual = [], ""
+    for parte in PATRON_ORACION.split(texto):
+        parte = parte.strip(" \t-*•")
+        if not parte:
+            continue
+        actual = f"{actual} {parte}".strip()
+        if len(actual) >= min_caracteres:
+            pasajes.append(actual)
+            actual = ""
+    if actual:
+        if pasajes and len(actual) < min_caracteres:
+            pasajes[-1] = f"{pasajes[-1]} {actual}"
+        else:
+            pasajes.append(actual)
+    return pasajes
+
+
+def _normalizar(matriz: np.ndarray) -> np.ndarray:
+    matriz = np.asarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    return matriz / np.maximum(normas, 1e-12)
+
+
+def _puntaje(valor: float) -> float:
+    # Coseno en [-1, 1] llevado a la misma escala 0-1 que TF-IDF
+    return round(max(0.0, float(valor)), 2)
+
+
+class ModeloEmbeddings:
+    """Modelo local de sentence-transformers en CPU, cargado en el primer uso"""
+
+    def __init__(self, nombre: str = MODELO_DEFECTO, lote: int = 32):
+        self.nombre = nombre
+        self.lote = lote
+        self._modelo = None
+        self._lock = threading.Lock()
+
+    def __call__(self, textos: List[str]) -> np.ndarray:
+        with self._lock:
+            if self._modelo is None:
+                logging.info(f"🧠 Cargando el modelo de embeddings {self.nombre}")
+                self._modelo = SentenceTransformer(self.nombre, device="cpu")
+        return self._modelo.encode(textos, batch_size=self.lote, convert_to_numpy=True)
+
+
+class IndiceReferencias:
+    """
+    Embeddings de las respuestas de referencia de un documento y escenario, calculados una vez.
+    Cada respuesta nueva cuesta un embedding y un producto matriz-vector.
+    """
+
+    def __init__(self, referencias: Dict[str, str], embeber: FuncionEmbeddings):
+        self.nombres = list(referencias)
+        self.embeber = embeber
+
+        # Respuestas completas y sus pasajes, en una sola llamada al modelo
+        self.pasajes = [(nombre, pasaje) for nombre in self.nombres
+                        for pasaje in dividir_pasajes(referencias[nombre])]
+        textos = [referencias[n] for n in self.nombres] + [p for _, p in self.pasajes]
+        matriz = _normalizar(embeber(textos))
+        self.matriz = matriz[:len(self.nombres)]
+        self.matriz_pasajes = matriz[len(self.nombres):]
+
+    def similitudes(self, respuesta: str) -> Dict[str, float]:
+        """Similitud coseno de la respuesta con cada referencia"""
+        with DURACION_ETAPA.medir(stage="similitud_semantica"):
+            vector = _normalizar(self.embeber([respuesta]))[0]
+            puntajes = self.matriz @ vector
+        return {nombre: _puntaje(p) for nombre, p in zip(self.nombres, puntajes)}
+
+    def alinear(self, respuesta: str, umbral: float = UMBRAL_COBERTURA) -> Dict[str, dict]:
+        """
+        Alineación por fragmentos: para cada pasaje de cada referencia, el fragmento de la
+        respuesta más parecido y si queda cubierto. Devuelve {referencia: {"similarity",
+        "coverage", "passages": [...]}}.
+        """
+        with DURACION_ETAPA.medir(stage="similitud_semantica"):
+            fragmentos = dividir_pasajes(respuesta) or [respuesta]
+            matriz = _normalizar(self.embeber([respuesta] + fragmentos))
+            global_ = self.matriz @ matriz[0]
+            cruzada = self.matriz_pasajes @ matriz[1:].T if len(self.pasajes) else np.zeros((0, len(fragmentos)))
+
+        resultado = {
+            nombre: {"similarity": _puntaje(global_[i]), "coverage": 0.0, "passages": []}
+            for i, nombre in enumerate(self.nombres)
+        }
+        for fila, (nombre, pasaje) in enumerate(self.pasajes):
+            mejor = int(cruzada[fila].argmax())
+            puntaje = _puntaje(cruzada[fila, mejor])
+            resultado[nombre]["passages"].append({
+                "reference": pasaje,
+                "similarity": puntaje,
+                "covered": puntaje >= umbral,
+                "student_passage": fragmentos[mejor],
+            })
+        for datos in resultado.values():
+            if datos["passages"]:
+                cubiertos = sum(p["covered"] for p in datos["passages"])
+                datos["coverage"] = round(cubiertos / len(datos["passages"]), 2)
+        return resultado
+
+
+class MotorSemantico:
+    """
+    Similitud por embeddings con caché LRU de índices de referencias y de vectores de textos
+    sueltos (las referencias repetidas de un grupo se embeben una sola vez).
+    """
+
+    def __init__(self, embeber: FuncionEmbeddings, max_indices: int = 64, max_vectores: int = 2048):
+        self.embeber = embeber
+        self.max_indices = max_indices
+        self.max_vectores = max_vectores
+        self._indices = OrderedDict()
+        self._vectores = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _clave(*partes: str) -> str:
+        return hashlib.sha256("\x00".join(partes).encode("utf-8")).hexdigest()
+
+    def indice(self, doc_id: str, escenario: str, referencias: Dict[str, str]) -> IndiceReferencias:
+        """Índice de las referencias de (documento, escenario), construyéndolo si no está en caché"""
+        clave = self._clave(doc_id or "", escenario, *(f"{n}\x01{t}" for n, t in referencias.items()))
+        with self._lock:
+            indice = self._indices.get(clave)
+            if indice is not None:
+                self._indices.move_to_end(clave)
+                return indice
+
+        indice = IndiceReferencias(referencias, self.embeber)
+        with self._lock:
+            self._indices[clave] = indice
+            while len(self._indices) > self.max_indices:
+                self._indices.popitem(last=False)
+        return indice
+
+    def _vector(self, texto: str) -> np.ndarray:
+        clave = self._clave(texto)
+        with self._lock:
+            vector = self._vectores.get(clave)
+            if vector is not None:
+                self._vectores.move_to_end(clave)
+                return vector
+
+        vector = _normalizar(self.embeber([texto]))[0]
+        with self._lock:
+            self._vectores[clave] = vector
+            while len(self._vectores) > self.max_vectores:
+                self._vectores.popitem(last=False)
+        return vector
+
+    def similitud(self, texto_a: str, texto_b: str) -> float:
+        """Similitud coseno entre dos textos (misma firma que similitud_textos)"""
+        with DURACION_ETAPA.medir(stage="similitud_semantica"):
+            return _puntaje(self._vector(texto_a) @ self._vector(texto_b))
+
+
+def crear_motor_similitud(embeber: Optional[FuncionEmbeddings] = None) -> Optional[MotorSemantico]:
+    """
+    Motor semántico según SIMILARITY_BACKEND (tfidf | semantic). Con una función de
+    embeddings inyectada se usa esa; si no, el modelo local SEMANTIC_MODEL.
+    Devuelve None cuando se mantiene TF-IDF.
+    """
+    if embeber is not None:
+        return MotorSemantico(embeber)
+    if os.getenv("SIMILARITY_BACKEND", "tfidf").lower() != "semantic":
+        return None
+    if SentenceTransformer is None:
+        logging.warning("⚠️ SIMILARITY_BACKEND=semantic sin sentence-transformers instalado: se usa TF-IDF")
+        return None
+    return MotorSemantico(ModeloEmbeddings(os.getenv("SEMANTIC_MODEL", MODELO_DEFECTO)))
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from grading_jobs import AlmacenTrabajos
+from shared_state import ruta_compartida
+from streaming_utils import evento_sse
+
+# emitir(evento, datos): eventos intermedios de una etapa (p. ej. tokens) para los clientes conectados
+Emisor = Callable[[str, dict], None]
+
+
+@dataclass
+class Etapa:
+    dependencias: Tuple[str, ...]
+    # Recibe los resultados de las etapas terminadas (al menos todas sus dependencias)
+    ejecutar: Callable[[Dict[str, Any], Emisor], Awaitable[Any]]
+
+
+class EtapaOmitida(Exception):
+    """Una dependencia de la etapa falló: la etapa no se ejecuta"""
+
+
+class ServicioSesiones:
+    """
+    Sesiones de análisis completas en el servidor. Cada sesión ejecuta un grafo de etapas:
+    cada etapa empieza en cuanto terminan sus dependencias, así la duración total se acerca
+    a la del camino crítico. Los resultados se guardan por etapa (para consultarlos y para
+    el reporte) y se emiten por SSE a los clientes conectados. La sesión sigue aunque el
+    cliente se desconecte.
+    """
+
+    def __init__(self, almacen: AlmacenTrabajos):
+        self.almacen = almacen
+        self._suscriptores = {}
+        self._tareas = set()
+
+    def iniciar(self, datos: dict, etapas: Dict[str, Etapa],
+                suscribir: bool = True) -> Tuple[dict, Optional[asyncio.Queue]]:
+        """Crea la sesión y lanza su grafo; devuelve la sesión y, si se suscribe, la cola de eventos SSE"""
+        sesion = {
+            "session_id": uuid.uuid4().hex,
+            "status": "running",
+            "created_at": time.time(),
+            "finished_at": None,
+            **datos,
+            "stages": {nombre: {"status": "pending", "result": None, "error": None, "latency_s": None}
+                       for nombre in etapas},
+        }
+        self.almacen.guardar(sesion)
+        cola = asyncio.Queue() if suscribir else None
+        self._suscriptores[sesion["session_id"]] = [cola] if suscribir else []
+
+        tarea = asyncio.create_task(self._ejecutar(sesion, etapas))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+        return sesion, cola
+
+    def obtener(self, session_id: str):
+        return self.almacen.obtener(session_id)
+
+    def _emitir(self, session_id: str, evento: str, datos: dict):
+        for cola in self._suscriptores.get(session_id, []):
+            cola.put_nowait(evento_sse(evento, datos))
+
+    async def transmitir(self, sesion: dict, cola: asyncio.Queue):
+        """Eventos SSE de la sesión: session, token, stage y, al terminar, end"""
+        try:
+            yield evento_sse("session", {"session_id": sesion["session_id"], "stages": list(sesion["stages"])})
+            while True:
+                evento = await cola.get()
+                if evento is None:
+                    break
+                yield evento
+        finally:
+            # Si el cliente se desconecta la sesión continúa; solo deja de recibir eventos
+            colas = self._suscriptores.get(sesion["session_id"], [])
+            if cola in colas:
+                colas.remove(cola)
+
+    async def _ejecutar(self, sesion: dict, etapas: Dict[str, Etapa]):
+        session_id = sesion["session_id"]
+        inicio = time.perf_counter()
+        resultados = {}
+        tareas = {}
+
+        def emitir_etapa(nombre: str) -> Emisor:
+            return lambda evento, datos: self._emitir(session_id, evento, {"stage": nombre, **datos})
+
+        async def correr(nombre: str, etapa: Etapa):
+            estado = sesion["stages"][nombre]
+            try:
+                for dependencia in etapa.dependencias:
+                    await tareas[dependencia]
+            except Exception:
+                estado.update(status="skipped", error="No se ejecutó porque falló una etapa previa")
+                self.almacen.guardar(sesion)
+                self._emitir(session_id, "stage", {"stage": nombre, **estado})
+                raise EtapaOmitida(nombre)
+
+            estado["status"] = "running"
+            comienzo = time.perf_counter()
+            try:
+                resultado = await etapa.ejecutar(resultados, emitir_etapa(nombre))
+            except Exception as e:
+                logging.error(f"❌ Falló la etapa {nombre} de la sesión {session_id}: {e}")
+                estado.update(status="failed", error=getattr(e, "detail", None) or str(e),
+                              latency_s=round(time.perf_counter() - comienzo, 3))
+                raise
+            else:
+                resultados[nombre] = resultado
+                estado.update(status="completed", result=resultado,
+                              latency_s=round(time.perf_counter() - comienzo, 3))
+            finally:
+                self.almacen.guardar(sesion)  # el estado también lo consultan los otros workers
+                self._emitir(session_id, "stage", {"stage": nombre, **estado})
+            return resultado
+
+        # Todas las tareas se crean antes de que empiece ninguna: cada una espera a sus dependencias
+        for nombre, etapa in etapas.items():
+            tareas[nombre] = asyncio.create_task(correr(nombre, etapa))
+        await asyncio.gather(*tareas.values(), return_exceptions=True)
+
+        fallidas = [n for n, e in sesion["stages"].items() if e["status"] != "completed"]
+        sesion.update(
+            status="failed" if fallidas else "completed",
+            error=f"Etapas sin completar: {', '.join(fallidas)}" if fallidas else None,
+            finished_at=time.time(),
+            elapsed_s=round(time.perf_counter() - inicio, 3),
+        )
+        self.almacen.guardar(sesion)
+        self._emitir(session_id, "end", {"status": sesion["status"], "elapsed_s": sesion["elapsed_s"]})
+        for cola in self._suscriptores.pop(session_id, []):
+            cola.put_nowait(None)
+        logging.info(f"✅ Sesión {session_id} terminada en {sesion['elapsed_s']}s ({sesion['status']})")
+
+
+def crear_servicio_sesiones() -> ServicioSesiones:
+    """Crea el servicio con la configuración de las variables de entorno"""
+    almacen = AlmacenTrabajos(
+        max_trabajos=int(os.getenv("SESSIONS_MAX", "256")),
+        ruta_sqlite=ruta_compartida("SESSIONS_SQLITE", "sesiones.db"),
+        campo_id="session_id"
+    )
+    return ServicioSesiones(almacen)
@@ -0,0 +1,31 @@
+import os
+import sqlite3
+from typing import Optional
+
+# Directorio del estado compartido por todos los workers del nodo (documentos, caché, trabajos)
+DIRECTORIO_ESTADO = os.getenv("SHARED_STATE_DIR") or None
+
+
+def ruta_compartida(variable: str, nombre: str) -> Optional[str]:
+    """
+    Ruta del almacenamiento indicado por la variable de entorno; si no está definida
+    y hay SHARED_STATE_DIR, un archivo con ese nombre dentro del directorio compartido.
+    """
+    ruta = os.getenv(variable)
+    if ruta:
+        return ruta
+    if DIRECTORIO_ESTADO:
+        os.makedirs(DIRECTORIO_ESTADO, exist_ok=True)
+        return os.path.join(DIRECTORIO_ESTADO, nombre)
+    return None
+
+
+def conectar_sqlite(ruta: str) -> sqlite3.Connection:
+    """
+    Conexión a SQLite apta para varios procesos: en modo WAL los lectores no bloquean
+    al escritor, y las escrituras concurrentes esperan en lugar de fallar.
+    """
+    conn = sqlite3.connect(ruta, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,32 @@
+from typing import List, Optional
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from metrics import DURACION_ETAPA
+
+
+def similitud_textos(texto_a: str, texto_b: str) -> float:
+    """Similitud TF-IDF entre dos textos (vocabulario ajustado sobre ambos)"""
+    with DURACION_ETAPA.medir(stage="similitud_tfidf"):
+        vectorizer = TfidfVectorizer().fit_transform([texto_a, texto_b])
+        similarity = cosine_similarity(vectorizer[0:1], vectorizer[1:2])
+    return round(float(similarity[0][0]), 2)
+
+
+def matriz_similitud(referencias: List[str], respuestas: List[str],
+                     vectorizador: Optional[TfidfVectorizer] = None) -> np.ndarray:
+    """
+    Matriz N×M de similitud coseno entre N respuestas de referencia y M respuestas de usuarios.
+    Si se pasa un vectorizador ya ajustado (vocabulario/IDF del documento) se reutiliza;
+    si no, se ajusta una sola vez sobre todos los textos.
+    """
+    with DURACION_ETAPA.medir(stage="similitud_tfidf"):
+        if vectorizador is None:
+            vectorizador = TfidfVectorizer().fit(referencias + respuestas)
+
+        # Las filas TF-IDF están normalizadas (L2): el producto disperso es la similitud coseno
+        matriz_ref = vectorizador.transform(referencias)
+        matriz_resp = vectorizador.transform(respuestas)
+        return (matriz_ref @ matriz_resp.T).toarray().round(2)
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from provider_clients import ErrorProveedor
+
+
+class ProveedorNoDisponible:
+    """
+    Ocupa el lugar de un cliente de IA que no se pudo crear (p. ej. falta la clave):
+    el servidor arranca igual y cada uso falla con ErrorProveedor (503).
+    """
+
+    def __init__(self, proveedor: str, motivo: str):
+        self.proveedor = proveedor
+        self.motivo = motivo
+
+    def __getattr__(self, nombre):
+        raise ErrorProveedor(self.proveedor, f"Proveedor no disponible: {self.motivo}")
+
+
+class EstadoArranque:
+    """Inicialización pesada en segundo plano: el proceso escucha mientras se cargan los módulos"""
+
+    def __init__(self, timeout: float = 60):
+        self.timeout = timeout
+        self.componentes = {}
+        self.inicio = None
+        self.duracion = None
+        self._tarea = None
+
+    def iniciar(self, inicializar: Callable[["EstadoArranque"], None]):
+        """Lanza inicializar(estado) en un hilo; debe llamarse dentro del event loop"""
+        self.inicio = time.perf_counter()
+
+        async def ejecutar():
+            try:
+                await run_in_threadpool(inicializar, self)
+            except Exception as e:
+                logging.error(f"❌ Falló la inicialización del servidor: {e}")
+                raise
+            finally:
+                self.duracion = round(time.perf_counter() - self.inicio, 3)
+            logging.info(f"🚀 Servidor listo en {self.duracion}s")
+
+        self._tarea = asyncio.ensure_future(ejecutar())
+
+    @property
+    def listo(self) -> bool:
+        return self._tarea is not None and self._tarea.done() and self._tarea.exception() is None
+
+    @property
+    def error(self) -> Optional[str]:
+        if self._tarea is not None and self._tarea.done() and self._tarea.exception() is not None:
+            return str(self._tarea.exception())
+        return None
+
+    async def esperar(self) -> bool:
+        """Espera a que termine la inicialización; False si no terminó bien a tiempo"""
+        if self._tarea is None:
+            return False
+        try:
+            await asyncio.wait_for(asyncio.shield(self._tarea), self.timeout)
+        except Exception:
+            return False
+        return True
+
+    def resumen(self) -> dict:
+        return {
+            "ready": self.listo,
+            "error": self.error,
+            "startup_s": self.duracion,
+            "components": self.componentes,
+        }
+
+
+class MiddlewareArranque:
+    """
+    Retiene las peticiones hasta que termina la inicialización (503 si falla o tarda
+    demasiado). Las rutas exentas, como /ready, responden siempre al instante.
+    """
+
+    def __init__(self, app, estado: EstadoArranque, exentas: tuple = ()):
+        self.app = app
+        self.estado = estado
+        self.exentas = exentas
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in self.exentas and not self.estado.listo:
+            if not await self.estado.esperar():
+                cuerpo = json.dumps({"detail": "El servidor se está iniciando, reintenta en unos segundos"},
+                                    ensure_ascii=False).encode("utf-8")
+                await send({
+                    "type": "http.response.start", "status": 503,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(cuerpo)).encode()),
+                                (b"retry-after", b"5")]
+                })
+                await send({"type": "http.response.body", "body": cuerpo})
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+
+
+def evento_sse(evento: str, datos: dict) -> str:
+    """Formatea un evento Server-Sent Events"""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+async def flujo_texto(texto: str):
+    """Flujo de una sola parte, para respuestas ya disponibles (ej: pool de casos de uso)"""
+    yield texto
+
+
+async def _consumir(proveedor: str, flujo, cola: asyncio.Queue, uso: Optional[dict]):
+    inicio = time.perf_counter()
+    primer_token = None
+    partes = []
+    async for parte in flujo:
+        if not partes:
+            primer_token = round(time.perf_counter() - inicio, 3)
+            await cola.put(evento_sse("first_token", {"provider": proveedor, "latency_s": primer_token}))
+        partes.append(parte)
+        await cola.put(evento_sse("token", {"provider": proveedor, "text": parte}))
+    await cola.put(evento_sse("done", {
+        "provider": proveedor,
+        "response": "".join(partes),
+        "latency_s": round(time.perf_counter() - inicio, 3),
+        "first_token_s": primer_token,
+        "usage": uso
+    }))
+
+
+async def _ejecutar_con_timeout(proveedor: str, flujo, timeout: float, cola: asyncio.Queue, uso: Optional[dict]):
+    try:
+        await asyncio.wait_for(_consumir(proveedor, flujo, cola, uso), timeout)
+    except asyncio.TimeoutError:
+        logging.error(f"⏱️ {proveedor} superó el tiempo máximo de {timeout}s")
+        await cola.put(evento_sse("error", {"provider": proveedor, "detail": f"Tiempo de espera agotado ({timeout}s)"}))
+    except Exception as e:
+        logging.error(f"Error en streaming de {proveedor}: {e}")
+        detalle = getattr(e, "detail", None) or "Error al generar la respuesta"
+        await cola.put(evento_sse("error", {"provider": proveedor, "detail": detalle}))
+
+
+async def fusionar_flujos(flujos: dict, timeouts: dict, usos: Optional[dict] = None):
+    """
+    Ejecuta varios flujos de texto en paralelo y emite sus eventos SSE
+    etiquetados por proveedor, a medida que llegan. El evento done de cada
+    proveedor resume latencias y, si se pasa usos, el consumo de tokens.
+    """
+    usos = usos or {}
+    cola = asyncio.Queue()
+    tareas = [
+        asyncio.create_task(_ejecutar_con_timeout(proveedor, flujo, timeouts[proveedor], cola, usos.get(proveedor)))
+        for proveedor, flujo in flujos.items()
+    ]
+    pendientes = asyncio.gather(*tareas)
+    try:
+        while not (pendientes.done() and cola.empty()):
+            lector = asyncio.ensure_future(cola.get())
+            await asyncio.wait({lector, pendientes}, return_when=asyncio.FIRST_COMPLETED)
+            if lector.done():
+                yield lector.result()
+            else:
+                lector.cancel()
+        yield evento_sse("end", {})
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
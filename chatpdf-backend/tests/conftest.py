@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Las pruebas importan los módulos del backend (y los PDFs de ejemplo de benchmarks) sin instalarlos
+DIRECTORIO_BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [DIRECTORIO_BACKEND, os.path.join(DIRECTORIO_BACKEND, "benchmarks")]
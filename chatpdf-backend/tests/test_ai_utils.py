@@ -0,0 +1,49 @@
+import pytest
+
+from ai_utils import validar_evaluacion_lote
+
+
+def evaluacion(coherencia=80, precision=70, aplicabilidad=90):
+    return {"coherencia": coherencia, "precision": precision, "aplicabilidad": aplicabilidad, "comentario": "bien"}
+
+
+def lote(**cambios):
+    datos = {
+        "evaluaciones": {"azure": evaluacion(), "e1": evaluacion(60, 50.4, 40)},
+        "mejor_respuesta": "azure",
+        "analisis": "Azure cita el artículo aplicable.",
+        "respuesta_combinada": "Síntesis de ambas respuestas.",
+    }
+    datos.update(cambios)
+    return datos
+
+
+def test_lote_valido():
+    resultado = validar_evaluacion_lote(lote(), ["azure", "e1"], combinar=True)
+    assert resultado["evaluaciones"]["e1"] == {"coherencia": 60, "precision": 50, "aplicabilidad": 40, "comentario": "bien"}
+    assert resultado["mejor_respuesta"] == "azure"
+    assert resultado["respuesta_combinada"] == "Síntesis de ambas respuestas."
+
+
+def test_sin_combinar_no_exige_respuesta_combinada():
+    resultado = validar_evaluacion_lote(lote(respuesta_combinada=None), ["azure", "e1"], combinar=False)
+    assert "respuesta_combinada" not in resultado
+
+
+@pytest.mark.parametrize("datos, ids", [
+    (["no", "es", "objeto"], ["azure"]),
+    (lote(evaluaciones=None), ["azure", "e1"]),
+    (lote(), ["azure"]),
+    (lote(), ["azure", "e1", "e2"]),
+    (lote(evaluaciones={"azure": evaluacion(101), "e1": evaluacion()}), ["azure", "e1"]),
+    (lote(evaluaciones={"azure": evaluacion(-1), "e1": evaluacion()}), ["azure", "e1"]),
+    (lote(evaluaciones={"azure": evaluacion(True), "e1": evaluacion()}), ["azure", "e1"]),
+    (lote(evaluaciones={"azure": evaluacion("80"), "e1": evaluacion()}), ["azure", "e1"]),
+    (lote(evaluaciones={"azure": "excelente", "e1": evaluacion()}), ["azure", "e1"]),
+    (lote(mejor_respuesta="e9"), ["azure", "e1"]),
+    (lote(analisis=None), ["azure", "e1"]),
+    (lote(respuesta_combinada="  "), ["azure", "e1"]),
+])
+def test_lote_invalido(datos, ids):
+    with pytest.raises(ValueError):
+        validar_evaluacion_lote(datos, ids, combinar=True)
@@ -0,0 +1,55 @@
+import pytest
+
+from pdf_utils import extraer_texto, id_de_cita, indexar_secciones
+from sample_pdfs import generar_pdf
+
+
+@pytest.fixture(scope="module")
+def documento():
+    contenido = generar_pdf(12)
+    extraido = extraer_texto(contenido)
+    return extraido, indexar_secciones(extraido, contenido)
+
+
+def test_capitulos_y_articulos_del_pdf(documento):
+    _, secciones = documento
+    capitulos = [s for s in secciones if s["kind"] == "capitulo"]
+    articulos = [s for s in secciones if s["kind"] == "articulo"]
+    assert [s["id"] for s in capitulos] == ["capitulo-1", "capitulo-2"]
+    assert [s["number"] for s in articulos] == [str(n) for n in range(1, 37)]
+
+
+def test_jerarquia_y_paginas(documento):
+    _, secciones = documento
+    por_id = {s["id"]: s for s in secciones}
+    assert por_id["articulo-1"]["parent"] == "capitulo-1"
+    assert por_id["articulo-31"]["parent"] == "capitulo-2"
+    assert por_id["capitulo-1"]["page_start"] == 1 and por_id["capitulo-1"]["page_end"] == 10
+    assert por_id["articulo-4"]["page_start"] == 2
+
+
+def test_rangos_apuntan_al_texto(documento):
+    extraido, secciones = documento
+    for seccion in secciones:
+        assert extraido.texto[seccion["start"]:seccion["end"]].startswith(seccion["title"])
+    # Los artículos de un capítulo quedan dentro de su rango
+    por_id = {s["id"]: s for s in secciones}
+    capitulo = por_id["capitulo-1"]
+    assert capitulo["start"] <= por_id["articulo-30"]["start"] < por_id["articulo-30"]["end"] <= capitulo["end"]
+
+
+def test_sin_pdf_se_indexa_desde_el_texto():
+    contenido = generar_pdf(3)
+    extraido = extraer_texto(contenido)
+    secciones = indexar_secciones(extraido)
+    assert [s["id"] for s in secciones if s["kind"] == "articulo"] == [f"articulo-{n}" for n in range(1, 10)]
+
+
+@pytest.mark.parametrize("cita, esperado", [
+    ("Artículo 12", "articulo-12"),
+    ("Art. 12", "articulo-12"),
+    ("cláusula 4.2.1", "clausula-4.2.1"),
+    ("sin cita", None),
+])
+def test_id_de_cita(cita, esperado):
+    assert id_de_cita(cita) == esperado
@@ -0,0 +1,64 @@
+from prompt_budget import (FIN_DOCUMENTO, PRESUPUESTOS, ContextoDocumento, PresupuestoPrompt, construir_prompt,
+                           contar_tokens, dividir_prompt, prefijo_documento, seccion_indice, secciones_contexto)
+
+
+def test_sin_exceso_no_recorta():
+    presupuesto = PresupuestoPrompt(1000).agregar("a", "uno dos tres", 1).agregar("b", "cuatro", 2)
+    assert presupuesto.asignar() == {"a": "uno dos tres", "b": "cuatro"}
+    assert presupuesto.uso["total"] <= 1000
+
+
+def test_recorta_primero_la_menor_prioridad():
+    largo = "palabra " * 400
+    presupuesto = PresupuestoPrompt(300).agregar("contexto", largo, 1).agregar("pregunta", "¿qué exige?", 3)
+    resultado = presupuesto.asignar()
+    assert resultado["pregunta"] == "¿qué exige?"
+    assert len(resultado["contexto"]) < len(largo)
+    assert presupuesto.uso["total"] <= 300
+
+
+def test_misma_prioridad_se_nivela_por_arriba():
+    presupuesto = PresupuestoPrompt(200)
+    presupuesto.agregar("corta", "x " * 40, 2).agregar("larga", "y " * 400, 2)
+    presupuesto.asignar()
+    secciones = presupuesto.uso["secciones"]
+    # Solo se recorta la más larga mientras siga siendo mayor que la otra
+    assert secciones["corta"] == contar_tokens("x " * 40)
+    assert secciones["corta"] + secciones["larga"] <= 200
+
+
+def test_respeta_el_minimo_y_la_reserva():
+    presupuesto = PresupuestoPrompt(100).agregar("a", "z " * 400, 1, minimo=30)
+    presupuesto.asignar(reserva=90)
+    assert presupuesto.uso["secciones"]["a"] == 30
+    assert presupuesto.uso["plantilla"] == 90
+
+
+def test_prefijo_documento_recortado_y_estable():
+    documento = "Artículo 1. Texto normativo denso. " * 2000
+    prefijo = prefijo_documento(documento)
+    assert prefijo == prefijo_documento(documento)
+    assert prefijo.endswith(FIN_DOCUMENTO)
+    bloque = prefijo.split("--- DOCUMENTO NORMATIVO ---\n", 1)[1]
+    assert contar_tokens(bloque) <= PRESUPUESTOS["documento"] + contar_tokens(FIN_DOCUMENTO) + 5
+
+
+def test_construir_prompt_con_documento_separa_prefijo():
+    def plantilla(fragmentos, escenario):
+        return f"{fragmentos}\nEscenario: {escenario}"
+
+    prompt = construir_prompt("respuesta", plantilla, [
+        ("fragmentos", "fragmento relevante", 1, 0),
+        ("escenario", "una empresa", 3, 0),
+    ], documento="Artículo 1. Bloque fijo.")
+    prefijo, variable = dividir_prompt(prompt)
+    assert prefijo == prefijo_documento("Artículo 1. Bloque fijo.")
+    assert variable == "fragmento relevante\nEscenario: una empresa"
+
+
+def test_secciones_del_indice_solo_con_contexto_documento():
+    contexto = ContextoDocumento("bloque", "fragmento", secciones="- Artículo 3 (id articulo-3, pág. 1)")
+    assert secciones_contexto(contexto) == "- Artículo 3 (id articulo-3, pág. 1)"
+    assert secciones_contexto("texto suelto") == ""
+    assert "articulo-3" in seccion_indice(secciones_contexto(contexto))
+    assert seccion_indice("") == ""
@@ -0,0 +1,98 @@
+import pytest
+
+import provider_clients
+from provider_clients import (CircuitBreaker, CircuitoAbiertoError, ErrorProveedor, PoliticaReintentos,
+                              SolicitudRechazadaError)
+
+
+class ErrorHTTP(Exception):
+    def __init__(self, status_code, cabeceras=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Respuesta", (), {"headers": cabeceras or {}})()
+
+
+@pytest.fixture(autouse=True)
+def sin_esperas(monkeypatch):
+    esperas = []
+    monkeypatch.setattr(provider_clients.time, "sleep", esperas.append)
+    return esperas
+
+
+def fallar_veces(n, error):
+    llamadas = []
+
+    def funcion():
+        llamadas.append(1)
+        if len(llamadas) <= n:
+            raise error
+        return "ok"
+    return funcion, llamadas
+
+
+def test_reintenta_errores_transitorios():
+    funcion, llamadas = fallar_veces(2, ErrorHTTP(503))
+    circuito = CircuitBreaker("azure", umbral_fallos=5)
+    assert PoliticaReintentos(intentos=3).ejecutar("azure", circuito, funcion) == "ok"
+    assert len(llamadas) == 3
+    assert circuito.estado == "cerrado" and circuito.fallos == 0
+
+
+def test_agota_los_reintentos():
+    funcion, llamadas = fallar_veces(10, ErrorHTTP(500))
+    with pytest.raises(ErrorProveedor):
+        PoliticaReintentos(intentos=2).ejecutar("azure", CircuitBreaker("azure", umbral_fallos=10), funcion)
+    assert len(llamadas) == 3
+
+
+def test_no_reintenta_errores_de_la_peticion():
+    funcion, llamadas = fallar_veces(1, ErrorHTTP(400))
+    circuito = CircuitBreaker("gemini", umbral_fallos=1)
+    with pytest.raises(SolicitudRechazadaError):
+        PoliticaReintentos(intentos=3).ejecutar("gemini", circuito, funcion)
+    assert len(llamadas) == 1
+    assert circuito.estado == "cerrado"
+
+
+def test_respeta_retry_after(sin_esperas):
+    funcion, _ = fallar_veces(1, ErrorHTTP(429, {"retry-after": "3"}))
+    PoliticaReintentos(intentos=1, maximo=8).ejecutar("azure", CircuitBreaker("azure"), funcion)
+    assert sin_esperas == [3.0]
+
+
+def test_backoff_acotado_por_el_maximo():
+    politica = PoliticaReintentos(base=0.5, maximo=2)
+    assert all(0 <= politica.espera(intento, ErrorHTTP(503)) <= 2 for intento in range(10))
+    assert politica.espera(0, ErrorHTTP(429, {"retry-after-ms": "20000"})) == 2
+
+
+def test_circuito_se_abre_tras_el_umbral():
+    circuito = CircuitBreaker("azure", umbral_fallos=2, tiempo_apertura=60)
+    circuito.registrar_fallo()
+    circuito.permitir()
+    circuito.registrar_fallo()
+    assert circuito.estado == "abierto"
+    with pytest.raises(CircuitoAbiertoError) as error:
+        circuito.permitir()
+    assert error.value.retry_after >= 1
+
+
+def test_circuito_semiabierto_deja_pasar_una_prueba():
+    circuito = CircuitBreaker("azure", umbral_fallos=1, tiempo_apertura=0)
+    circuito.registrar_fallo()
+    assert circuito.estado == "semiabierto"
+    circuito.permitir()
+    with pytest.raises(CircuitoAbiertoError):
+        circuito.permitir()
+    circuito.registrar_exito()
+    assert circuito.estado == "cerrado"
+    circuito.permitir()
+
+
+def test_circuito_abierto_no_llama_al_proveedor():
+    circuito = CircuitBreaker("azure", umbral_fallos=1, tiempo_apertura=60)
+    circuito.registrar_fallo()
+    funcion, llamadas = fallar_veces(0, None)
+    with pytest.raises(CircuitoAbiertoError):
+        PoliticaReintentos(intentos=3).ejecutar("azure", circuito, funcion)
+    assert llamadas == []
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from pdf_utils import extraer_texto
+from retrieval_utils import MAX_CAMBIO_INCREMENTAL, IndiceDocumento
+from sample_pdfs import generar_pdf
+
+
+@pytest.fixture(scope="module")
+def versiones():
+    return extraer_texto(generar_pdf(30)).texto, extraer_texto(generar_pdf(30, revision=True)).texto
+
+
+def test_revision_reutiliza_las_filas_sin_cambios(versiones):
+    original, revisado = versiones
+    anterior = IndiceDocumento(original)
+    indice = IndiceDocumento.revisar(revisado, anterior)
+
+    filas_anteriores = {f.texto: anterior.matriz[f.indice].toarray() for f in anterior.fragmentos}
+    reutilizadas = [f for f in indice.fragmentos if f.texto in filas_anteriores]
+    assert 0 < len(reutilizadas) < len(indice.fragmentos)
+    for fragmento in reutilizadas:
+        fila = indice.matriz[fragmento.indice].toarray()[:, :filas_anteriores[fragmento.texto].shape[1]]
+        assert np.allclose(fila, filas_anteriores[fragmento.texto])
+
+
+def test_revision_encuentra_el_texto_nuevo(versiones):
+    original, revisado = versiones
+    indice = IndiceDocumento.revisar(revisado, IndiceDocumento(original))
+    assert indice.matriz.shape == (len(indice.fragmentos), len(indice.vectorizador.vocabulary_))
+    resultados = indice.buscar("disposición final sustituye la versión anterior", k=1)
+    assert "Disposición final" in resultados[0].texto
+    assert [f.indice for f in indice.buscar("riesgos del proceso 12", k=3)] == \
+        [f.indice for f in IndiceDocumento(revisado).buscar("riesgos del proceso 12", k=3)]
+
+
+def test_cambio_grande_reindexa_completo(versiones):
+    original, _ = versiones
+    otro = extraer_texto(generar_pdf(5)).texto.replace("organización", "empresa")
+    anterior = IndiceDocumento(original)
+    indice = IndiceDocumento.revisar(otro, anterior)
+    nuevos = [f for f in indice.fragmentos if f.texto not in {g.texto for g in anterior.fragmentos}]
+    assert len(nuevos) > MAX_CAMBIO_INCREMENTAL * len(indice.fragmentos)
+    completo = IndiceDocumento(otro)
+    assert indice.vectorizador is not anterior.vectorizador
+    assert np.allclose(indice.vectorizador.idf_, completo.vectorizador.idf_)
+
+
+def test_contexto_respeta_el_maximo(versiones):
+    original, _ = versiones
+    indice = IndiceDocumento(original)
+    for maximo in (100, 1000, 5000):
+        assert len(indice.contexto("riesgos de seguridad", maximo)) <= maximo
+        assert len(indice.contexto_representativo(maximo)) <= maximo
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from provider_clients import ErrorProveedor
+from streaming_utils import fusionar_flujos
+
+
+async def flujo(partes, pausa=0.0):
+    for parte in partes:
+        await asyncio.sleep(pausa)
+        yield parte
+
+
+async def flujo_fallido():
+    yield "inicio"
+    raise ErrorProveedor("gemini", "El servicio gemini no respondió correctamente")
+
+
+def eventos(flujos, timeouts, usos=None):
+    async def recoger():
+        return [e async for e in fusionar_flujos(flujos, timeouts, usos)]
+
+    resultado = []
+    for bloque in asyncio.run(recoger()):
+        cabecera, datos = bloque.strip().split("\n")
+        resultado.append((cabecera[len("event: "):], json.loads(datos[len("data: "):])))
+    return resultado
+
+
+def test_fusiona_los_tokens_de_cada_proveedor():
+    recibidos = eventos(
+        {"azure": flujo(["Hola", " mundo"], 0.01), "gemini": flujo(["Buenas"], 0.005)},
+        {"azure": 5, "gemini": 5},
+        {"azure": {"total_tokens": 7}}
+    )
+    assert recibidos[-1] == ("end", {})
+    hechos = {d["provider"]: d for e, d in recibidos if e == "done"}
+    assert hechos["azure"]["response"] == "Hola mundo" and hechos["azure"]["usage"] == {"total_tokens": 7}
+    assert hechos["gemini"]["response"] == "Buenas" and hechos["gemini"]["usage"] is None
+    for proveedor in ("azure", "gemini"):
+        propios = [e for e, d in recibidos if d.get("provider") == proveedor]
+        assert propios[0] == "first_token" and propios[-1] == "done"
+        tokens = "".join(d["text"] for e, d in recibidos if e == "token" and d["provider"] == proveedor)
+        assert tokens == hechos[proveedor]["response"]
+
+
+def test_un_proveedor_lento_no_bloquea_al_otro():
+    recibidos = eventos({"azure": flujo(["tarde"], 1.0), "gemini": flujo(["ya"])}, {"azure": 0.1, "gemini": 5})
+    assert ("done", "gemini") in [(e, d.get("provider")) for e, d in recibidos]
+    errores = [d for e, d in recibidos if e == "error"]
+    assert errores == [{"provider": "azure", "detail": "Tiempo de espera agotado (0.1s)"}]
+    assert recibidos[-1][0] == "end"
+
+
+def test_error_del_proveedor_se_emite_como_evento():
+    recibidos = eventos({"azure": flujo(["ok"]), "gemini": flujo_fallido()}, {"azure": 5, "gemini": 5})
+    errores = [d for e, d in recibidos if e == "error"]
+    assert errores == [{"provider": "gemini", "detail": "El servicio gemini no respondió correctamente"}]
+    assert [d["response"] for e, d in recibidos if e == "done"] == ["ok"]
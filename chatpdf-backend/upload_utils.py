@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+TAMANO_BLOQUE = 1024 * 1024
+# Margen para las cabeceras y separadores multipart al comparar con Content-Length
+MARGEN_MULTIPART = 1024 * 1024
+
+
+def error_tamano(max_mb: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"El archivo excede el tamaño máximo de {max_mb}MB"
+    )
+
+
+async def recibir_pdf(file: UploadFile, max_mb: int, directorio: str = None):
+    """
+    Copia la subida por bloques a un archivo temporal único, calculando el SHA-256
+    y cortando en cuanto supera el límite. Devuelve (ruta, sha256); el llamador borra la ruta.
+    """
+    limite = max_mb * 1024 * 1024
+    sha256 = hashlib.sha256()
+    recibidos = 0
+    destino = tempfile.NamedTemporaryFile(prefix="chatpdf_", suffix=".pdf", dir=directorio, delete=False)
+    try:
+        with destino:
+            while bloque := await file.read(TAMANO_BLOQUE):
+                if recibidos == 0 and not bloque.startswith(b"%PDF-"):
+                    raise HTTPException(status_code=400, detail="El archivo no es un PDF válido")
+                recibidos += len(bloque)
+                if recibidos > limite:
+                    raise error_tamano(max_mb)
+                sha256.update(bloque)
+                await run_in_threadpool(destino.write, bloque)
+    except BaseException:
+        os.unlink(destino.name)
+        raise
+    return destino.name, sha256.hexdigest()
+
+
+class MiddlewareLimiteSubida:
+    """
+    Rechaza con 413 las subidas cuyo Content-Length supera el límite antes de leer
+    el cuerpo (FastAPI parsea el formulario completo antes de llamar al endpoint).
+    """
+
+    def __init__(self, app, rutas: tuple, max_mb: int):
+        self.app = app
+        self.rutas = rutas
+        self.max_mb = max_mb
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.rutas:
+            cabeceras = dict(scope["headers"])
+            declarado = cabeceras.get(b"content-length", b"")
+            if declarado.isdigit() and int(declarado) > self.max_mb * 1024 * 1024 + MARGEN_MULTIPART:
+                cuerpo = json.dumps({"detail": error_tamano(self.max_mb).detail}).encode("utf-8")
+                await send({
+                    "type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(cuerpo)).encode()),
+                                (b"connection", b"close")]
+                })
+                await send({"type": "http.response.body", "body": cuerpo})
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from typing import Optional
+
+from ai_utils import MENSAJE_ERROR_CASO_DE_USO
+from prompt_budget import ContextoDocumento
+from retrieval_utils import IndiceDocumento, huella_fragmento
+
+CLAVE_POOL = "casos_de_uso"
+CLAVE_GENERADOS = "casos_de_uso_generados"
+
+
+class PoolCasosDeUso:
+    """
+    Casos de uso pre-generados por documento, guardados en el almacén de documentos.
+    Se llenan en segundo plano al subir el PDF y se reponen cuando quedan pocos.
+    Cada caso recuerda las huellas de los fragmentos de los que partió, para conservarlo
+    en una nueva versión del documento si ninguno de ellos cambió.
+    """
+
+    def __init__(self, documentos, indices, planificador, ai, tamano: int, minimo: int, max_caracteres: int,
+                 max_documento: int):
+        self.documentos = documentos
+        self.indices = indices
+        self.planificador = planificador
+        self.ai = ai
+        self.tamano = tamano
+        self.minimo = minimo
+        self.max_caracteres = max_caracteres
+        self.max_documento = max_documento
+        self._tareas = {}
+
+    @property
+    def activo(self) -> bool:
+        return self.tamano > 0
+
+    def disponibles(self, doc_id: str) -> int:
+        return len(self.documentos.obtener_artefacto(doc_id, CLAVE_POOL, []))
+
+    def tomar(self, doc_id: str) -> Optional[str]:
+        """Entrega el siguiente caso del pool (cada caso se entrega una sola vez, aun entre workers)"""
+        caso = self.documentos.actualizar_artefacto(
+            doc_id, CLAVE_POOL, lambda pool: (pool[1:], pool[0] if pool else None), []
+        )
+        return caso["caso"] if isinstance(caso, dict) else caso
+
+    def heredar(self, anterior_id: str, doc_id: str, indice: IndiceDocumento) -> int:
+        """
+        Copia a la nueva versión los casos cuyos fragmentos de origen siguen intactos en ella
+        (los de antes de registrar fragmentos se descartan); devuelve cuántos se conservaron.
+        """
+        vigentes = {huella_fragmento(f.texto) for f in indice.fragmentos}
+        pool = [
+            caso for caso in self.documentos.obtener_artefacto(anterior_id, CLAVE_POOL, [])
+            if isinstance(caso, dict) and set(caso["fragmentos"]) <= vigentes
+        ]
+        if pool:
+            self.documentos.guardar_artefacto(doc_id, CLAVE_POOL, pool)
+            self.documentos.guardar_artefacto(
+                doc_id, CLAVE_GENERADOS, self.documentos.obtener_artefacto(anterior_id, CLAVE_GENERADOS, 0)
+            )
+        return len(pool)
+
+    def programar_relleno(self, doc_id: str, texto: str):
+        """Lanza el llenado en segundo plano si el pool está por debajo del mínimo"""
+        if not self.activo or doc_id in self._tareas:
+            return
+        if self.disponibles(doc_id) > self.minimo:
+            return
+        tarea = asyncio.create_task(self._rellenar(doc_id, texto))
+        self._tareas[doc_id] = tarea
+        tarea.add_done_callback(lambda _: self._tareas.pop(doc_id, None))
+
+    async def _rellenar(self, doc_id: str, texto: str):
+        indice = self.indices.obtener(doc_id, texto)
+        while self.disponibles(doc_id) < self.tamano:
+            # Cada caso parte del bloque fijo del documento y de una muestra distinta del resto
+            # El contador se reserva de forma atómica: otro worker usará la muestra siguiente
+            generados = self.documentos.actualizar_artefacto(
+                doc_id, CLAVE_GENERADOS, lambda n: (n + 1, n), 0
+            )
+            bloque = indice.seleccion_representativa(self.max_documento)
+            muestra = indice.seleccion_representativa(self.max_caracteres, generados, excluir=bloque)
+            contexto = ContextoDocumento(
+                indice.contexto_representativo(self.max_documento),
+                indice.contexto_representativo(self.max_caracteres, generados, excluir=bloque)
+            )
+            fragmentos = bloque + muestra
+
+            try:
+                caso = await self.planificador.ejecutar("azure", self.ai.generar_caso_de_uso, contexto, False)
+            except Exception as e:
+                logging.warning(f"⚠️ Se detuvo el llenado del pool de casos de uso de {doc_id}: {e}")
+                return
+            if not caso or caso == MENSAJE_ERROR_CASO_DE_USO:
+                logging.warning(f"⚠️ No se pudo pre-generar un caso de uso para {doc_id}")
+                return
+
+            nuevo = {"caso": caso, "fragmentos": sorted({huella_fragmento(f.texto) for f in fragmentos})}
+            self.documentos.actualizar_artefacto(doc_id, CLAVE_POOL, lambda pool: (pool + [nuevo], None), [])
@@ -5,9 +5,12 @@ import logo from './logo.png';
 function App() {
   // Estados para carga de PDF
   const [file, setFile] = useState(null);
-  const [pdfText, setPdfText] = useState('');
+  const [docId, setDocId] = useState('');
+  const [docPreview, setDocPreview] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState(null);
+  const [ocrProgress, setOcrProgress] = useState(null);
+  const [esNuevaVersion, setEsNuevaVersion] = useState(false);
   
   // Estados para generación de caso de uso y solución
   const [useCase, setUseCase] = useState('');
@@ -21,6 +24,10 @@ function App() {
   const [showComparison, setShowComparison] = useState(false);
   const [combinedResponse, setCombinedResponse] = useState('');
   const [showDownloadButton, setShowDownloadButton] = useState(false);
+
+  // Sesión de análisis en el servidor y resultados de sus etapas
+  const [sessionId, setSessionId] = useState('');
+  const [etapasSesion, setEtapasSesion] = useState({});
   const BASE_URL = "https://f653-201-183-101-131.ngrok-free.app";
 
   //Estados de las comparaciones
@@ -39,11 +46,55 @@ function App() {
     return "Muy poca coincidencia";
   };
 
+  // Lee un flujo Server-Sent Events de una respuesta fetch
+  const leerEventosSSE = async (response, onEvento) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let separador;
+      while ((separador = buffer.indexOf('\n\n')) !== -1) {
+        const bloque = buffer.slice(0, separador);
+        buffer = buffer.slice(separador + 2);
+
+        let evento = 'message';
+        let datos = '';
+        bloque.split('\n').forEach((linea) => {
+          if (linea.startsWith('event: ')) evento = linea.slice(7);
+          else if (linea.startsWith('data: ')) datos += linea.slice(6);
+        });
+        onEvento(evento, datos ? JSON.parse(datos) : {});
+      }
+    }
+  };
+
   const handleFileChange = (e) => {
     setFile(e.target.files[0]);
     setError(null);
   };
 
+  // PDF escaneado: el servidor hace OCR en segundo plano; se consulta hasta tener el doc_id
+  const esperarOCR = async (jobId) => {
+    while (true) {
+      const response = await fetch(`${BASE_URL}/ocr_jobs/${jobId}`);
+      const trabajo = await response.json();
+      if (!response.ok) {
+        throw new Error(trabajo.detail || "Error al consultar el OCR");
+      }
+      if (trabajo.status === 'completed') return trabajo;
+      if (trabajo.status === 'failed') {
+        throw new Error(trabajo.error || "No se pudo reconocer el texto del PDF escaneado");
+      }
+      setOcrProgress({ processed: trabajo.processed, total: trabajo.ocr_pages });
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     setIsLoading(true);
@@ -58,6 +109,9 @@ function App() {
     try {
       const formData = new FormData();
       formData.append('file', file);
+      // Solo si el usuario indica que es otra versión del documento actual, el servidor
+      // compara con él y reprocesa únicamente las páginas que cambiaron
+      if (docId && esNuevaVersion) formData.append('previous_doc_id', docId);
 
       const response = await fetch(`${BASE_URL}/upload_pdf/`, {
         method: 'POST',
@@ -70,12 +124,18 @@ function App() {
         throw new Error(data.detail || "Error al procesar el PDF");
       }
 
-      setPdfText(data.text);
+      // 202: sin capa de texto, el documento llega cuando termina el OCR. El servidor no
+      // devuelve el texto completo (se trabaja por doc_id), solo una vista previa
+      const documento = response.status === 202 ? await esperarOCR(data.ocr_job_id) : data;
+      setDocId(documento.doc_id);
+      setDocPreview(documento.preview || '');
+      setEsNuevaVersion(false);
       setActiveStep('useCase');
     } catch (error) {
       setError(error.message);
       console.error("Error:", error);
     } finally {
+      setOcrProgress(null);
       setIsLoading(false);
     }
   };
@@ -91,7 +151,7 @@ function App() {
           'Content-Type': 'application/x-www-form-urlencoded',
         },
         body: new URLSearchParams({
-          pdf_text: pdfText,
+          doc_id: docId,
           generate_automatically: autoGenerate
         })
       });
@@ -127,42 +187,55 @@ function App() {
     setComparisonLoading(true);
     setError(null);
     setShowComparison(false); // Asegurar que no se muestre comparación inicialmente
+    setCombinedResponse('');
+    setShowDownloadButton(false);
   
     try {
-      // Solo obtener respuestas (parte rápida)
-      const [azureRes, geminiRes] = await Promise.all([
-        fetch(`${BASE_URL}/solve_case/`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/x-www-form-urlencoded',
-          },
-          body: new URLSearchParams({
-            pdf_text: pdfText,
-            scenario: useCase
-          })
-        }),
-        fetch(`${BASE_URL}/solve_case_gemini/`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/x-www-form-urlencoded',
-          },
-          body: new URLSearchParams({
-            pdf_text: pdfText,
-            escenario: useCase
-          })
+      // Una sola sesión en el servidor: soluciones, comparaciones, evaluación y combinación
+      // se calculan en paralelo y llegan por un único flujo SSE, etapa por etapa
+      const response = await fetch(`${BASE_URL}/sessions`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/x-www-form-urlencoded',
+        },
+        body: new URLSearchParams({
+          doc_id: docId,
+          scenario: useCase,
+          user_response: userSolution
         })
-      ]);
-  
-      const azureData = await azureRes.json();
-      const geminiData = await geminiRes.json();
-  
-      if (!azureRes.ok || !geminiRes.ok) {
-        throw new Error(azureData.detail || geminiData.detail || "Error al generar respuestas");
+      });
+
+      if (!response.ok) {
+        const data = await response.json();
+        throw new Error(data.detail || "Error al generar respuestas");
       }
-  
-      setAzureResponse(azureData.ai_response);
-      setGeminiResponse(geminiData.gemini_response);
+
+      setAzureResponse('');
+      setGeminiResponse('');
+      setEtapasSesion({});
       setActiveStep('comparison');
+
+      const setters = { azure: setAzureResponse, gemini: setGeminiResponse };
+      const errores = [];
+      await leerEventosSSE(response, (evento, datos) => {
+        if (evento === 'session') {
+          setSessionId(datos.session_id);
+        } else if (evento === 'token') {
+          setters[datos.provider]((prev) => prev + datos.text);
+        } else if (evento === 'stage') {
+          if (datos.status === 'completed') {
+            setEtapasSesion((prev) => ({ ...prev, [datos.stage]: datos.result }));
+            if (datos.stage === 'solve_azure') setAzureResponse(datos.result.ai_response);
+            if (datos.stage === 'solve_gemini') setGeminiResponse(datos.result.ai_response);
+          } else if (datos.status === 'failed') {
+            errores.push(`${datos.stage}: ${datos.error}`);
+          }
+        }
+      });
+
+      if (errores.length) {
+        throw new Error(errores.join(' | '));
+      }
   
     } catch (error) {
       setError(error.message);
@@ -171,97 +244,34 @@ function App() {
     }
   };
   
-  // Añade esta NUEVA función justo después:
-  const handleCompareSolutions = async () => {
-    setComparisonLoading(true);
-    try {
-      const [azureCompare, geminiCompare, qualitativeEval] = await Promise.all([
-        fetch(`${BASE_URL}/compare_responses/`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/x-www-form-urlencoded',
-          },
-          body: new URLSearchParams({
-            ai_response: azureResponse,
-            user_response: userSolution
-          })
-        }),
-        fetch(`${BASE_URL}/compare_gemini_response/`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/x-www-form-urlencoded',
-          },
-          body: new URLSearchParams({
-            gemini_response: geminiResponse,
-            user_response: userSolution
-          })
-        }),
-        fetch(`${BASE_URL}/evaluate_three_responses/`, {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/x-www-form-urlencoded',
-          },
-          body: new URLSearchParams({
-            pdf_text: pdfText,
-            question: useCase,
-            azure_response: azureResponse,
-            gemini_response: geminiResponse,
-            user_response: userSolution
-          })
-        })
-      ]);
-  
-      const azureCompareData = await azureCompare.json();
-      const geminiCompareData = await geminiCompare.json();
-      const qualitativeData = await qualitativeEval.json();
-  
-      setSimilarityScores({
-        azure: azureCompareData.similarity,
-        gemini: geminiCompareData.similarity,
-        qualitative: qualitativeData
-      });
-  
-      setShowComparison(true);
-    } catch (error) {
-      setError(error.message);
-    } finally {
-      setComparisonLoading(false);
+  // Las comparaciones ya se calcularon en la sesión: solo se muestran
+  const handleCompareSolutions = () => {
+    const { compare_azure, compare_gemini, evaluate } = etapasSesion;
+    if (!compare_azure || !compare_gemini || !evaluate) {
+      setError("La comparación no está disponible para esta sesión");
+      return;
     }
+    setSimilarityScores({
+      azure: compare_azure.similarity,
+      gemini: compare_gemini.similarity,
+      qualitative: evaluate
+    });
+    setShowComparison(true);
   };
 
-  const handleCombineResponses = async () => {
-    try {
-      const response = await fetch(`${BASE_URL}/combine_responses/`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-        body: new URLSearchParams({
-          pdf_text: pdfText,
-          azure_response: azureResponse,
-          gemini_response: geminiResponse,
-          user_response: userSolution
-        })
-      });
-      const data = await response.json();
-      setCombinedResponse(data.combined_solution);
-      setShowDownloadButton(true); // <- Activa el botón de descarga
-    } catch (error) {
+  const handleCombineResponses = () => {
+    if (!etapasSesion.combine) {
       setError("Error al combinar respuestas");
+      return;
     }
+    setCombinedResponse(etapasSesion.combine.combined_solution);
+    setShowDownloadButton(true); // <- Activa el botón de descarga
   };
 
   const generarPDF = async () => {
     try {
-      const formData = new FormData();
-      formData.append('caso_uso', useCase);
-      formData.append('respuesta_usuario', userSolution);
-      formData.append('respuesta_azure', azureResponse);
-      formData.append('respuesta_gemini', geminiResponse);
-      formData.append('respuesta_combinada', combinedResponse);
-  
-      const response = await fetch(`${BASE_URL}/descargar-reporte/`, {
-        method: 'POST',
-        body: formData  // ¡Importante! No incluir headers 'Content-Type'
-      });
+      // El servidor arma el reporte con los resultados guardados de la sesión
+      const response = await fetch(`${BASE_URL}/sessions/${sessionId}/report`);
   
       if (response.ok) {
         const blob = await response.blob();
@@ -313,12 +323,24 @@ function App() {
                 className="file-input"
                 required
               />
+              {docId && (
+                <label className="version-checkbox">
+                  <input
+                    type="checkbox"
+                    checked={esNuevaVersion}
+                    onChange={(e) => setEsNuevaVersion(e.target.checked)}
+                  />
+                  Es una nueva versión del documento actual (solo se procesan los cambios)
+                </label>
+              )}
               <button 
                 type="submit" 
                 className="submit-button" 
                 disabled={isLoading}
               >
-                {isLoading ? 'Procesando...' : 'Subir PDF'}
+                {ocrProgress
+                  ? `Reconociendo texto (OCR): ${ocrProgress.processed}/${ocrProgress.total} páginas...`
+                  : isLoading ? 'Procesando...' : 'Subir PDF'}
               </button>
             </form>
           </section>
@@ -329,6 +351,12 @@ function App() {
           <section className="use-case-section">
             <h2>Generar caso de uso</h2>
             {error && <div className="error-message">{error}</div>}
+            {docPreview && (
+              <details className="document-preview">
+                <summary>Vista previa del documento</summary>
+                <p>{docPreview}...</p>
+              </details>
+            )}
             
             <div className="use-case-options">
               <button 